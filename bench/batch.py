@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Compares the batch endpoint (@see src/batch.py) with the per item endpoints:
+creating, editing and deleting n items one request at a time, and the same
+in three batch requests. Reports wall time and SQL statements per phase,
+then checks that strings too long for their column are rejected per
+operation.
+
+Run from the project root:
+    python3 bench/batch.py [items]
+
+Exits with status 1 if the check fails.
+"""
+import sys
+import time
+
+from common import webserver, seed, signed_in_client, csrf_token, \
+    statement_log, check, failures
+from models import Item
+
+
+def new_ids(user_id, prefix):
+    db_session = webserver.DBSession()
+    try:
+        return [row[0] for row in db_session.query(Item.id).filter(
+            Item.user_id == user_id, Item.name.like(prefix + '%')).order_by(
+            Item.id)]
+    finally:
+        webserver.DBSession.remove()
+
+
+def per_item(client, state, user_id, catalog_id, count):
+    """
+    :return: the create, update and delete phases, one request per item.
+    """
+    def create():
+        for n in range(count):
+            client.post('/items/', data={
+                'state': state, 'name': 'single %d' % n,
+                'description': 'one at a time', 'catalog_id': catalog_id})
+
+    def update():
+        for item_id in new_ids(user_id, 'single'):
+            response = client.put('/items/%d/' % item_id, data={
+                'state': state, 'name': 'single edited',
+                'description': 'edited', 'catalog_id': catalog_id})
+            assert response.status_code == 200, response.status_code
+
+    def delete():
+        for item_id in new_ids(user_id, 'single'):
+            response = client.delete('/items/%d/' % item_id,
+                                     data={'state': state})
+            assert response.status_code == 200, response.status_code
+
+    return [('create', create), ('update', update), ('delete', delete)]
+
+
+def batched(client, state, user_id, catalog_id, count):
+    """
+    :return: the same phases, one batch request each.
+    """
+    def send(operations):
+        response = client.post('/batch/JSON/', json={
+            'state': state, 'operations': operations})
+        assert response.status_code == 200, response.get_json()
+
+    def create():
+        send([{'op': 'create', 'type': 'item', 'name': 'batched %d' % n,
+               'description': 'all at once', 'catalog_id': catalog_id}
+              for n in range(count)])
+
+    def update():
+        send([{'op': 'update', 'type': 'item', 'id': item_id,
+               'name': 'batched edited', 'description': 'edited'}
+              for item_id in new_ids(user_id, 'batched')])
+
+    def delete():
+        send([{'op': 'delete', 'type': 'item', 'id': item_id}
+              for item_id in new_ids(user_id, 'batched')])
+
+    return [('create', create), ('update', update), ('delete', delete)]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    user_id, catalog_ids, _ = seed()
+    client = signed_in_client(user_id)
+    state = csrf_token(user_id)
+    statements = statement_log()
+
+    for name, phases in (('per item', per_item), ('batch', batched)):
+        for phase, run in phases(client, state, user_id, catalog_ids[0],
+                                 count):
+            del statements[:]
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            print("{:<9} {:<7} n={} {:>8.1f}ms  statements={}".format(
+                name, phase, count, elapsed * 1000, len(statements)))
+
+    item = {'op': 'create', 'type': 'item', 'catalog_id': catalog_ids[0]}
+    operations = [dict(item, name='fits', description='d' * 250),
+                  dict(item, name='n' * 81),
+                  dict(item, name='fits', description='d' * 251),
+                  {'op': 'create', 'type': 'catalog', 'name': 'c' * 251}]
+    response = client.post('/batch/JSON/', json={'state': state,
+                                                 'operations': operations})
+    errors = [result.get('error') for result in response.get_json()['results']]
+    check("over-long strings fail their operation, not the batch",
+          response.status_code == 400 and
+          errors == [None, 'invalid', 'invalid', 'invalid'])
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+Compares read latency of the cached pages with caching enabled (the
+in-process LRU) and disabled.
+
+Run from the project root:
+    python3 bench/cache_reads.py [repeat]
+"""
+import sys
+
+from common import webserver, seed, percentile, timed
+from cache import make_cache
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    user_id, catalog_ids, item_ids = seed(catalogs=20, items_per_catalog=200)
+    client = webserver.app.test_client()
+    urls = ['/', '/catalogs/', '/catalogs/%d/' % catalog_ids[0],
+            '/items/%d/' % item_ids[0]]
+
+    for backend in ('null', 'memory'):
+        webserver.cache = make_cache(backend)
+        for url in urls:
+            client.get(url)
+            samples = timed(lambda: client.get(url), repeat)
+            print("{:<8} {:<16} p50={:.2f}ms p99={:.2f}ms".format(
+                backend, url, percentile(samples, 50),
+                percentile(samples, 99)))
+        print("{:<8} {}".format(backend, webserver.cache.stats()))
+
+
+if __name__ == '__main__':
+    main()
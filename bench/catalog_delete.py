@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Deletes catalogs of n items three ways and reports time, SQL statements and
+peak Python memory of each:
+- the ORM cascade the app used before, loading every item and deleting them
+  one by one;
+- DELETE /catalogs/<id>/, two set based DELETEs in one transaction (run
+  inline: ASYNC_DELETE_MIN_ITEMS is raised above n, so no job is queued);
+- bulk.delete_catalog, in chunks (@see "flask katalog delete-catalog").
+
+Run from the project root:
+    python3 bench/catalog_delete.py [items] [chunk size]
+"""
+from sqlalchemy import func
+
+import sys
+import time
+import tracemalloc
+
+from common import webserver, get_engine, signed_in_client, csrf_token, \
+    statement_log, EMAIL
+from bulk import import_records, delete_catalog
+from models import User, Catalog, Item
+
+
+def make_catalog(name, count):
+    import_records(get_engine(), ({'name': 'item %d' % n,
+                                   'description': 'to be deleted',
+                                   'catalog': name, 'by': EMAIL}
+                                  for n in range(count)), batch_size=5000)
+    db_session = webserver.DBSession()
+    try:
+        return db_session.query(Catalog.id).filter_by(name=name).scalar()
+    finally:
+        webserver.DBSession.remove()
+
+
+def orm_cascade(catalog_id):
+    db_session = webserver.DBSession()
+    catalog = db_session.query(Catalog).get(catalog_id)
+    list(catalog.items)
+    db_session.delete(catalog)
+    db_session.commit()
+    webserver.DBSession.remove()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    chunk_size = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    catalogs = {name: make_catalog(name, count)
+                for name in ('orm', 'endpoint', 'chunked')}
+    db_session = webserver.DBSession()
+    user_id = db_session.query(User.id).filter_by(email=EMAIL).scalar()
+    webserver.DBSession.remove()
+    webserver.app.config['ASYNC_DELETE_MIN_ITEMS'] = count + 1
+    client = signed_in_client(user_id)
+    state = csrf_token(user_id)
+
+    def endpoint(catalog_id):
+        response = client.delete('/catalogs/%d/' % catalog_id,
+                                 data={'state': state})
+        assert response.status_code == 200, response.status_code
+
+    statements = statement_log()
+    runs = [('orm', orm_cascade), ('endpoint', endpoint),
+            ('chunked', lambda catalog_id: delete_catalog(
+                get_engine(), catalog_id, chunk_size))]
+    for name, run in runs:
+        del statements[:]
+        tracemalloc.start()
+        start = time.perf_counter()
+        run(catalogs[name])
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print("{:<9} n={} {:>9.1f}ms  statements={:<6} peak={:.1f} MB".format(
+            name, count, elapsed * 1000, len(statements), peak / 1e6))
+
+    db_session = webserver.DBSession()
+    left = db_session.query(func.count(Item.id)).scalar()
+    print("items left: {}".format(left))
+    sys.exit(1 if left else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""
+Shared setup for the benchmarks: puts src/ on the path, points DATABASE_URL
+at a throwaway SQLite file unless one is given, and seeds data.
+"""
+from sqlalchemy import event
+
+import os
+import sys
+import tempfile
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+# The directory the benchmark was started from, for resolving its arguments.
+CWD = os.getcwd()
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(
+    tempfile.mkdtemp(), 'bench.db'))
+os.chdir(SRC)
+sys.path.insert(0, SRC)
+
+import webserver  # noqa: E402
+import migrations  # noqa: E402
+from database import get_engine  # noqa: E402
+from models import User, Catalog, Item  # noqa: E402
+import csrf  # noqa: E402
+
+migrations.migrate(get_engine())
+
+EMAIL = 'bench@example.com'
+
+
+def seed(catalogs=1, items_per_catalog=10):
+    """
+    Creates one user owning the given number of catalogs and items.
+
+    :return: a (user_id, catalog_ids, item_ids) tuple.
+    """
+    db_session = webserver.DBSession()
+    user = User(email=EMAIL)
+    db_session.add(user)
+    db_session.flush()
+    catalog_ids, item_ids = [], []
+    for c in range(catalogs):
+        catalog = Catalog(name='catalog %d' % c, user_id=user.id)
+        db_session.add(catalog)
+        db_session.flush()
+        catalog_ids.append(catalog.id)
+        items = [Item(name='item %d' % i, description='bench item',
+                      catalog_id=catalog.id, user_id=user.id)
+                 for i in range(items_per_catalog)]
+        db_session.add_all(items)
+        db_session.flush()
+        item_ids.extend(i.id for i in items)
+    db_session.commit()
+    user_id = user.id
+    webserver.DBSession.remove()
+    return user_id, catalog_ids, item_ids
+
+
+def signed_in_client(user_id):
+    """
+    :return: a test client whose session is signed in as the seeded user.
+    """
+    client = webserver.app.test_client()
+    with client.session_transaction() as sess:
+        sess['idinfo'] = {'email': EMAIL}
+        sess['user_id'] = user_id
+    return client
+
+
+def csrf_token(user_id=None, nonce=None):
+    """
+    :return: a CSRF token, as a page would embed it for the user or for an
+    anonymous visitor whose session holds nonce as its csrf_nonce.
+    """
+    subject = 'anonymous:' + nonce if user_id is None else str(user_id)
+    return csrf.make_token(webserver.app.secret_key, subject)
+
+
+# The names of the checks that failed (@see check).
+failures = []
+
+
+def check(name, ok):
+    """
+    Prints the outcome of a check, remembering it in failures if it failed.
+    Check scripts exit with status 1 if any did.
+    """
+    print("{:<58} {}".format(name, 'ok' if ok else 'FAILED'))
+    if not ok:
+        failures.append(name)
+
+
+def statement_log():
+    """
+    :return: a list every SQL statement executed from now on is appended to.
+    Empty it between measurements.
+    """
+    statements = []
+    event.listen(get_engine(), 'before_cursor_execute',
+                 lambda *args: statements.append(args[2]))
+    return statements
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100.0))]
+
+
+def timed(function, repeat):
+    """
+    :return: the latencies, in milliseconds, of repeat calls to function.
+    """
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
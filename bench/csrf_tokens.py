@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Checks that CSRF tokens (@see src/csrf.py) are accepted only when valid, and
+that malformed ones are rejected with a 401 rather than an error.
+
+Run from the project root:
+    python3 bench/csrf_tokens.py
+
+Exits with status 1 if any check fails.
+"""
+import sys
+import time
+
+from common import webserver, seed, signed_in_client, csrf_token, \
+    check, failures
+import csrf
+
+
+def main():
+    user_id, catalog_ids, item_ids = seed()
+    client = signed_in_client(user_id)
+    now = int(time.time())
+    form = {'name': 'renamed', 'description': 'edited',
+            'catalog_id': catalog_ids[0]}
+
+    def put(state):
+        return client.put('/items/%d/' % item_ids[0],
+                          data=dict(form, state=state)).status_code
+
+    check("a valid token is accepted", put(csrf_token(user_id)) == 200)
+    check("another user's token is rejected",
+          put(csrf_token(user_id + 1)) == 401)
+    check("an expired token is rejected", not csrf.check_token(
+        csrf.make_token('key', '1', now=now - 100), 'key', '1', max_age=10))
+    anonymous = webserver.app.test_client()
+    anonymous.get('/login/')
+    with anonymous.session_transaction() as sess:
+        nonce = sess.get('csrf_nonce')
+    check("the login page gives anonymous visitors a nonce", nonce)
+
+    def login(visitor, state):
+        return visitor.post('/login/', data={'state': state,
+                                             'token': 'x'}).status_code
+
+    other = webserver.app.test_client()
+    check("another browser cannot replay an anonymous token",
+          login(other, csrf_token(nonce=nonce)) == 401)
+    check("a visitor without a nonce is rejected",
+          login(other, csrf_token(nonce='')) == 401)
+    with webserver.app.test_request_context('/login/', method='POST'):
+        webserver.session['csrf_nonce'] = nonce
+        check("the visitor's own token passes the CSRF check",
+              webserver.valid_state(csrf_token(nonce=nonce)))
+    for name, token in [('an empty token', ''),
+                        ('a token without parts', 'garbage'),
+                        ('a token with a bad time', 'x.y.z'),
+                        ('a token with too many parts', '1.2.3.4'),
+                        ('a non-ASCII signature', '{}.x.é'.format(now)),
+                        ('a non-ASCII nonce', '{}.é.x'.format(now))]:
+        check("{} is rejected with 401".format(name), put(token) == 401)
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
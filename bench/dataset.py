@@ -0,0 +1,56 @@
+"""
+Deterministic synthetic data at a configurable scale, loaded through the
+bulk importer (@see src/bulk.py), i.e. with COPY on PostgreSQL.
+
+At scale n there are n items, spread over n / 100 catalogs owned by n / 1000
+users (at least one of each). The same seed always produces the same rows.
+"""
+import random
+
+from common import EMAIL
+from bulk import import_records
+
+WORDS = ('lamp chair desk shelf camera lens tripod kettle mug plate bowl '
+         'guitar drum violin piano book atlas novel map globe bike helmet '
+         'tent stove lantern boot jacket scarf glove watch clock '
+         'radio').split()
+
+
+def scale_counts(items):
+    """
+    :return: the (users, catalogs, items) counts for a scale.
+    """
+    return max(1, items // 1000), max(1, items // 100), items
+
+
+def records(items, seed=0):
+    """
+    :param items: the number of items.
+    :param seed: the random seed.
+
+    :return: a generator of item records, in the format import_records reads.
+    The first user is common.EMAIL, so signed_in_client can act as an owner.
+    """
+    rng = random.Random(seed)
+    users, catalogs, _ = scale_counts(items)
+    for n in range(items):
+        catalog = n % catalogs
+        user = catalog % users
+        yield {
+            'name': ' '.join(rng.choice(WORDS) for _ in range(2)),
+            'description': ' '.join(rng.choice(WORDS) for _ in range(12)),
+            'catalog': 'catalog %d' % catalog,
+            'by': EMAIL if user == 0 else 'user%d@example.com' % user,
+        }
+
+
+def generate(engine, items, seed=0, batch_size=5000, report=None):
+    """
+    Loads a dataset of the given scale into an empty, migrated database.
+
+    :param report: called with the number of items loaded after each batch.
+
+    :return: the number of items loaded.
+    """
+    return import_records(engine, records(items, seed), 'items', batch_size,
+                          on_batch=report)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Hammers the item create, move and delete endpoints from several threads at
+once, then checks every catalog's item_count against a real COUNT(*).
+
+Run from the project root:
+    python3 bench/item_counts.py [threads] [operations per thread]
+
+Exits with status 1 if any counter is off. Point DATABASE_URL at PostgreSQL
+to exercise real row level concurrency; SQLite serializes the writers.
+"""
+from sqlalchemy import func
+
+import random
+import sys
+import threading
+
+from common import webserver, seed, signed_in_client, csrf_token
+from models import Catalog, Item
+
+
+def writer(user_id, catalog_ids, operations, seed_value, errors):
+    rng = random.Random(seed_value)
+    client = signed_in_client(user_id)
+    state = csrf_token(user_id)
+    # Items created by this thread; no other thread touches them.
+    mine = []
+    try:
+        for n in range(operations):
+            action = rng.random()
+            if not mine or action < 0.5:
+                client.post('/items/', data={
+                    'name': 'item %d.%d' % (seed_value, n),
+                    'description': 'counted', 'state': state,
+                    'catalog_id': rng.choice(catalog_ids)})
+                mine.append(newest_item(seed_value, n))
+                continue
+            item_id = rng.choice(mine)
+            if action < 0.8:
+                response = client.put('/items/%d/' % item_id, data={
+                    'state': state, 'name': 'moved', 'description': 'counted',
+                    'catalog_id': rng.choice(catalog_ids)})
+            else:
+                response = client.delete('/items/%d/' % item_id,
+                                         data={'state': state})
+                mine.remove(item_id)
+            assert response.status_code == 200, response.status_code
+    except Exception as error:
+        errors.append(error)
+
+
+def newest_item(seed_value, n):
+    db_session = webserver.DBSession()
+    try:
+        return db_session.query(Item.id).filter(
+            Item.name == 'item %d.%d' % (seed_value, n)).scalar()
+    finally:
+        webserver.DBSession.remove()
+
+
+def main():
+    threads = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    operations = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    user_id, catalog_ids, _ = seed(catalogs=4, items_per_catalog=25)
+
+    errors = []
+    workers = [threading.Thread(target=writer, args=(
+        user_id, catalog_ids, operations, t, errors)) for t in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    db_session = webserver.DBSession()
+    actual = dict(db_session.query(Item.catalog_id, func.count(Item.id))
+                  .group_by(Item.catalog_id))
+    wrong = 0
+    for catalog_id, item_count in db_session.query(Catalog.id,
+                                                   Catalog.item_count):
+        ok = item_count == actual.get(catalog_id, 0)
+        wrong += not ok
+        print("catalog {:<4} item_count={:<5} count(*)={:<5} {}".format(
+            catalog_id, item_count, actual.get(catalog_id, 0),
+            'ok' if ok else 'WRONG'))
+    for error in errors:
+        print("writer failed: {!r}".format(error))
+    sys.exit(1 if wrong or errors else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Exercises the background jobs (@see src/jobs.py) locally, with a worker on
+threads of this process:
+- a large catalog deleted through DELETE /catalogs/<id>/ is answered with
+  202 and a status URL, and is gone once the job is done, also from the
+  owner index of a web worker sharing the cache;
+- jobs that fail are retried until they succeed or run out of attempts;
+- a kind limited to 2 concurrent runs never has more running at once;
+- a burst worker stops although a job of a kind it does not handle waits;
+- a job whose worker went silent is taken over, and the old worker can no
+  longer record progress or an outcome for it, while progress keeps a job
+  from being taken over;
+- a job that loses its worker on every attempt fails for good;
+- an import job refreshes the cached pages of the catalogs it imported into;
+- the request itself stays fast however large the catalog.
+
+Run from the project root:
+    python3 bench/jobs.py [items]
+
+Exits with status 1 if any check fails.
+"""
+from sqlalchemy import func
+
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from common import webserver, get_engine, signed_in_client, csrf_token, \
+    check, failures, EMAIL
+from bulk import import_records
+from models import User, Catalog, Item
+import jobs
+import owners
+
+
+attempts = {}
+running = {'now': 0, 'max': 0}
+lock = threading.Lock()
+
+
+@jobs.handler('flaky')
+def flaky(payload, progress):
+    """
+    Fails the first payload['failures'] attempts.
+    """
+    with lock:
+        attempts[payload['n']] = attempts.get(payload['n'], 0) + 1
+        if attempts[payload['n']] <= payload['failures']:
+            raise RuntimeError("attempt {}".format(attempts[payload['n']]))
+    return {'attempts': attempts[payload['n']]}
+
+
+@jobs.handler('limited', concurrency=2)
+def limited(payload, progress):
+    with lock:
+        running['now'] += 1
+        running['max'] = max(running['max'], running['now'])
+    time.sleep(0.05)
+    with lock:
+        running['now'] -= 1
+
+
+def queue(kind, payloads, max_attempts=3):
+    db_session = webserver.DBSession()
+    ids = [jobs.enqueue(db_session, kind, payload,
+                        max_attempts=max_attempts).id for payload in payloads]
+    db_session.commit()
+    webserver.DBSession.remove()
+    return ids
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    # The flaky jobs' failures are expected.
+    logging.getLogger('katalog.jobs').setLevel(logging.CRITICAL)
+    webserver.app.config['ASYNC_DELETE_MIN_ITEMS'] = 1000
+    import_records(get_engine(), ({'name': 'item %d' % n,
+                                   'description': 'queued for deletion',
+                                   'catalog': 'large', 'by': EMAIL}
+                                  for n in range(count)), batch_size=5000)
+    db_session = webserver.DBSession()
+    user_id = db_session.query(User.id).filter_by(email=EMAIL).scalar()
+    catalog_id = db_session.query(Catalog.id).filter_by(name='large').scalar()
+    item_id = db_session.query(Item.id).filter_by(
+        catalog_id=catalog_id).first()[0]
+    webserver.DBSession.remove()
+    client = signed_in_client(user_id)
+
+    start = time.perf_counter()
+    response = client.delete('/catalogs/%d/' % catalog_id,
+                             data={'state': csrf_token(user_id)})
+    elapsed = (time.perf_counter() - start) * 1000
+    check("DELETE of {} items answers 202 ({:.1f}ms)".format(count, elapsed),
+          response.status_code == 202)
+    status_url = response.get_json()['job']
+    check("the job is queued",
+          client.get(status_url).get_json()['job']['status'] == 'queued')
+    check("other users cannot see it", webserver.app.test_client().get(
+        status_url).status_code == 401)
+
+    # The owner index of another web worker, filled before the delete.
+    web = owners.OwnerIndex()
+    web.sync(webserver.cache.generation('owners'))
+    web.remember(Item, item_id, user_id)
+
+    # A cached catalog page, and a file of items for it to import.
+    import_records(get_engine(), [{'name': 'item before the import',
+                                   'description': 'imported directly',
+                                   'catalog': 'small', 'by': EMAIL}])
+    db_session = webserver.DBSession()
+    small_id = db_session.query(Catalog.id).filter_by(name='small').scalar()
+    webserver.DBSession.remove()
+    client.get('/catalogs/%d/' % small_id)
+    fd, path = tempfile.mkstemp(suffix='.ndjson')
+    with os.fdopen(fd, 'w') as stream:
+        stream.write('{"name": "item from the import job", "description": '
+                     '"imported by a job", "catalog": "small", "by": "%s"}\n'
+                     % EMAIL)
+    queue('import', [{'path': path, 'kind': 'items', 'format': 'ndjson',
+                      'batch_size': 100}])
+
+    queue('flaky', [{'n': 0, 'failures': 1}, {'n': 1, 'failures': 5}])
+    queue('limited', [{} for _ in range(10)])
+    manual_id, = queue('manual', [{}])
+
+    worker = jobs.Worker(get_engine(), threads=4, poll_interval=0.05,
+                         retry_delay=0.05)
+    start = time.perf_counter()
+    burst = threading.Thread(target=worker.run, args=(True,), daemon=True)
+    burst.start()
+    burst.join(60)
+    check("a burst worker ignores kinds it does not handle",
+          not burst.is_alive())
+    worker.stop()
+    print("worker ran {} attempts in {:.1f}s".format(
+        worker.processed, time.perf_counter() - start))
+
+    job = client.get(status_url).get_json()['job']
+    check("the delete job is done", job['status'] == 'done')
+    check("... and reported the items deleted",
+          job['result'] == {'items_deleted': count})
+    db_session = webserver.DBSession()
+    check("the catalog and its items are gone",
+          not db_session.query(Catalog).get(catalog_id) and
+          not db_session.query(func.count(Item.id)).filter(
+              Item.catalog_id == catalog_id).scalar())
+    web.sync(webserver.cache.generation('owners'))
+    check("... and other workers' owner indexes forget its items",
+          web.owner(Item, item_id) is None)
+    statuses = dict(db_session.query(jobs.Job.payload, jobs.Job.status)
+                    .filter(jobs.Job.kind == 'flaky'))
+    check("a job failing once succeeds on its second attempt",
+          attempts[0] == 2 and
+          statuses['{"n": 0, "failures": 1}'] == 'done')
+    check("a job failing every time fails after 3 attempts",
+          attempts[1] == 3 and
+          statuses['{"n": 1, "failures": 5}'] == 'failed')
+    check("at most 2 'limited' jobs ran at once (saw {})".format(
+        running['max']), running['max'] <= 2)
+    os.remove(path)
+    check("an import job refreshes the cached catalog pages",
+          b'item from the import job' in client.get(
+              '/catalogs/%d/' % small_id).data)
+    webserver.DBSession.remove()
+
+    engine = get_engine()
+    check("the unhandled job was left queued",
+          jobs.claim(engine, 'a', ['manual']) == (manual_id, 'manual', {}))
+    time.sleep(0.01)
+    check("a silent job is taken over after the timeout",
+          jobs.claim(engine, 'b', ['manual'], timeout=0) is not None)
+    try:
+        jobs.progress(engine, manual_id, 'a', {'step': 1})
+        lost = False
+    except jobs.Lost:
+        lost = True
+    check("... its old worker cannot report progress", lost)
+    check("... nor finish it",
+          jobs.finish(engine, manual_id, 'a', error='late') is None)
+    jobs.progress(engine, manual_id, 'b', {'step': 1})
+    check("progress keeps the job from being taken over",
+          jobs.claim(engine, 'c', ['manual'], timeout=1) is None)
+    check("the new worker finishes it",
+          jobs.finish(engine, manual_id, 'b', {'step': 2}) == 'done')
+
+    # A job that crashes its worker, e.g. out of memory, on every attempt.
+    crashing_id, = queue('crashing', [{}], max_attempts=2)
+    claimed = []
+    for worker_id in ('a', 'b'):
+        claimed.append(jobs.claim(engine, worker_id, ['crashing'], timeout=0))
+        time.sleep(0.01)
+    check("a job losing its worker is retried while attempts last",
+          all(claimed))
+    check("... but not once they are used up",
+          jobs.claim(engine, 'c', ['crashing'], timeout=0) is None)
+    db_session = webserver.DBSession()
+    job = db_session.query(jobs.Job).get(crashing_id)
+    check("... when it fails, with an error",
+          job.status == 'failed' and job.error is not None)
+    webserver.DBSession.remove()
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Compares encode time and bytes on the wire of a large JSON listing: Flask's
+pretty printed jsonify output, compact JSON from the json module and from
+orjson (if installed), each sent plain, gzipped and brotli compressed (if
+installed).
+
+Run from the project root:
+    python3 bench/json_encoding.py [items] [repeat]
+"""
+import json
+import sys
+import time
+
+from common import percentile
+import compression
+import serializers
+
+
+def payload(count):
+    return {'items': [{'name': 'item %d' % n,
+                       'description': 'A benchmark item, number %d of %d.' %
+                                      (n, count),
+                       'catalog': 'catalog %d' % (n % 100),
+                       'by': 'user%d@example.com' % (n % 1000)}
+                      for n in range(count)],
+            'next': 'bjoxMDAwMDA', 'prev': None}
+
+
+def timed(function, repeat):
+    samples, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        samples.append((time.perf_counter() - start) * 1000)
+    return percentile(samples, 50), result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    document = payload(count)
+    encoders = [
+        ('json indent=2', lambda: json.dumps(
+            document, indent=2, separators=(', ', ': ')).encode('utf-8')),
+        ('json compact', lambda: json.dumps(
+            document, separators=(',', ':')).encode('utf-8')),
+    ]
+    if serializers.orjson is not None:
+        encoders.append(('orjson', lambda: serializers.orjson.dumps(
+            document)))
+    for name, encode in encoders:
+        encode_ms, body = timed(encode, repeat)
+        print("{:<14} encode={:>7.1f}ms  plain={:>9} bytes".format(
+            name, encode_ms, len(body)))
+        for encoding in compression.encodings():
+            compress_ms, compressed = timed(
+                lambda: compression.compress(body, encoding), repeat)
+            print("{:<14} {:<6} compress={:>6.1f}ms  wire={:>9} bytes".format(
+                '', encoding, compress_ms, len(compressed)))
+    print("serializers.dumps uses {}".format(
+        'orjson' if serializers.orjson is not None else 'the json module'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Checks that the JSON endpoints issue the same number of SQL statements
+whatever the size of the database, i.e. that none of them loads rows one by
+one (N+1 queries). Each endpoint is requested once to warm up (e.g. the
+search index) and counted on the second request, at two dataset scales
+(@see dataset.py). The exports stream in batches, so they are left out.
+
+Run from the project root:
+    python3 bench/json_queries.py [small scale] [large scale]
+
+Exits with status 1 if any count differs.
+"""
+import sys
+
+from common import webserver, get_engine, statement_log
+from dataset import generate
+from models import Catalog, Item
+
+
+def endpoints():
+    db_session = webserver.DBSession()
+    catalog_id = db_session.query(Catalog.id).order_by(Catalog.id).first()[0]
+    item_id = db_session.query(Item.id).order_by(Item.id).first()[0]
+    webserver.DBSession.remove()
+    return ['/catalogs/JSON/', '/catalogs/%d/JSON/' % catalog_id,
+            '/items/JSON/', '/items/%d/JSON/' % item_id,
+            '/items/search/JSON/?q=lamp']
+
+
+def count(statements):
+    client = webserver.app.test_client()
+    counts = {}
+    for url in endpoints():
+        client.get(url)
+        del statements[:]
+        response = client.get(url)
+        assert response.status_code == 200, (url, response.status_code)
+        counts[url] = len(statements)
+    return counts
+
+
+def main():
+    small = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    large = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    statements = statement_log()
+    generate(get_engine(), small)
+    before = count(statements)
+    generate(get_engine(), large - small, seed=1)
+    after = count(statements)
+
+    failures = 0
+    for url in before:
+        same = before[url] == after[url]
+        failures += not same
+        print("{:<28} n={:<6} queries={:<3} n={:<6} queries={:<3} {}".format(
+            url, small, before[url], large, after[url],
+            'ok' if same else 'FAILED'))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
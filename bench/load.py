@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+A small closed-loop load generator: concurrency clients each send requests
+back to back over a kept-alive connection for the given duration. Give it
+one or more running servers to compare, e.g. the sync, gthread and ASGI
+modes:
+
+    GUNICORN_WORKER_CLASS=sync PORT=8000 \\
+        gunicorn -c gunicorn.conf.py --chdir src webserver:app
+    GUNICORN_WORKER_CLASS=gthread GUNICORN_THREADS=10 PORT=8001 \\
+        gunicorn -c gunicorn.conf.py --chdir src webserver:app
+    GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker PORT=8002 \\
+        gunicorn -c gunicorn.conf.py --chdir src asgi:app
+
+    python3 bench/load.py sync=http://127.0.0.1:8000 \\
+        gthread=http://127.0.0.1:8001 asgi=http://127.0.0.1:8002 \\
+        --concurrency 200 --duration 30
+
+--slow-clients makes that many extra clients trickle their requests out
+slowly, to show how each mode copes with clients that hold a connection.
+"""
+from urllib.parse import urlsplit
+
+import argparse
+import http.client
+import json
+import socket
+import threading
+import time
+
+PATHS = ['/', '/items/', '/catalogs/', '/items/JSON/']
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100.0))]
+
+
+def client(host, port, paths, deadline, latencies, errors):
+    connection = http.client.HTTPConnection(host, port, timeout=30)
+    n = 0
+    while time.time() < deadline:
+        path = paths[n % len(paths)]
+        n += 1
+        start = time.perf_counter()
+        try:
+            connection.request('GET', path)
+            response = connection.getresponse()
+            response.read()
+            if response.status >= 500:
+                errors.append(response.status)
+                continue
+        except (OSError, http.client.HTTPException) as error:
+            errors.append(type(error).__name__)
+            connection.close()
+            connection = http.client.HTTPConnection(host, port, timeout=30)
+            continue
+        latencies.append((time.perf_counter() - start) * 1000)
+    connection.close()
+
+
+def slow_client(host, port, deadline):
+    """
+    Sends a request one byte per second, then repeats.
+    """
+    while time.time() < deadline:
+        try:
+            sock = socket.create_connection((host, port), timeout=30)
+            for byte in 'GET / HTTP/1.1\r\nHost: {}\r\n\r\n'.format(host):
+                if time.time() >= deadline:
+                    break
+                sock.send(byte.encode())
+                time.sleep(1)
+            sock.close()
+        except OSError:
+            time.sleep(1)
+
+
+def run(url, concurrency, duration, slow, paths):
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    deadline = time.time() + duration
+    latencies, errors = [], []
+    threads = [threading.Thread(target=slow_client, args=(host, port,
+                                                          deadline))
+               for _ in range(slow)]
+    threads += [threading.Thread(target=client, args=(
+        host, port, paths, deadline, latencies, errors))
+        for _ in range(concurrency)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'rps': len(latencies) / float(duration),
+        'p50_ms': percentile(latencies, 50) if latencies else None,
+        'p99_ms': percentile(latencies, 99) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('targets', nargs='+', metavar='label=url')
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--duration', type=int, default=10)
+    parser.add_argument('--slow-clients', type=int, default=0)
+    parser.add_argument('--path', action='append', dest='paths',
+                        help="May be repeated, defaults to " + str(PATHS))
+    parser.add_argument('--json', action='store_true',
+                        help="Print the results as JSON.")
+    args = parser.parse_args()
+
+    results = {}
+    for target in args.targets:
+        label, _, url = target.rpartition('=')
+        label = label or url
+        results[label] = run(url, args.concurrency, args.duration,
+                             args.slow_clients, args.paths or PATHS)
+        if not args.json:
+            result = results[label]
+            print("{:<8} {:>8.1f} req/s  p50={}ms  p99={}ms  errors={}".format(
+                label, result['rps'],
+                '%.1f' % result['p50_ms'] if result['requests'] else '-',
+                '%.1f' % result['p99_ms'] if result['requests'] else '-',
+                result['errors']))
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Measures login latency against a local stand-in for Google's certificate
+endpoint, with tokens signed by a locally generated key, and counts how
+often the certificates are fetched.
+
+Run from the project root (requires the cryptography package):
+    python3 bench/login.py [logins] [max-age]
+"""
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from google.auth import crypt, jwt
+
+import json
+import sys
+import threading
+import time
+
+from common import webserver, percentile, timed, csrf_token
+
+KEY_ID = 'bench-key'
+CLIENT_ID = 'bench-client-id'
+
+
+def make_keys():
+    """
+    :return: a (signer, public key PEM) tuple.
+    """
+    key = rsa.generate_private_key(65537, 2048, default_backend())
+    private = key.private_bytes(serialization.Encoding.PEM,
+                                serialization.PrivateFormat.TraditionalOpenSSL,
+                                serialization.NoEncryption())
+    public = key.public_key().public_bytes(serialization.Encoding.PEM,
+                                           serialization.PublicFormat.PKCS1)
+    return crypt.RSASigner.from_string(private, KEY_ID), public.decode()
+
+
+def serve_certs(public, max_age):
+    """
+    Serves {KEY_ID: public} the way Google serves its certificates.
+
+    :return: the URL of the certificates.
+    """
+    body = json.dumps({KEY_ID: public}).encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Cache-Control',
+                             'public, max-age={}'.format(max_age))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return 'http://127.0.0.1:{}/certs'.format(server.server_port)
+
+
+def sign(signer, email):
+    now = int(time.time())
+    return jwt.encode(signer, {
+        'iss': 'https://accounts.google.com', 'aud': CLIENT_ID, 'sub': email,
+        'email': email, 'iat': now, 'exp': now + 3600}).decode()
+
+
+def main():
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    certs_max_age = int(sys.argv[2]) if len(sys.argv) > 2 else 3600
+    signer, public = make_keys()
+    webserver.create_app({'GOOGLE_CLIENT_ID': CLIENT_ID,
+                          'GOOGLE_CERTS_URL': serve_certs(public,
+                                                          certs_max_age)})
+    client = webserver.app.test_client()
+    tokens = [sign(signer, 'user%d@example.com' % (i % 20))
+              for i in range(logins)]
+
+    def login():
+        with client.session_transaction() as sess:
+            sess.clear()
+            sess['csrf_nonce'] = 'bench'
+        response = client.post('/login/', data={'state': csrf_token(
+                                                    nonce='bench'),
+                                                'token': tokens.pop()})
+        assert response.status_code == 200, response.status_code
+
+    samples = timed(login, logins)
+    print("POST /login/  n={} p50={:.2f}ms p99={:.2f}ms cert fetches={}"
+          .format(logins, percentile(samples, 50), percentile(samples, 99),
+                  webserver.cert_cache.fetches))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+Counts the SQL statements issued by typical authenticated mutations.
+
+Run from the project root:
+    python3 bench/mutation_queries.py
+
+DATABASE_URL defaults to a throwaway SQLite file so the benchmark can run
+without PostgreSQL.
+"""
+from common import seed, signed_in_client, csrf_token, statement_log
+
+
+def main():
+    user_id, catalog_ids, item_ids = seed()
+    statements = statement_log()
+    client = signed_in_client(user_id)
+    state = csrf_token(user_id)
+
+    cases = [
+        ('PUT /items/<id>/', 'put', '/items/%d/' % item_ids[0],
+         {'state': state, 'name': 'renamed', 'description': 'edited',
+          'catalog_id': catalog_ids[0]}),
+        ('DELETE /items/<id>/', 'delete', '/items/%d/' % item_ids[1],
+         {'state': state}),
+        ('PUT /catalogs/<id>/', 'put', '/catalogs/%d/' % catalog_ids[0],
+         {'state': state, 'name': 'renamed'}),
+        ('POST /items/', 'post', '/items/',
+         {'name': 'new', 'description': 'new item',
+          'catalog_id': catalog_ids[0]}),
+    ]
+    for name, method, url, data in cases:
+        del statements[:]
+        response = getattr(client, method)(url, data=data)
+        print("{:<24} status={} queries={}".format(
+            name, response.status_code, len(statements)))
+
+
+if __name__ == '__main__':
+    main()
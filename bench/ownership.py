@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Reports the memory the owner index (@see src/owners.py) needs per million
+items, next to an OrderedDict of the same entries, and the cost of a hot
+ownership check against the primary key lookup it replaces.
+
+Run from the project root:
+    python3 bench/ownership.py [entries] [repeat]
+"""
+from collections import OrderedDict
+
+import sys
+import tracemalloc
+
+from common import webserver, seed, percentile, timed, EMAIL
+from models import Item
+import owners
+
+
+def measure(build):
+    tracemalloc.start()
+    structure = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return structure, size
+
+
+def fill_index(entries):
+    index = owners.OwnerIndex(entries)
+    for item_id in range(1, entries + 1):
+        # Realistic owners: ids above the small int cache, shared by many
+        # items like real owners are.
+        index.remember(Item, item_id, 1000 + item_id // 1000)
+    return index
+
+
+def fill_ordered_dict(entries):
+    return OrderedDict((item_id, 1000 + item_id // 1000)
+                       for item_id in range(1, entries + 1))
+
+
+def main():
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    for name, build in (('owner index', fill_index),
+                        ('OrderedDict', fill_ordered_dict)):
+        structure, size = measure(lambda: build(entries))
+        print("{:<12} {} entries: {:.1f} MB, {:.0f} bytes per entry, "
+              "{:.1f} MB per million".format(
+                  name, entries, size / 1e6, float(size) / entries,
+                  size / 1e6 * 1000000 / entries))
+        del structure
+
+    user_id, _, item_ids = seed()
+    app = webserver.app
+    owners.index = owners.OwnerIndex(app.config['OWNER_INDEX_MAX_ENTRIES'])
+    with app.test_request_context():
+        webserver.session['idinfo'] = {'email': EMAIL}
+        webserver.session['user_id'] = user_id
+
+        def check(clear):
+            if clear:
+                owners.index.items.clear()
+            assert webserver.is_authorized_item(item_ids[0])
+            webserver.DBSession.remove()
+
+        for name, clear in (('cold (query)', True), ('hot (index)', False)):
+            samples = timed(lambda: check(clear), repeat)
+            print("is_authorized_item {:<13} p50={:.1f}us p99={:.1f}us".format(
+                name, percentile(samples, 50) * 1000,
+                percentile(samples, 99) * 1000))
+    print(owners.index.stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Compares rendering a listing of many item cards the original way (url_for
+per link, every card rendered every time) with the cached card fragments
+and url_path (@see item_card in webserver.py), cold and warm.
+
+Run from the project root:
+    python3 bench/render_cards.py [cards] [repeat]
+"""
+from flask import render_template_string
+
+import sys
+import time
+
+from common import webserver, percentile
+from cache import make_cache
+from serializers import CatalogView, ItemView, UserView
+
+ORIGINAL = """
+<div class="row">
+  {%for catalog, item, user in tuple%}
+  <div class="col-lg-4">
+    <div class="sp-blog-item small-card">
+      <div class="blog-thubm">
+        <div class="blog-date">
+          <span>May 04, 2018</span>
+        </div>
+      </div>
+      <div class="blog-text">
+        <h5>{{item.name}}</h5>
+        <span><a href="{{url_for('id_catalog', catalog_id=catalog.id)}}">
+          {{catalog.name}}</a></span>
+        <span>By {{user.email}}</span>
+        <p class="items-ellipsis">{{item.description}}</p>
+        <a href="{{url_for('id_item', item_id=item.id)}}" class="readmore"
+           title="Click to go to item"><i class="fa fa-angle-right"></i></a>
+      </div>
+    </div>
+  </div>
+  {%endfor%}
+</div>
+"""
+CACHED = "{% include 'items_generic.html' %}"
+
+
+def cards(count):
+    user = UserView(1, 'bench@example.com')
+    catalogs = [CatalogView(c, 'catalog %d' % c, 1, 1) for c in range(20)]
+    return [(catalogs[i % 20],
+             ItemView(i, 'item %d' % i, 'a <benchmark> item', i % 20, 1, 1),
+             user) for i in range(count)]
+
+
+def render(source, rows, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        render_template_string(source, tuple=rows)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    rows = cards(count)
+    with webserver.app.test_request_context('/items/'):
+        runs = [('url_for', ORIGINAL, repeat)]
+        webserver.fragments = make_cache('memory', 3600, count)
+        runs += [('cold cards', CACHED, 1), ('warm cards', CACHED, repeat)]
+        for label, source, times in runs:
+            samples = render(source, rows, times)
+            print("{:<11} {} cards p50={:.1f}ms max={:.1f}ms".format(
+                label, count, percentile(samples, 50), max(samples)))
+
+
+if __name__ == '__main__':
+    main()
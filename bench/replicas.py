@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Checks read replica routing (@see src/database.py) with a SQLite primary and
+two SQLite "replicas", copies of the primary taken before a write, so that a
+read served by a replica is recognisable by its stale data.
+
+Run from the project root:
+    python3 bench/replicas.py
+
+It checks that:
+- anonymous GETs go to the replicas, round-robin, and see the stale copy;
+- writes and authorization checks go to the primary;
+- right after a write the writer reads from the primary (read-your-writes),
+  and from the replicas again once REPLICA_STICKY_SECONDS have passed.
+
+Exits with status 1 if any check fails.
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+DIRECTORY = tempfile.mkdtemp()
+PRIMARY = os.path.join(DIRECTORY, 'primary.db')
+REPLICAS = [os.path.join(DIRECTORY, 'replica%d.db' % n) for n in (1, 2)]
+os.environ['DATABASE_URL'] = 'sqlite:///' + PRIMARY
+os.environ['READ_REPLICA_URLS'] = ','.join('sqlite:///' + path
+                                           for path in REPLICAS)
+
+from sqlalchemy import event  # noqa: E402
+
+from common import webserver, seed, signed_in_client, csrf_token, \
+    check, failures  # noqa
+from database import get_engine, get_replica_engines  # noqa: E402
+
+
+def main():
+    user_id, catalog_ids, item_ids = seed(items_per_catalog=3)
+    # SQLite file engines pool nothing, so the copies are safe to take now.
+    for path in REPLICAS:
+        shutil.copy(PRIMARY, path)
+
+    used = []
+    for engine in [get_engine()] + get_replica_engines():
+        event.listen(engine, 'before_cursor_execute',
+                     lambda *a, url=str(engine.url): used.append(url))
+    primary, replica1, replica2 = ['sqlite:///' + path
+                                   for path in [PRIMARY] + REPLICAS]
+
+    client = signed_in_client(user_id)
+    state = csrf_token(user_id)
+    response = client.put('/items/%d/' % item_ids[0], data={
+        'state': state, 'name': 'renamed on the primary',
+        'description': 'edited', 'catalog_id': catalog_ids[0]})
+    check("PUT is applied", response.status_code == 200)
+    check("PUT only touches the primary", set(used) == {primary})
+
+    del used[:]
+    page = client.get('/items/%d/JSON/' % item_ids[0]).get_data(True)
+    check("the writer reads its own write", 'renamed on the primary' in page)
+    check("... from the primary", set(used) == {primary})
+
+    del used[:]
+    anonymous = webserver.app.test_client()
+    pages = [anonymous.get('/items/%d/JSON/' % item_ids[0]).get_data(True)
+             for _ in range(2)]
+    check("anonymous readers see the replicas' stale copy",
+          all('renamed on the primary' not in page for page in pages))
+    check("... from both replicas in turn",
+          set(used) == {replica1, replica2})
+
+    del used[:]
+    client.get('/items/%d/edit/' % item_ids[0])
+    check("the edit page authorizes against the primary", primary in used)
+
+    webserver.app.config['REPLICA_STICKY_SECONDS'] = 0
+    del used[:]
+    client.get('/items/%d/JSON/' % item_ids[0])
+    check("after the sticky window the writer reads a replica",
+          primary not in used and used)
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Checks that the in-process search index (@see src/search.py) keeps items
+created and edited through the forms findable with ?catalog_id=, once it
+has been built, and that walking the pages of a search with many equally
+ranked results ends with exactly the matching items.
+
+Run from the project root:
+    python3 bench/search_index.py
+
+Exits with status 1 if any check fails.
+"""
+import sys
+
+from common import webserver, seed, signed_in_client, csrf_token, \
+    check, failures
+from models import Item
+from search import search_items
+
+
+def found(client, q, catalog_id):
+    response = client.get('/items/search/JSON/?q={}&catalog_id={}'.format(
+        q, catalog_id))
+    return [item['name'] for item in response.get_json()['items']]
+
+
+def walk(q, per_page):
+    """
+    :return: the ids of every result of a search, following the cursors,
+    and the number of pages, or None if the walk does not end.
+    """
+    db_session = webserver.DBSession()
+    ids, cursor = [], None
+    try:
+        for pages in range(1, 1000):
+            page = search_items(db_session, q, cursor=cursor,
+                                per_page=per_page)
+            ids.extend(row.id for row in page.rows)
+            if not page.next_cursor:
+                return ids, pages
+            cursor = page.next_cursor
+        return ids, None
+    finally:
+        webserver.DBSession.remove()
+
+
+def main():
+    user_id, catalog_ids, item_ids = seed(catalogs=2, items_per_catalog=91)
+    client = signed_in_client(user_id)
+    state = csrf_token(user_id)
+    # The first search builds the index; later writes go through the events.
+    check("the seeded items are found in their catalog",
+          found(client, 'bench', catalog_ids[0]))
+
+    client.post('/items/', data={'state': state, 'name': 'zeppelin',
+                                 'description': 'created through the form',
+                                 'catalog_id': str(catalog_ids[0])})
+    check("a created item is found in its catalog",
+          found(client, 'zeppelin', catalog_ids[0]) == ['zeppelin'])
+
+    db_session = webserver.DBSession()
+    item_id = db_session.query(Item.id).filter_by(name='zeppelin').scalar()
+    webserver.DBSession.remove()
+    client.put('/items/%d/' % item_id, data={
+        'state': state, 'name': 'zeppelin', 'description': 'moved',
+        'catalog_id': str(catalog_ids[1])})
+    check("a moved item is found in its new catalog",
+          found(client, 'zeppelin', catalog_ids[1]) == ['zeppelin'])
+    check("... and no longer in its old one",
+          found(client, 'zeppelin', catalog_ids[0]) == [])
+
+    # Every seeded item has the same name and description, so they tie.
+    ids, pages = walk('bench', 7)
+    check("a search walked 7 at a time ends ({} pages)".format(pages),
+          pages is not None)
+    check("... with each matching item exactly once",
+          sorted(ids) == sorted(item_ids) and len(set(ids)) == len(ids))
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Measures cold start latency: importing the app, creating it and serving the
+first request, each in a fresh interpreter, as a newly booted gunicorn
+worker would.
+
+Run from the project root:
+    python3 bench/startup.py [runs]
+"""
+import json
+import os
+import subprocess
+import sys
+
+import common
+from common import percentile
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import webserver
+imported = time.perf_counter()
+app = webserver.create_app()
+created = time.perf_counter()
+response = app.test_client().get('/items/')
+served = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print(json.dumps({'import': imported - start, 'create_app': created - imported,
+                  'first_request': served - created}))
+"""
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    common.seed()
+    samples = {'import': [], 'create_app': [], 'first_request': []}
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', PROBE],
+                                         cwd=common.SRC, env=os.environ)
+        for phase, seconds in json.loads(output.decode()).items():
+            samples[phase].append(seconds * 1000)
+    for phase in ('import', 'create_app', 'first_request'):
+        print("{:<14} p50={:.1f}ms max={:.1f}ms".format(
+            phase, percentile(samples[phase], 50), max(samples[phase])))
+
+
+if __name__ == '__main__':
+    main()
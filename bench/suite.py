@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Drives every route of the app against a generated dataset (@see dataset.py)
+and records, per route, throughput, p50/p95/p99 latency and the number of
+SQL statements per request. Results are written as JSON, tagged with the
+commit, so runs can be compared across commits.
+
+Reads are measured twice: warm, as a busy worker serves them, and cold
+("GET ... (cold)"), with the caches emptied before every request, as after a
+restart, so their queries and rendering are measured too.
+
+Run from the project root:
+    python3 bench/suite.py --scale 10000 --repeat 200 --output results.json
+    python3 bench/suite.py --scale 10000 --compare results.json
+
+DATABASE_URL defaults to a throwaway SQLite file; point it at an empty
+PostgreSQL database to measure the production setup. Requests go through
+Flask's test client, so the numbers are the app's own cost without any
+HTTP server or network. Logins are not covered; @see login.py.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from common import webserver, get_engine, signed_in_client, percentile, \
+    csrf_token, statement_log, CWD
+from models import User, Catalog, Item
+from bulk import import_records
+from cache import make_cache
+import dataset
+
+# Items in each of the catalogs created for DELETE /catalogs/<id>/.
+DELETED_CATALOG_ITEMS = 10
+# Requests per route at most for the exports, which stream the whole table.
+EXPORT_REPEAT = 10
+
+
+class Scenario(object):
+    """
+    A route to measure. path and data are functions of the iteration number,
+    so that e.g. every DELETE targets a different item. repeat caps the
+    number of requests, if given.
+    """
+
+    def __init__(self, name, method, path, data=None, repeat=None):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.data = data
+        self.repeat = repeat
+
+
+def scenarios(ids, state):
+    """
+    :param ids: the ids of rows owned by the signed in user and ids of rows
+    that can be deleted (@see owned_ids).
+    :param state: a CSRF token of the signed in user.
+
+    :return: the Scenarios, reads first.
+    """
+    catalog = ids['catalog']
+    item = ids['item']
+    deletable = ids['deletable']
+    deletable_catalogs = ids['deletable_catalogs']
+    form = {'state': state, 'description': 'benchmarked'}
+    return [
+        Scenario('GET /', 'get', lambda n: '/'),
+        Scenario('GET /catalogs/', 'get', lambda n: '/catalogs/'),
+        Scenario('GET /catalogs/JSON/', 'get', lambda n: '/catalogs/JSON/'),
+        Scenario('GET /catalogs/new/', 'get', lambda n: '/catalogs/new/'),
+        Scenario('GET /catalogs/<id>/', 'get',
+                 lambda n: '/catalogs/%d/' % catalog),
+        Scenario('GET /catalogs/<id>/JSON/', 'get',
+                 lambda n: '/catalogs/%d/JSON/' % catalog),
+        Scenario('GET /catalogs/<id>/JSON/export/', 'get',
+                 lambda n: '/catalogs/%d/JSON/export/' % catalog,
+                 repeat=EXPORT_REPEAT),
+        Scenario('GET /catalogs/<id>/edit/', 'get',
+                 lambda n: '/catalogs/%d/edit/' % catalog),
+        Scenario('GET /items/', 'get', lambda n: '/items/'),
+        Scenario('GET /items/JSON/', 'get', lambda n: '/items/JSON/'),
+        Scenario('GET /items/JSON/export/', 'get',
+                 lambda n: '/items/JSON/export/', repeat=EXPORT_REPEAT),
+        Scenario('GET /items/search/', 'get',
+                 lambda n: '/items/search/?q=lamp'),
+        Scenario('GET /items/search/JSON/', 'get',
+                 lambda n: '/items/search/JSON/?q=lamp+desk'),
+        Scenario('GET /items/new/', 'get', lambda n: '/items/new/'),
+        Scenario('GET /items/<id>/', 'get', lambda n: '/items/%d/' % item),
+        Scenario('GET /items/<id>/JSON/', 'get',
+                 lambda n: '/items/%d/JSON/' % item),
+        Scenario('GET /items/<id>/edit/', 'get',
+                 lambda n: '/items/%d/edit/' % item),
+        Scenario('GET /login/', 'get', lambda n: '/login/'),
+        Scenario('POST /catalogs/', 'post', lambda n: '/catalogs/',
+                 lambda n: {'state': state, 'name': 'bench %d' % n}),
+        Scenario('PUT /catalogs/<id>/', 'put',
+                 lambda n: '/catalogs/%d/' % catalog,
+                 lambda n: {'state': state, 'name': 'renamed %d' % n}),
+        Scenario('POST /items/', 'post', lambda n: '/items/',
+                 lambda n: dict(form, name='new %d' % n,
+                                catalog_id=catalog)),
+        Scenario('PUT /items/<id>/', 'put', lambda n: '/items/%d/' % item,
+                 lambda n: dict(form, name='edited %d' % n,
+                                catalog_id=catalog)),
+        Scenario('DELETE /items/<id>/', 'delete',
+                 lambda n: '/items/%d/' % deletable[n + 1],
+                 lambda n: {'state': state}),
+        Scenario('DELETE /catalogs/<id>/', 'delete',
+                 lambda n: '/catalogs/%d/' % deletable_catalogs[n + 1],
+                 lambda n: {'state': state}),
+    ]
+
+
+def owned_ids(repeat):
+    """
+    :return: the ids the scenarios act on: a catalog and an item of the
+    signed in user, and repeat + 1 (with the warm up) items of theirs to
+    delete. As many catalogs of DELETED_CATALOG_ITEMS items are created for
+    them to delete.
+    """
+    import_records(get_engine(), ({'name': 'doomed %d' % n,
+                                   'description': 'to be deleted',
+                                   'catalog': 'deletable %d' % c,
+                                   'by': dataset.EMAIL}
+                                  for c in range(repeat + 1)
+                                  for n in range(DELETED_CATALOG_ITEMS)),
+                   batch_size=5000)
+    db_session = webserver.DBSession()
+    user_id = db_session.query(User.id).filter_by(
+        email=dataset.EMAIL).order_by(User.id).first()[0]
+    catalog_id = db_session.query(Catalog.id).filter_by(
+        user_id=user_id).order_by(Catalog.id).first()[0]
+    item_ids = [row[0] for row in db_session.query(Item.id).filter_by(
+        user_id=user_id).order_by(Item.id).limit(repeat + 2)]
+    deletable_catalogs = [row[0] for row in db_session.query(
+        Catalog.id).filter(Catalog.name.like('deletable %')).order_by(
+        Catalog.id)]
+    webserver.DBSession.remove()
+    if len(item_ids) < repeat + 2:
+        sys.exit("The dataset is too small for --repeat {}.".format(repeat))
+    return user_id, {'catalog': catalog_id, 'item': item_ids[0],
+                     'deletable': item_ids[1:],
+                     'deletable_catalogs': deletable_catalogs}
+
+
+def empty_caches():
+    """
+    Replaces the app's caches with empty ones, as create_app() builds them.
+    """
+    config = webserver.app.config
+    webserver.cache = make_cache(config['CACHE_BACKEND'], config['CACHE_TTL'],
+                                 config['CACHE_MAX_ENTRIES'])
+    webserver.fragments = make_cache(config['CACHE_BACKEND'],
+                                     config['CACHE_TTL'],
+                                     config['FRAGMENT_CACHE_MAX_ENTRIES'])
+
+
+def measure(client, scenario, repeat, statements, cold=False):
+    repeat = min(repeat, scenario.repeat or repeat)
+    latencies, queries = [], []
+    # One unmeasured request warms up the connection pool (and the caches,
+    # unless cold).
+    for n in range(-1, repeat):
+        if cold:
+            empty_caches()
+        del statements[:]
+        call = getattr(client, scenario.method)
+        data = scenario.data(n) if scenario.data else None
+        start = time.perf_counter()
+        response = call(scenario.path(n), data=data)
+        # Streamed responses are produced while they are read.
+        response.get_data()
+        elapsed = (time.perf_counter() - start) * 1000
+        if response.status_code >= 400:
+            sys.exit("{} returned {}".format(scenario.name,
+                                             response.status_code))
+        if n >= 0:
+            latencies.append(elapsed)
+            queries.append(len(statements))
+    return {
+        'requests': repeat,
+        'rps': 1000.0 * repeat / sum(latencies),
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'queries': float(sum(queries)) / repeat,
+    }
+
+
+def commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    print("\nCompared with {} ({}):".format(baseline.get('commit'),
+                                            baseline.get('timestamp')))
+    for name, result in results.items():
+        before = baseline['routes'].get(name)
+        if not before:
+            continue
+        print("{:<38} p50 {:+6.1f}%  queries {:+.1f}".format(
+            name, 100.0 * (result['p50_ms'] / before['p50_ms'] - 1),
+            result['queries'] - before['queries']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--scale', type=int, default=10000,
+                        help="Number of items to generate (1000 to 10M).")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=100,
+                        help="Requests per route.")
+    parser.add_argument('--route', action='append', dest='routes',
+                        help="Only measure this route, e.g. 'GET /items/'.")
+    parser.add_argument('--output', help="Write the results to this file.")
+    parser.add_argument('--compare', help="A previous results file.")
+    args = parser.parse_args()
+
+    engine = get_engine()
+    start = time.time()
+    dataset.generate(engine, args.scale, args.seed)
+    print("Generated {} items in {:.1f}s".format(args.scale,
+                                                 time.time() - start))
+    user_id, ids = owned_ids(args.repeat)
+    client = signed_in_client(user_id)
+    statements = statement_log()
+
+    results = {}
+    for scenario in scenarios(ids, csrf_token(user_id)):
+        if args.routes and scenario.name not in args.routes:
+            continue
+        passes = [(scenario.name, False)]
+        if scenario.method == 'get':
+            passes.append((scenario.name + ' (cold)', True))
+        for name, cold in passes:
+            result = results[name] = measure(client, scenario, args.repeat,
+                                             statements, cold)
+            print("{:<38} {:>7.1f} req/s  p50={:.2f}ms  p95={:.2f}ms  "
+                  "p99={:.2f}ms  queries={:.1f}".format(
+                      name, result['rps'], result['p50_ms'],
+                      result['p95_ms'], result['p99_ms'], result['queries']))
+
+    report = {
+        'commit': commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'database': engine.dialect.name,
+        'scale': dict(zip(('users', 'catalogs', 'items'),
+                          dataset.scale_counts(args.scale))),
+        'repeat': args.repeat,
+        'routes': results,
+    }
+    if args.output:
+        with open(os.path.join(CWD, args.output), 'w') as out:
+            json.dump(report, out, indent=2, sort_keys=True)
+    if args.compare:
+        with open(os.path.join(CWD, args.compare)) as previous:
+            compare(results, json.load(previous))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Checks that a write racing another one to the same row is answered with
+409 and rolled back, rather than failing with a 500: another connection
+bumps the row's version between the handler loading it and flushing
+(@see commit_write in src/webserver.py).
+
+Run from the project root:
+    python3 bench/write_conflicts.py
+
+Exits with status 1 if any check fails.
+"""
+from sqlalchemy import event
+
+import sys
+
+from common import webserver, get_engine, seed, signed_in_client, \
+    csrf_token, check, failures
+from models import Item, Catalog
+
+
+def concurrently_bump(model, row_id):
+    """
+    Has another connection write the row right after the next handler
+    loads it.
+    """
+    def bump(target, context):
+        table = model.__table__
+        with get_engine().begin() as connection:
+            connection.execute(table.update().where(
+                table.c.id == row_id).values(version=table.c.version + 1))
+    event.listen(model, 'load', bump, once=True)
+
+
+def exists(model, row_id):
+    db_session = webserver.DBSession()
+    try:
+        return db_session.query(model).get(row_id) is not None
+    finally:
+        webserver.DBSession.remove()
+
+
+def main():
+    user_id, catalog_ids, item_ids = seed(catalogs=2, items_per_catalog=2)
+    client = signed_in_client(user_id)
+    state = csrf_token(user_id)
+    item_form = {'state': state, 'name': 'edited', 'description': 'raced',
+                 'catalog_id': catalog_ids[0]}
+
+    concurrently_bump(Item, item_ids[0])
+    check("a raced item update answers 409", client.put(
+        '/items/%d/' % item_ids[0], data=item_form).status_code == 409)
+    check("... and the next one goes through", client.put(
+        '/items/%d/' % item_ids[0], data=item_form).status_code == 200)
+
+    concurrently_bump(Item, item_ids[1])
+    check("a raced item delete answers 409", client.delete(
+        '/items/%d/' % item_ids[1], data={'state': state}).status_code == 409)
+    check("... and leaves the item", exists(Item, item_ids[1]))
+
+    concurrently_bump(Catalog, catalog_ids[0])
+    check("a raced catalog rename answers 409", client.put(
+        '/catalogs/%d/' % catalog_ids[0],
+        data={'state': state, 'name': 'renamed'}).status_code == 409)
+
+    concurrently_bump(Catalog, catalog_ids[1])
+    check("a raced catalog delete answers 409", client.delete(
+        '/catalogs/%d/' % catalog_ids[1],
+        data={'state': state}).status_code == 409)
+    check("... and leaves the catalog and its items",
+          exists(Catalog, catalog_ids[1]) and exists(Item, item_ids[2]))
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
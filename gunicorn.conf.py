@@ -0,0 +1,23 @@
+import multiprocessing
+import os
+
+# Gunicorn settings, read from the environment:
+#
+#     gunicorn -c gunicorn.conf.py --chdir src webserver:app
+#
+# The default is the original setup of sync workers, one request per worker
+# at a time, so a few slow clients stall them. GUNICORN_WORKER_CLASS=gthread
+# with GUNICORN_THREADS > 1 lets each worker overlap requests waiting on the
+# database or on clients. For the ASGI mode (@see src/asgi.py) use
+# uvicorn.workers.UvicornWorker and asgi:app.
+
+bind = '0.0.0.0:{}'.format(os.getenv('PORT', 8000))
+workers = int(os.getenv('WEB_CONCURRENCY',
+                        multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'sync')
+threads = int(os.getenv('GUNICORN_THREADS', 1))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+# Workers import the app after forking, so none of them inherits a
+# connection pool (@see get_engine in src/database.py).
+preload_app = False
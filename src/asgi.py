@@ -0,0 +1,33 @@
+from webserver import app as wsgi_app
+
+import os
+
+# Optional ASGI entry point for the same app, for serving behind an ASGI
+# server such as uvicorn:
+#
+#     GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker \
+#         gunicorn -c gunicorn.conf.py --chdir src asgi:app
+#
+# The views stay synchronous: Flask 1.0 has no async views and SQLAlchemy 1.3
+# has no async engine. uvicorn reads requests on its event loop, so a client
+# sending slowly holds a connection rather than a thread, and each complete
+# request then runs on one of ASGI_THREADS (default 10) threads per worker.
+# Size DB_POOL_SIZE + DB_MAX_OVERFLOW (@see database.py) to at least that.
+#
+# bench/load.py measured it no faster than gunicorn's own threads
+# (GUNICORN_WORKER_CLASS=gthread with as many GUNICORN_THREADS), which cope
+# with slow clients as well; only sync workers stall behind them. Prefer
+# gthread unless the app has to run in an ASGI stack.
+#
+# Requires the a2wsgi package (and an ASGI server). asgiref's WsgiToAsgi is
+# not used: it runs every request of a worker on one thread, and failed
+# requests under concurrent load. webserver:app, the WSGI entry point, is
+# unaffected.
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    raise ImportError("The ASGI entry point requires a2wsgi: "
+                      "pip install a2wsgi uvicorn")
+
+app = WSGIMiddleware(wsgi_app, workers=int(os.getenv('ASGI_THREADS', 10)))
@@ -0,0 +1,234 @@
+import gzip
+import hashlib
+import io
+import json
+import os
+import posixpath
+import re
+import shutil
+
+# Static asset build, run by "flask katalog assets" (@see cli.py) before
+# deploying. It writes into views/static/dist:
+#
+# - the stylesheets and scripts of every page bundled into one file each,
+#   minified if rcssmin / rjsmin are installed;
+# - a copy of every other static file;
+# - WebP thumbnails of the images, if Pillow is installed;
+# - manifest.json, mapping the original names to the built ones.
+#
+# Every built file name carries a hash of its content, so the files can be
+# cached forever (@see static_dist in webserver.py): a change produces a new
+# name. Text files also get .gz and, if the brotli package is installed, .br
+# siblings, which are served as is to clients that accept them.
+#
+# Without a build, asset_url() and bundle_urls() fall back to the original
+# files, so development needs no build step.
+
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+
+# Bundle name -> members, in page order (@see html_start.html, html_end.html).
+BUNDLES = {
+    'css/site.css': ['css/bootstrap.min.css', 'css/font-awesome.min.css',
+                     'css/owl.carousel.css', 'css/animate.css',
+                     'css/style.css', 'css/custom.css'],
+    'js/site.js': ['js/jquery-3.2.1.min.js', 'js/owl.carousel.min.js',
+                   'js/main.js', 'js/custom.js'],
+}
+COMPRESSIBLE = ('.css', '.js', '.svg', '.eot', '.ttf', '.ico', '.json')
+THUMBNAIL_WIDTHS = (320, 640, 1280)
+IMAGES = ('.jpg', '.jpeg', '.png')
+
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+
+def fingerprint(name, content):
+    """
+    :return: name with a hash of content before its extension, e.g.
+    css/site.css -> css/site.1f2e3d4c.css.
+    """
+    stem, ext = posixpath.splitext(name)
+    return '{}.{}{}'.format(stem, hashlib.md5(content).hexdigest()[:8], ext)
+
+
+def static_files(static_dir):
+    """
+    :return: the names (relative, with forward slashes) of the source files,
+    i.e. everything outside dist/.
+    """
+    for root, dirs, files in os.walk(static_dir):
+        if root == static_dir and DIST in dirs:
+            dirs.remove(DIST)
+        for filename in files:
+            path = os.path.relpath(os.path.join(root, filename), static_dir)
+            yield path.replace(os.sep, '/')
+
+
+def read(static_dir, name):
+    with open(os.path.join(static_dir, *name.split('/')), 'rb') as source:
+        return source.read()
+
+
+def write(dist_dir, name, content):
+    path = os.path.join(dist_dir, *name.split('/'))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as out:
+        out.write(content)
+    return path
+
+
+def rewrite_css_urls(css, source, bundle, files):
+    """
+    Points the url(...) references of a stylesheet that moves into dist/, on
+    its own or in a bundle, at the built copies of the files they name.
+
+    :param css: the stylesheet.
+    :param source: the stylesheet's original name, e.g. css/style.css.
+    :param bundle: the name it is built under, e.g. css/site.css. Only its
+    directory matters.
+    :param files: maps original names to built names.
+
+    :return: the rewritten stylesheet.
+    """
+    def replace(match):
+        quote, url = match.group(1), match.group(2)
+        if re.match(r'^(data:|https?:|//|/|#)', url):
+            return match.group(0)
+        path, suffix = re.match(r'^([^?#]*)(.*)$', url).groups()
+        target = posixpath.normpath(posixpath.join(
+            posixpath.dirname(source), path))
+        # Files that were not copied stay where they are, outside dist/.
+        built = posixpath.join(DIST, files[target]) if target in files \
+            else target
+        relative = posixpath.relpath(built, posixpath.join(
+            DIST, posixpath.dirname(bundle)))
+        return 'url({0}{1}{2}{0})'.format(quote, relative, suffix)
+    return CSS_URL.sub(replace, css)
+
+
+def minify(name, content):
+    """
+    Minifies a stylesheet or script with rcssmin / rjsmin, or returns it as
+    is if they are not installed.
+    """
+    try:
+        if name.endswith('.css'):
+            import rcssmin
+            return rcssmin.cssmin(content)
+        import rjsmin
+        return rjsmin.jsmin(content)
+    except ImportError:
+        return content
+
+
+def compress(path):
+    """
+    Writes path.gz and, with the brotli package, path.br, keeping only the
+    ones that are actually smaller.
+    """
+    with open(path, 'rb') as source:
+        content = source.read()
+    variants = [('.gz', gzip.compress(content, 9))]
+    try:
+        import brotli
+        variants.append(('.br', brotli.compress(content)))
+    except ImportError:
+        pass
+    for suffix, compressed in variants:
+        if len(compressed) < len(content):
+            with open(path + suffix, 'wb') as out:
+                out.write(compressed)
+
+
+def thumbnails(static_dir, dist_dir, name, widths=THUMBNAIL_WIDTHS):
+    """
+    Writes WebP copies of an image at each width narrower than the image.
+
+    :return: (width, built name) pairs, or [] without Pillow.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return []
+    built = []
+    with Image.open(os.path.join(static_dir, *name.split('/'))) as image:
+        for width in widths:
+            if width >= image.width:
+                break
+            height = int(round(image.height * float(width) / image.width))
+            out = io.BytesIO()
+            image.resize((width, height), Image.LANCZOS).save(
+                out, 'WEBP', quality=80)
+            stem = posixpath.splitext(name)[0]
+            thumbnail = fingerprint('{}.{}w.webp'.format(stem, width),
+                                    out.getvalue())
+            write(dist_dir, thumbnail, out.getvalue())
+            built.append((width, thumbnail))
+    return built
+
+
+def build(static_dir, report=None):
+    """
+    Builds dist/ from the static files (@see the top of this module),
+    replacing any earlier build.
+
+    :param static_dir: the app's static folder.
+    :param report: called with (original name, built name) for every file.
+
+    :return: the manifest.
+    """
+    dist_dir = os.path.join(static_dir, DIST)
+    if os.path.isdir(dist_dir):
+        shutil.rmtree(dist_dir)
+    report = report or (lambda source, built: None)
+    bundled = set(name for members in BUNDLES.values() for name in members)
+    manifest = {'files': {}, 'webp': {}}
+    files = manifest['files']
+
+    # Stylesheets last, so they can point at the copies of everything else.
+    for name in sorted(static_files(static_dir),
+                       key=lambda name: (name.endswith('.css'), name)):
+        if name in bundled:
+            continue
+        content = read(static_dir, name)
+        if name.endswith('.css'):
+            content = rewrite_css_urls(content.decode('utf-8'), name, name,
+                                       files).encode('utf-8')
+        files[name] = fingerprint(name, content)
+        write(dist_dir, files[name], content)
+        report(name, files[name])
+        if name.lower().endswith(IMAGES):
+            manifest['webp'][name] = thumbnails(static_dir, dist_dir, name)
+
+    for bundle, members in sorted(BUNDLES.items()):
+        texts = []
+        for member in members:
+            text = read(static_dir, member).decode('utf-8')
+            if bundle.endswith('.css'):
+                text = rewrite_css_urls(text, member, bundle, files)
+            texts.append(minify(bundle, text))
+        # A script's last statement may lack its semicolon.
+        separator = '\n' if bundle.endswith('.css') else '\n;'
+        content = separator.join(texts).encode('utf-8')
+        files[bundle] = fingerprint(bundle, content)
+        write(dist_dir, files[bundle], content)
+        report(bundle, files[bundle])
+
+    for name in files.values():
+        if name.endswith(COMPRESSIBLE):
+            compress(os.path.join(dist_dir, *name.split('/')))
+    with open(os.path.join(dist_dir, MANIFEST), 'w') as out:
+        json.dump(manifest, out, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(static_dir):
+    """
+    :return: the manifest of the last build, or an empty one if there is
+    none.
+    """
+    try:
+        with open(os.path.join(static_dir, DIST, MANIFEST)) as manifest:
+            return json.load(manifest)
+    except (IOError, ValueError):
+        return {'files': {}, 'webp': {}}
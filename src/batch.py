@@ -0,0 +1,302 @@
+from sqlalchemy import select, bindparam, func
+
+from models import Item, Catalog, search_document, adjust_item_counts
+from collections import Counter
+from datetime import datetime
+
+# Batch mutations of items and catalogs (@see batch_json in webserver.py).
+# A batch is a list of operations such as
+#
+#     {"op": "create", "type": "item", "name": ..., "description": ...,
+#      "catalog_id": ...}
+#     {"op": "update", "type": "item", "id": ..., "name": ...}
+#     {"op": "delete", "type": "catalog", "id": ...}
+#
+# Whatever its size, a batch is authorized with one ownership query per
+# table over the ids it mentions and applied in a single transaction with
+# bulk statements: one DELETE per table, one executemany UPDATE per set of
+# changed fields and one INSERT per table (one per row outside PostgreSQL).
+# Either every operation is applied or none is.
+#
+# The ownership queries lock the rows they read (SELECT ... FOR UPDATE, in id
+# order) until the batch commits. No concurrent write can move an item to
+# another catalog, or change a row, between the checks and the bulk
+# statements, so the item counters cannot drift. An ORM write racing the
+# batch waits for it, then fails its version check and answers 409 (@see
+# commit_write in webserver.py) instead of overwriting the batch. SQLite
+# has no row locks, but it only lets one transaction write at a time.
+#
+# Since every row appears at most once and nothing may touch a catalog
+# deleted by the same batch, the operations do not depend on each other's
+# order. Core statements skip the ORM hooks, so the item counters and search
+# documents are maintained here (@see models.py).
+
+OPERATIONS = ('create', 'update', 'delete')
+MODELS = {'item': Item, 'catalog': Catalog}
+FIELDS = {'item': ('name', 'description', 'catalog_id'),
+          'catalog': ('name',)}
+
+INVALID = 'invalid'
+NOT_FOUND = 'not found'
+FORBIDDEN = 'forbidden'
+CONFLICT = 'conflict'
+
+
+def parse(spec):
+    """
+    Validates an operation's shape.
+
+    :param spec: the operation as received.
+
+    :return: the operation, with its id and catalog_id as integers and
+    strings stripped.
+    :raise ValueError: if the operation is malformed, or a string is longer
+    than its column allows.
+    """
+    if not isinstance(spec, dict) or spec.get('op') not in OPERATIONS or \
+            spec.get('type') not in MODELS:
+        raise ValueError(spec)
+    kind = spec['type']
+    operation = {'op': spec['op'], 'type': kind}
+    if spec['op'] != 'create':
+        operation['id'] = int(spec['id'])
+    if spec['op'] != 'delete':
+        for field in FIELDS[kind]:
+            if field not in spec:
+                continue
+            value = spec[field]
+            if field == 'catalog_id':
+                value = int(value)
+            else:
+                value = value.strip()
+                if not value and field == 'name':
+                    raise ValueError(spec)
+                # Longer strings would fail the whole statement on
+                # PostgreSQL.
+                if len(value) > MODELS[kind].__table__.c[field].type.length:
+                    raise ValueError(spec)
+            operation[field] = value
+        changed = [field for field in FIELDS[kind] if field in operation]
+        required = ('name', 'catalog_id') if kind == 'item' else ('name',)
+        if spec['op'] == 'create' and \
+                not all(field in operation for field in required):
+            raise ValueError(spec)
+        if spec['op'] == 'update' and not changed:
+            raise ValueError(spec)
+    return operation
+
+
+def apply(connection, user_id, specs):
+    """
+    Authorizes and applies a batch on behalf of a user.
+
+    :param connection: the connection of the current transaction. The caller
+    commits, or rolls back if there are errors.
+    :param user_id: the id of the user.
+    :param specs: the operations (@see the top of this module).
+
+    :return: a (results, changes) tuple. results holds one dict per
+    operation, in order, with "success" and, for creates, the new "id" or,
+    for failures, an "error". changes is None if nothing was applied,
+    otherwise it holds the ids of the "items" written or deleted, the ids of
+    the "catalogs" whose listings changed and whether "catalogs" themselves
+    were written.
+    """
+    operations, errors = [], {}
+    for n, spec in enumerate(specs):
+        try:
+            operations.append((n, parse(spec)))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            errors[n] = INVALID
+
+    items, catalogs = _owners(connection, operations)
+    deleted_catalogs = set(o['id'] for _, o in operations
+                           if o['type'] == 'catalog' and o['op'] == 'delete')
+    seen = Counter((o['type'], o['id']) for _, o in operations if 'id' in o)
+    for n, operation in operations:
+        error = _check(operation, user_id, items, catalogs, deleted_catalogs,
+                       seen)
+        if error:
+            errors[n] = error
+    if errors:
+        return [{'success': False, 'error': errors[n]} if n in errors
+                else {'success': False} for n in range(len(specs))], None
+
+    by_kind = {}
+    for n, operation in operations:
+        by_kind.setdefault((operation['op'], operation['type']), []).append(
+            (n, operation))
+    results = [{'success': True} for _ in specs]
+    changes = {'items': set(), 'catalogs': set(), 'catalogs_written': False}
+    deltas = Counter()
+    now = datetime.utcnow()
+
+    # Deletes
+    doomed = [o['id'] for _, o in by_kind.get(('delete', 'item'), [])]
+    if doomed:
+        table = Item.__table__
+        connection.execute(table.delete().where(table.c.id.in_(doomed)))
+        for item_id in doomed:
+            deltas[items[item_id]['catalog_id']] -= 1
+            changes['catalogs'].add(items[item_id]['catalog_id'])
+        changes['items'].update(doomed)
+    if deleted_catalogs:
+        table = Item.__table__
+        changes['items'].update(row[0] for row in connection.execute(
+            select([table.c.id]).where(
+                table.c.catalog_id.in_(deleted_catalogs))))
+        connection.execute(table.delete().where(
+            table.c.catalog_id.in_(deleted_catalogs)))
+        table = Catalog.__table__
+        connection.execute(table.delete().where(
+            table.c.id.in_(deleted_catalogs)))
+        changes['catalogs'].update(deleted_catalogs)
+        changes['catalogs_written'] = True
+
+    # Updates
+    for _, operation in by_kind.get(('update', 'item'), []):
+        old = items[operation['id']]['catalog_id']
+        new = operation.get('catalog_id', old)
+        if new != old:
+            deltas[old] -= 1
+            deltas[new] += 1
+        changes['catalogs'].update((old, new))
+        changes['items'].add(operation['id'])
+    for kind in ('catalog', 'item'):
+        _update(connection, kind,
+                [o for _, o in by_kind.get(('update', kind), [])], now)
+    for _, operation in by_kind.get(('update', 'catalog'), []):
+        changes['catalogs'].add(operation['id'])
+        changes['catalogs_written'] = True
+
+    # Creates
+    for kind in ('catalog', 'item'):
+        created = by_kind.get(('create', kind), [])
+        if not created:
+            continue
+        rows = [dict({f: o.get(f) for f in FIELDS[kind]}, user_id=user_id,
+                     version=1, updated_at=now) for _, o in created]
+        ids = _insert(connection, MODELS[kind].__table__, rows)
+        for (n, operation), row_id in zip(created, ids):
+            results[n]['id'] = row_id
+        if kind == 'item':
+            for row, row_id in zip(rows, ids):
+                deltas[row['catalog_id']] += 1
+                changes['catalogs'].add(row['catalog_id'])
+                changes['items'].add(row_id)
+        else:
+            changes['catalogs_written'] = True
+
+    adjust_item_counts(connection, deltas)
+    written = [o['id'] for _, o in by_kind.get(('update', 'item'), [])] + \
+        [results[n]['id'] for n, _ in by_kind.get(('create', 'item'), [])]
+    if written and connection.dialect.name == 'postgresql':
+        table = Item.__table__
+        connection.execute(table.update().where(
+            table.c.id.in_(written)).values(search_vector=search_document(
+                table.c.name, table.c.description)))
+    return results, changes
+
+
+def _owners(connection, operations):
+    """
+    Loads and locks, in one query per table, the owner (and for items, the
+    catalog) of every row the operations name: the items they update or
+    delete, the catalogs they update or delete and the catalogs they put
+    items in.
+
+    :return: an (items, catalogs) tuple of dicts keyed by id.
+    """
+    item_ids, catalog_ids = set(), set()
+    for _, operation in operations:
+        if operation['type'] == 'item':
+            if 'id' in operation:
+                item_ids.add(operation['id'])
+            if 'catalog_id' in operation:
+                catalog_ids.add(operation['catalog_id'])
+        elif 'id' in operation:
+            catalog_ids.add(operation['id'])
+
+    items, catalogs = {}, {}
+    if item_ids:
+        table = Item.__table__
+        for row in connection.execute(select(
+                [table.c.id, table.c.user_id, table.c.catalog_id]).where(
+                table.c.id.in_(item_ids)).order_by(
+                table.c.id).with_for_update()):
+            items[row.id] = {'user_id': row.user_id,
+                             'catalog_id': row.catalog_id}
+    if catalog_ids:
+        table = Catalog.__table__
+        for row in connection.execute(select(
+                [table.c.id, table.c.user_id]).where(
+                table.c.id.in_(catalog_ids)).order_by(
+                table.c.id).with_for_update()):
+            catalogs[row.id] = {'user_id': row.user_id}
+    return items, catalogs
+
+
+def _check(operation, user_id, items, catalogs, deleted_catalogs, seen):
+    """
+    :return: why the user may not apply the operation, or None. As with
+    single item writes, any existing catalog may receive items.
+    """
+    kind = operation['type']
+    if 'id' in operation:
+        if seen[(kind, operation['id'])] > 1:
+            return CONFLICT
+        rows = items if kind == 'item' else catalogs
+        row = rows.get(operation['id'])
+        if row is None:
+            return NOT_FOUND
+        if row['user_id'] != user_id:
+            return FORBIDDEN
+        if kind == 'item' and row['catalog_id'] in deleted_catalogs:
+            return CONFLICT
+    if 'catalog_id' in operation:
+        if operation['catalog_id'] not in catalogs:
+            return NOT_FOUND
+        if operation['catalog_id'] in deleted_catalogs:
+            return CONFLICT
+    return None
+
+
+def _update(connection, kind, operations, now):
+    """
+    Applies updates with one executemany UPDATE per set of changed fields,
+    bumping each row's version as the ORM would.
+    """
+    table = MODELS[kind].__table__
+    groups = {}
+    for operation in operations:
+        fields = tuple(f for f in FIELDS[kind] if f in operation)
+        groups.setdefault(fields, []).append(operation)
+    for fields, group in sorted(groups.items()):
+        statement = table.update().where(
+            table.c.id == bindparam('row_id')).values(
+            version=table.c.version + 1, updated_at=now,
+            **{f: bindparam('new_' + f) for f in fields})
+        connection.execute(statement, [
+            dict({'new_' + f: o[f] for f in fields}, row_id=o['id'])
+            for o in group])
+
+
+def _insert(connection, table, rows):
+    """
+    Inserts rows, PostgreSQL in one INSERT.
+
+    :return: the ids of the new rows, in order.
+    """
+    if connection.dialect.name == 'postgresql':
+        # A multi-row INSERT ... RETURNING does not promise to return the ids
+        # in VALUES order, so the ids are drawn from the table's sequence
+        # first and inserted with the rows.
+        sequence = func.pg_get_serial_sequence(table.name, table.c.id.name)
+        ids = [row[0] for row in connection.execute(
+            select([func.nextval(sequence)]).select_from(
+                func.generate_series(1, len(rows))))]
+        connection.execute(table.insert().values(
+            [dict(row, id=row_id) for row, row_id in zip(rows, ids)]))
+        return ids
+    return [connection.execute(table.insert(), row).inserted_primary_key[0]
+            for row in rows]
@@ -0,0 +1,365 @@
+from sqlalchemy import select, func, and_
+
+from models import User, Catalog, Item, search_document, adjust_item_counts
+from serializers import item_rows, catalog_rows, serialize_item, \
+    serialize_catalog, stream_rows
+from collections import Counter
+from datetime import datetime
+
+import csv
+import io
+import json
+import os
+import time
+
+# Bulk import and export of catalogs and items, in the same shape the JSON
+# endpoints use (@see serializers.py): items are {"name", "description",
+# "catalog", "by"} and catalogs are {"name", "by"}, where "catalog" is a
+# catalog name and "by" a user's email. Used by the "flask katalog" commands
+# (@see cli.py). Catalogs of any size are deleted here too, without loading
+# their items (@see delete_catalog).
+
+FIELDS = {
+    'items': ['name', 'description', 'catalog', 'by'],
+    'catalogs': ['name', 'by']
+}
+
+
+def detect_format(path, fmt=None):
+    """
+    :param path: the file name.
+    :param fmt: "csv" or "ndjson" to override detection.
+
+    :return: "csv" for .csv files, "ndjson" for everything else.
+    """
+    if fmt:
+        return fmt
+    return 'csv' if path.lower().endswith('.csv') else 'ndjson'
+
+
+def read_records(stream, fmt):
+    """
+    :param stream: a text file object.
+    :param fmt: "csv" (with a header row) or "ndjson".
+
+    :return: a generator of dicts, one per record.
+    """
+    if fmt == 'csv':
+        for record in csv.DictReader(stream):
+            yield record
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def batches(records, size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# =========Checkpoints=============
+def load_checkpoint(path, source):
+    """
+    :param path: the checkpoint file, may not exist.
+    :param source: the file being imported.
+
+    :return: the number of records of source already imported.
+    """
+    if not path or not os.path.exists(path):
+        return 0
+    with open(path) as checkpoint:
+        state = json.load(checkpoint)
+    if state.get('source') != os.path.abspath(source):
+        return 0
+    return state['records']
+
+
+def save_checkpoint(path, source, records):
+    """
+    Atomically records that the first records records of source have been
+    committed. A crash between a batch's commit and its checkpoint means the
+    batch is imported again on resume.
+    """
+    if not path:
+        return
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as checkpoint:
+        json.dump({'source': os.path.abspath(source),
+                   'records': records}, checkpoint)
+    os.replace(temporary, path)
+
+
+# =========Lookups=============
+class Resolver(object):
+    """
+    Resolves user emails and catalog names to ids, a whole batch at a time,
+    creating the missing ones. Resolved ids are remembered for the rest of
+    the import.
+    """
+
+    def __init__(self):
+        self.user_ids = {}
+        self.catalog_ids = {}
+
+    def users(self, connection, emails):
+        users = User.__table__
+        missing = set(emails) - set(self.user_ids)
+        if missing:
+            self._load_users(connection, missing)
+            new = missing - set(self.user_ids)
+            if new:
+                connection.execute(users.insert(),
+                                   [{'email': email} for email in new])
+                self._load_users(connection, new)
+        return self.user_ids
+
+    def _load_users(self, connection, emails):
+        users = User.__table__
+        rows = connection.execute(select([users.c.id, users.c.email]).where(
+            users.c.email.in_(emails)).order_by(users.c.id))
+        for user_id, email in rows:
+            self.user_ids.setdefault(email, user_id)
+
+    def catalogs(self, connection, owners):
+        """
+        :param owners: maps catalog names to the id of the user that owns
+        the catalog if it has to be created.
+        """
+        catalogs = Catalog.__table__
+        missing = set(owners) - set(self.catalog_ids)
+        if missing:
+            self._load_catalogs(connection, missing)
+            new = missing - set(self.catalog_ids)
+            if new:
+                now = datetime.utcnow()
+                connection.execute(catalogs.insert(), [
+                    {'name': name, 'user_id': owners[name], 'version': 1,
+                     'updated_at': now} for name in new])
+                self._load_catalogs(connection, new)
+        return self.catalog_ids
+
+    def _load_catalogs(self, connection, names):
+        catalogs = Catalog.__table__
+        rows = connection.execute(select([catalogs.c.id, catalogs.c.name])
+                                  .where(catalogs.c.name.in_(names))
+                                  .order_by(catalogs.c.id))
+        for catalog_id, name in rows:
+            self.catalog_ids.setdefault(name, catalog_id)
+
+
+# =========Import=============
+def import_records(engine, records, kind='items', batch_size=1000,
+                   method='auto', on_batch=None, catalog_ids=None):
+    """
+    Inserts records in batches, one transaction per batch.
+
+    :param engine: the engine to import into.
+    :param records: an iterable of record dicts (@see read_records).
+    :param kind: "items" or "catalogs".
+    :param batch_size: the number of records per batch.
+    :param method: "copy" (PostgreSQL only), "executemany", or "auto" to use
+    COPY whenever the database supports it.
+    :param on_batch: called with the number of records imported so far
+    after every committed batch.
+    :param catalog_ids: a set that collects the ids of the catalogs items
+    were imported into, e.g. to invalidate their pages afterwards (@see
+    invalidate_import in webserver.py).
+
+    :return: the number of records imported.
+    """
+    if method == 'auto':
+        method = 'copy' if engine.dialect.name == 'postgresql' \
+            else 'executemany'
+    resolver = Resolver()
+    imported = 0
+    items = Item.__table__
+    search = kind == 'items' and engine.dialect.name == 'postgresql'
+    for batch in batches(records, batch_size):
+        with engine.begin() as connection:
+            if search:
+                # Ids are drawn from a sequence, so the batch's rows are
+                # the ones above the current maximum.
+                last_id = connection.execute(
+                    select([func.max(items.c.id)])).scalar() or 0
+            if kind == 'catalogs':
+                rows = _catalog_rows(connection, resolver, batch)
+            else:
+                rows = _item_rows(connection, resolver, batch)
+            table = Catalog.__table__ if kind == 'catalogs' \
+                else Item.__table__
+            if method == 'copy':
+                _copy(connection, table, rows)
+            else:
+                connection.execute(table.insert(), rows)
+            if kind == 'items':
+                # Core inserts skip the ORM hooks that maintain the counters.
+                counts = Counter(row['catalog_id'] for row in rows)
+                adjust_item_counts(connection, counts)
+                if catalog_ids is not None:
+                    catalog_ids.update(counts)
+            if search:
+                # Likewise for the search document, so that every committed
+                # batch is searchable.
+                connection.execute(items.update().where(and_(
+                    items.c.id > last_id,
+                    items.c.search_vector.is_(None))).values(
+                    search_vector=search_document(items.c.name,
+                                                  items.c.description)))
+        imported += len(batch)
+        if on_batch is not None:
+            on_batch(imported)
+    return imported
+
+
+def _catalog_rows(connection, resolver, batch):
+    user_ids = resolver.users(connection, [r['by'] for r in batch])
+    now = datetime.utcnow()
+    return [{'name': r['name'], 'user_id': user_ids[r['by']], 'version': 1,
+             'updated_at': now} for r in batch]
+
+
+def _item_rows(connection, resolver, batch):
+    user_ids = resolver.users(connection, [r['by'] for r in batch])
+    owners = {}
+    for record in batch:
+        owners.setdefault(record['catalog'], user_ids[record['by']])
+    catalog_ids = resolver.catalogs(connection, owners)
+    now = datetime.utcnow()
+    return [{'name': r['name'], 'description': r.get('description'),
+             'catalog_id': catalog_ids[r['catalog']],
+             'user_id': user_ids[r['by']], 'version': 1, 'updated_at': now}
+            for r in batch]
+
+
+def _copy(connection, table, rows):
+    """
+    Loads rows with PostgreSQL's COPY ... FROM STDIN.
+    """
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['\\N' if row[c] is None else row[c]
+                         for c in columns])
+    buffer.seek(0)
+    cursor = connection.connection.cursor()
+    cursor.copy_expert("COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL "
+                       "'\\N')".format(table.name, ', '.join(columns)),
+                       buffer)
+
+
+# =========Delete=============
+def delete_catalog_items(connection, catalog_id, limit=None):
+    """
+    Deletes the items of a catalog with set based statements, without
+    loading them (@see Catalog.items).
+
+    :param connection: the connection of the current transaction.
+    :param catalog_id: the id of the catalog.
+    :param limit: delete at most this many items, and keep the catalog's
+    item_count current. Without a limit the catalog is expected to be
+    deleted in the same transaction.
+
+    :return: the number of items deleted.
+    """
+    items = Item.__table__
+    if limit is None:
+        return connection.execute(items.delete().where(
+            items.c.catalog_id == catalog_id)).rowcount
+    chunk = select([items.c.id]).where(
+        items.c.catalog_id == catalog_id).limit(limit)
+    deleted = connection.execute(items.delete().where(
+        items.c.id.in_(chunk))).rowcount
+    adjust_item_counts(connection, {catalog_id: -deleted})
+    return deleted
+
+
+def delete_catalog(engine, catalog_id, chunk_size=5000, on_chunk=None):
+    """
+    Deletes a catalog of any size: its items in chunks, one transaction
+    each, so that no transaction holds locks on (or the database keeps undo
+    for) more than chunk_size rows, then the catalog itself. An interrupted
+    run can simply be repeated.
+
+    :param engine: the engine to delete from.
+    :param catalog_id: the id of the catalog.
+    :param chunk_size: the number of items deleted per transaction.
+    :param on_chunk: called with the number of items deleted so far after
+    every committed chunk.
+
+    :return: the number of items deleted.
+    """
+    deleted = 0
+    while True:
+        with engine.begin() as connection:
+            count = delete_catalog_items(connection, catalog_id, chunk_size)
+        if not count:
+            break
+        deleted += count
+        if on_chunk is not None:
+            on_chunk(deleted)
+    with engine.begin() as connection:
+        # Items added in the meantime go in the same transaction.
+        deleted += delete_catalog_items(connection, catalog_id)
+        catalogs = Catalog.__table__
+        connection.execute(catalogs.delete().where(
+            catalogs.c.id == catalog_id))
+    return deleted
+
+
+# =========Export=============
+def export_records(db_session, out, kind='items', fmt='ndjson',
+                   batch_size=1000):
+    """
+    Streams every item or catalog to out, in the format import_records
+    reads.
+
+    :param db_session: the session to read from.
+    :param out: a text file object.
+    :param kind: "items" or "catalogs".
+    :param fmt: "csv" or "ndjson".
+    :param batch_size: the number of rows fetched per round trip.
+
+    :return: the number of records exported.
+    """
+    if kind == 'catalogs':
+        query = catalog_rows(db_session).order_by(Catalog.id)
+        serialize = serialize_catalog
+    else:
+        query = item_rows(db_session).order_by(Item.id)
+        serialize = serialize_item
+
+    writer = None
+    if fmt == 'csv':
+        writer = csv.DictWriter(out, fieldnames=FIELDS[kind])
+        writer.writeheader()
+    exported = 0
+    for row in stream_rows(query, batch_size):
+        if writer is not None:
+            writer.writerow(serialize(row))
+        else:
+            out.write(json.dumps(serialize(row)) + '\n')
+        exported += 1
+    return exported
+
+
+class Progress(object):
+    """
+    Reports throughput as batches complete.
+    """
+
+    def __init__(self, report, offset=0):
+        self.report = report
+        self.offset = offset
+        self.start = time.time()
+
+    def __call__(self, done):
+        elapsed = max(time.time() - self.start, 1e-9)
+        self.report(done + self.offset, done / elapsed)
@@ -0,0 +1,253 @@
+from collections import OrderedDict
+
+import pickle
+import threading
+import time
+
+# Read-through cache for query results and rendered fragments.
+#
+# The default backend is an in-process LRU with a TTL. Each gunicorn worker
+# has its own copy, so an invalidation only reaches the worker that handled
+# the write and other workers may serve stale data for up to the TTL. For
+# multi-worker deployments plug in a SharedBackend (e.g. Redis), which every
+# worker sees.
+#
+# Whole groups of keys are invalidated through generations: a key embeds the
+# current generation of the group(s) it belongs to, and bumping a generation
+# makes every key built from the old value unreachable.
+
+MISSING = object()
+
+
+class NullBackend(object):
+    """
+    A backend that never stores anything, i.e. caching disabled.
+    """
+
+    def get(self, key):
+        return MISSING
+
+    def set(self, key, value, ttl):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def incr(self, key):
+        return 0
+
+    def generation(self, key):
+        return 0
+
+
+class MemoryBackend(object):
+    """
+    Thread safe in-process LRU cache with a per entry TTL.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        # Generations live outside the LRU: evicting one would reset it and
+        # could resurrect keys built from an older value.
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            expires, value = entry
+            if expires < time.time():
+                del self._entries[key]
+                return MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            value = self._counters.get(key, initial_generation()) + 1
+            self._counters[key] = value
+            return value
+
+    def generation(self, key):
+        with self._lock:
+            return self._counters.setdefault(key, initial_generation())
+
+
+class SharedBackend(object):
+    """
+    A backend shared between workers, on top of a Redis-like client (anything
+    with get, set(key, value, ex=seconds), delete and incr). Values are
+    pickled.
+    """
+
+    def __init__(self, client, prefix='katalog:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            return MISSING
+        return pickle.loads(raw)
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=int(ttl))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + 'gen:' + key)
+
+    def generation(self, key):
+        raw = self.client.get(self.prefix + 'gen:' + key)
+        if raw is None:
+            self.client.set(self.prefix + 'gen:' + key, initial_generation(),
+                            nx=True)
+            raw = self.client.get(self.prefix + 'gen:' + key)
+        return int(raw)
+
+
+class LocalClient(object):
+    """
+    A local, single process stand-in for a Redis client, so SharedBackend can
+    be used (and tested) without a Redis server.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.time():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key, value, ex=None, nx=False):
+        with self._lock:
+            if nx and key in self._data:
+                return None
+            expires = time.time() + ex if ex else None
+            self._data[key] = (value, expires)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            value = int(self._data.get(key, (0, None))[0]) + 1
+            self._data[key] = (value, None)
+            return value
+
+
+class Cache(object):
+    """
+    The cache used by the views. Counts hits and misses per backend.
+    """
+
+    def __init__(self, backend, ttl=60):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_set(self, key, create, ttl=None):
+        """
+        Returns the cached value for key, calling create() and caching its
+        result on a miss.
+
+        :param key: the cache key.
+        :param create: a function that computes the value.
+        :param ttl: seconds to keep the value for, defaults to self.ttl.
+
+        :return: the (possibly cached) value.
+        """
+        value = self.backend.get(key)
+        if value is not MISSING:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = create()
+        self.backend.set(key, value, ttl or self.ttl)
+        return value
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def generation(self, group):
+        """
+        :param group: the name of a group of keys, e.g. "catalog:4".
+
+        :return: the group's current generation, to be embedded in keys.
+        """
+        return self.backend.generation(group)
+
+    def invalidate(self, *groups):
+        """
+        Invalidates every key built from the current generation of each
+        group.
+
+        :param groups: the group names.
+        """
+        for group in groups:
+            self.backend.incr(group)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': float(self.hits) / total if total else 0.0
+        }
+
+
+def initial_generation():
+    """
+    Generations start from the clock rather than 0, so a restarted worker
+    (or an emptied shared cache) never reuses an older generation's keys.
+    """
+    return int(time.time() * 1000)
+
+
+def make_cache(backend='memory', ttl=60, max_entries=1024):
+    """
+    Builds a Cache from configuration.
+
+    :param backend: "memory" (the default), "null" to disable caching,
+    "local" for SharedBackend over LocalClient, or a redis:// URL (requires
+    the redis package).
+    :param ttl: the default time to live in seconds.
+    :param max_entries: the size of the in-process LRU.
+
+    :return: the Cache.
+    """
+    if backend == 'null':
+        return Cache(NullBackend(), ttl)
+    if backend == 'local':
+        return Cache(SharedBackend(LocalClient()), ttl)
+    if backend.startswith('redis://'):
+        import redis
+        return Cache(SharedBackend(redis.StrictRedis.from_url(backend)), ttl)
+    return Cache(MemoryBackend(max_entries), ttl)
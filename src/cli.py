@@ -0,0 +1,175 @@
+from flask import current_app
+from flask.cli import AppGroup
+
+from database import get_engine, KatalogSession
+from bulk import detect_format, read_records, import_records, \
+    export_records, load_checkpoint, save_checkpoint, Progress, \
+    delete_catalog
+import migrations
+import assets
+import jobs
+
+import click
+import itertools
+import logging
+import os
+
+# "flask katalog ..." commands, registered on the app in webserver.py. Run
+# them from src/ with FLASK_APP=webserver.
+katalog_cli = AppGroup('katalog', help="Katalog maintenance commands.")
+
+
+@katalog_cli.command('migrate')
+@click.option('--status', is_flag=True,
+              help="List the migrations and whether they were applied.")
+@click.option('--to', 'target', type=int,
+              help="Stop after this version.")
+def migrate_command(status, target):
+    """
+    Brings the database schema up to date (@see migrations.py).
+    """
+    if status:
+        for version, description, applied in migrations.status(get_engine()):
+            click.echo("{:>4} [{}] {}".format(
+                version, 'x' if applied else ' ', description))
+        return
+
+    def report(version, description):
+        click.echo("Applying {}: {}".format(version, description))
+
+    applied = migrations.migrate(get_engine(), target, report)
+    click.echo("Applied {} migration(s).".format(len(applied)))
+
+
+@katalog_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--kind', type=click.Choice(['items', 'catalogs']),
+              default='items', show_default=True)
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']),
+              help="Defaults to csv for .csv files and ndjson otherwise.")
+@click.option('--batch-size', default=1000, show_default=True)
+@click.option('--method', type=click.Choice(['auto', 'copy', 'executemany']),
+              default='auto', show_default=True,
+              help="auto uses COPY on PostgreSQL.")
+@click.option('--checkpoint', type=click.Path(dir_okay=False),
+              help="File recording progress; an interrupted import resumes "
+                   "from it.")
+@click.option('--queue', is_flag=True,
+              help="Leave the import to a worker (see the worker command), "
+                   "which must be able to read the file.")
+def import_command(path, kind, fmt, batch_size, method, checkpoint, queue):
+    """
+    Imports items or catalogs from a CSV or NDJSON file.
+    """
+    if queue:
+        db_session = KatalogSession()
+        try:
+            job = jobs.enqueue(db_session, 'import', {
+                'path': os.path.abspath(path), 'kind': kind,
+                'format': detect_format(path, fmt),
+                'batch_size': batch_size})
+            db_session.commit()
+            click.echo("Queued job {}.".format(job.id))
+        finally:
+            db_session.close()
+        return
+
+    skip = load_checkpoint(checkpoint, path)
+    if skip:
+        click.echo("Resuming after {} records.".format(skip))
+
+    progress = Progress(lambda done, rate: click.echo(
+        "{} records ({:.0f} rows/sec)".format(done, rate), err=True), skip)
+
+    def on_batch(done):
+        save_checkpoint(checkpoint, path, skip + done)
+        progress(done)
+
+    # The app is loaded by now (FLASK_APP), so this is no circular import.
+    from webserver import invalidate_import
+    catalog_ids = set()
+    try:
+        with open(path, newline='') as stream:
+            records = itertools.islice(
+                read_records(stream, detect_format(path, fmt)), skip, None)
+            imported = import_records(get_engine(), records, kind,
+                                      batch_size, method, on_batch,
+                                      catalog_ids)
+    finally:
+        invalidate_import(kind, catalog_ids)
+    click.echo("Imported {} {}.".format(imported, kind))
+
+
+@katalog_cli.command('export')
+@click.argument('path', type=click.File('w'))
+@click.option('--kind', type=click.Choice(['items', 'catalogs']),
+              default='items', show_default=True)
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']),
+              help="Defaults to csv for .csv files and ndjson otherwise.")
+@click.option('--batch-size', default=1000, show_default=True)
+def export_command(path, kind, fmt, batch_size):
+    """
+    Exports every item or catalog to a CSV or NDJSON file ("-" for stdout),
+    in the format the import command reads.
+    """
+    db_session = KatalogSession()
+    try:
+        exported = export_records(db_session, path, kind,
+                                  detect_format(path.name, fmt), batch_size)
+    finally:
+        db_session.close()
+    click.echo("Exported {} {}.".format(exported, kind), err=True)
+
+
+@katalog_cli.command('delete-catalog')
+@click.argument('catalog_id', type=int)
+@click.option('--chunk-size', default=5000, show_default=True,
+              help="Items deleted per transaction.")
+def delete_catalog_command(catalog_id, chunk_size):
+    """
+    Deletes a catalog and its items in chunks, e.g. one too large to delete
+    through the app in a single transaction. Safe to rerun if interrupted.
+    """
+    progress = Progress(lambda done, rate: click.echo(
+        "{} items ({:.0f} rows/sec)".format(done, rate), err=True))
+    deleted = delete_catalog(get_engine(), catalog_id, chunk_size, progress)
+    # The app is loaded by now (FLASK_APP), so this is no circular import.
+    from webserver import invalidate_deleted_catalog
+    invalidate_deleted_catalog(catalog_id)
+    click.echo("Deleted catalog {} and {} item(s).".format(catalog_id,
+                                                           deleted))
+
+
+@katalog_cli.command('worker')
+@click.option('--threads', default=4, show_default=True,
+              help="Jobs run at the same time.")
+@click.option('--poll-interval', default=1.0, show_default=True,
+              help="Seconds to wait when no job is due.")
+@click.option('--burst', is_flag=True,
+              help="Exit once no job is queued or running.")
+def worker_command(threads, poll_interval, burst):
+    """
+    Runs background jobs (@see jobs.py) until interrupted.
+    """
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(threadName)s %(message)s')
+    worker = jobs.Worker(get_engine(), threads, poll_interval)
+    click.echo("Worker {} running {} thread(s) for: {}".format(
+        worker.id, threads, ', '.join(sorted(jobs.HANDLERS))), err=True)
+    worker.run(burst)
+    click.echo("Processed {} job(s).".format(worker.processed), err=True)
+
+
+@katalog_cli.command('assets')
+@click.option('--verbose', is_flag=True, help="List every file built.")
+def assets_command(verbose):
+    """
+    Builds the fingerprinted, compressed static assets (@see assets.py).
+    """
+    def report(source, built):
+        if verbose:
+            click.echo("{} -> {}".format(source, built))
+
+    manifest = assets.build(current_app.static_folder, report)
+    click.echo("Built {} file(s) into {}/{}.".format(
+        len(manifest['files']), current_app.static_folder, assets.DIST))
@@ -0,0 +1,87 @@
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Response compression, negotiated per request (@see compress_response in
+# webserver.py). Brotli is offered when the brotli package is installed,
+# gzip always. Built static assets are compressed ahead of time instead
+# (@see assets.py).
+#
+# A compressed response is a different representation from the plain one, so
+# it gets its own strong ETag: the plain ETag with the encoding appended
+# (@see variant_etag), as Apache does.
+
+COMPRESSIBLE = {'text/html', 'text/plain', 'text/css', 'text/javascript',
+                'application/javascript', 'application/json',
+                'application/x-ndjson', 'image/svg+xml'}
+
+GZIP_LEVEL = 6
+# Brotli's default of 11 is meant for compressing ahead of time; 4 to 5
+# beats gzip -6 on size at a similar speed.
+BROTLI_QUALITY = 5
+
+
+def encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate(accept_encodings):
+    """
+    :param accept_encodings: the request's parsed Accept-Encoding header.
+
+    :return: the encoding to use, or None to send the response as is.
+    """
+    return accept_encodings.best_match(encodings())
+
+
+def compress(data, encoding):
+    """
+    :param data: the body, as bytes.
+    :param encoding: "br" or "gzip".
+
+    :return: the compressed body.
+    """
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, GZIP_LEVEL)
+
+
+def compress_stream(chunks, encoding):
+    """
+    Compresses a streamed body chunk by chunk, keeping memory use flat.
+
+    :param chunks: an iterable of str or bytes.
+    :param encoding: "br" or "gzip".
+
+    :return: a generator of compressed chunks.
+    """
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        process, finish = compressor.process, compressor.finish
+    else:
+        # wbits 31 selects the gzip container.
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        process, finish = compressor.compress, compressor.flush
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = process(chunk)
+            if data:
+                yield data
+        yield finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def variant_etag(etag, encoding):
+    """
+    :return: the ETag of the encoding's representation of a response whose
+    plain ETag is etag.
+    """
+    return '{}-{}'.format(etag, encoding)
@@ -0,0 +1,75 @@
+import base64
+import hashlib
+import hmac
+import secrets
+import time
+
+# Stateless CSRF tokens. A token is the time it was issued, a random nonce
+# and an HMAC of both (and of whom it was issued to) under the app's secret
+# key, so checking one needs nothing but the key: pages that embed a token no
+# longer write it to the session, the session cookie is not re-issued on
+# every page view, and tokens from several open tabs are all valid at once.
+#
+# Tokens are bound to the signed in user or, before signing in, to a random
+# nonce in the visitor's session (@see csrf_subject in webserver.py), so a
+# token leaked from one account or browser is useless in another. They expire
+# after CSRF_TOKEN_MAX_AGE seconds.
+
+NONCE_BYTES = 16
+
+
+def _signature(key, issued, nonce, subject):
+    message = '{}.{}.{}'.format(issued, nonce, subject).encode('utf-8')
+    digest = hmac.new(key, message, hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
+
+
+def _key(secret):
+    return secret if isinstance(secret, bytes) else secret.encode('utf-8')
+
+
+def new_nonce():
+    """
+    :return: a random value to bind an anonymous visitor's tokens to, kept in
+    their session.
+    """
+    return secrets.token_urlsafe(NONCE_BYTES)
+
+
+def make_token(secret, subject='', now=None):
+    """
+    :param secret: the app's secret key.
+    :param subject: whom the token is for, e.g. the user id.
+    :param now: the issue time, defaults to the current time.
+
+    :return: a new token.
+    """
+    issued = int(time.time() if now is None else now)
+    nonce = secrets.token_urlsafe(NONCE_BYTES)
+    return '{}.{}.{}'.format(issued, nonce,
+                             _signature(_key(secret), issued, nonce, subject))
+
+
+def check_token(token, secret, subject='', max_age=3600, now=None):
+    """
+    :param token: the token received.
+    :param secret: the app's secret key.
+    :param subject: whom the token must have been issued to.
+    :param max_age: how long, in seconds, a token stays valid.
+    :param now: the current time, defaults to time.time().
+
+    :return: True if the token was issued by us to subject at most max_age
+    seconds ago.
+    """
+    try:
+        issued, nonce, signature = token.split('.')
+        issued = int(issued)
+    except (AttributeError, ValueError):
+        return False
+    now = time.time() if now is None else now
+    if not 0 <= now - issued <= max_age:
+        return False
+    expected = _signature(_key(secret), issued, nonce, subject)
+    # As bytes: compare_digest rejects str with non-ASCII characters.
+    return hmac.compare_digest(expected.encode('ascii'),
+                               signature.encode('utf-8', 'replace'))
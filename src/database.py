@@ -0,0 +1,201 @@
+from flask import _app_ctx_stack
+from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import Session, sessionmaker, scoped_session
+from sqlalchemy.pool import QueuePool
+from contextlib import contextmanager
+
+import metrics
+import profiling
+
+import itertools
+import os
+import threading
+import time
+
+# The one place engines are created. Every gunicorn worker holds a single
+# pool of at most DB_POOL_SIZE + DB_MAX_OVERFLOW connections, so PostgreSQL's
+# max_connections has to be at least
+#     workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+# plus whatever the CLI commands and background jobs use, and as many again
+# on every read replica.
+#
+# READ_REPLICA_URLS optionally lists (comma separated) read replicas of
+# DATABASE_URL. Sessions marked read only (@see KatalogSession.use_replica)
+# then read from one of them, taken round-robin; everything else stays on the
+# primary.
+
+if os.getenv("DATABASE_URL"):
+    DATABASE_URL = os.environ['DATABASE_URL']
+else:
+    DATABASE_URL = 'postgres:///catalog'
+
+READ_REPLICA_URLS = [url.strip() for url in
+                     os.getenv("READ_REPLICA_URLS", "").split(',')
+                     if url.strip()]
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    A QueuePool that reports how long each checkout waited for a connection
+    to on_checkout_wait (@see metrics.py).
+    """
+    on_checkout_wait = None
+
+    def _do_get(self):
+        start = time.time()
+        try:
+            return super(InstrumentedQueuePool, self)._do_get()
+        finally:
+            if self.on_checkout_wait is not None:
+                self.on_checkout_wait(time.time() - start)
+
+
+def engine_options(url, environ=os.environ):
+    """
+    Builds create_engine() arguments from the environment:
+
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT: QueuePool sizing.
+    DB_POOL_PRE_PING: test connections on checkout (default on).
+    DB_POOL_RECYCLE: seconds after which connections are replaced.
+    DB_STATEMENT_TIMEOUT: PostgreSQL statement_timeout in milliseconds.
+
+    :param url: the database URL.
+    :param environ: where to read the settings from.
+
+    :return: the keyword arguments.
+    """
+    options = {
+        'pool_pre_ping': environ.get('DB_POOL_PRE_PING', 'true').lower() in (
+            '1', 'true', 'yes', 'on'),
+        'pool_recycle': int(environ.get('DB_POOL_RECYCLE', 1800)),
+    }
+    backend = make_url(url).get_backend_name()
+    if backend == 'sqlite':
+        # SQLite uses its own pools, which take none of the sizing options.
+        return options
+
+    options.update({
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': int(environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': int(environ.get('DB_POOL_TIMEOUT', 30)),
+    })
+    timeout = environ.get('DB_STATEMENT_TIMEOUT')
+    if timeout and backend in ('postgres', 'postgresql'):
+        options['connect_args'] = {
+            'options': '-c statement_timeout={}'.format(int(timeout))}
+    return options
+
+
+def make_engine(url=None, **overrides):
+    """
+    Creates an engine configured from the environment (@see engine_options).
+
+    :param url: the database URL, defaults to DATABASE_URL.
+    :param overrides: create_engine() arguments that take precedence.
+
+    :return: the engine.
+    """
+    url = url or DATABASE_URL
+    options = engine_options(url)
+    options.update(overrides)
+    return create_engine(url, **options)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """
+    The process wide engine, created (and instrumented, @see metrics.py and
+    profiling.py) on first use. Importing the app never touches the
+    database; the first connection is only made by the first query.
+
+    :return: the engine.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = instrumented(make_engine())
+    return _engine
+
+
+_replicas = None
+_next_replica = itertools.count()
+
+
+def get_replica_engines():
+    """
+    The engines of READ_REPLICA_URLS, created on first use like get_engine().
+
+    :return: the engines, [] if there are no replicas.
+    """
+    global _replicas
+    if _replicas is None:
+        with _engine_lock:
+            if _replicas is None:
+                _replicas = [instrumented(make_engine(url))
+                             for url in READ_REPLICA_URLS]
+    return _replicas
+
+
+def next_replica():
+    """
+    :return: the replica engine next in turn, or None if there are none.
+    """
+    engines = get_replica_engines()
+    if not engines:
+        return None
+    return engines[next(_next_replica) % len(engines)]
+
+
+def instrumented(engine):
+    metrics.instrument_engine(engine)
+    profiling.instrument_engine(engine)
+    return engine
+
+
+class KatalogSession(Session):
+    """
+    A session that binds to get_engine() when it first needs a connection.
+    Once use_replica() is called it reads from a replica instead, the same
+    one for the rest of the session, while flushes (and anything inside
+    using_primary()) still go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = self.info.get('replica')
+        if replica is not None and not self._flushing and \
+                not self.info.get('primary'):
+            return replica
+        return get_engine()
+
+    def use_replica(self):
+        """
+        Sends the session's reads to the next replica, if there is any.
+        """
+        self.info['replica'] = next_replica()
+
+    @contextmanager
+    def using_primary(self):
+        """
+        Reads from the primary within the block, e.g. for authorization
+        checks, which must not act on a lagging replica.
+        """
+        previous = self.info.get('primary')
+        self.info['primary'] = True
+        try:
+            yield self
+        finally:
+            self.info['primary'] = previous
+
+
+# One session per thread (or greenlet, under gevent), which serves one request
+# at a time; handlers, authorization checks and user lookups all share it, and
+# webserver.py removes it when the request's app context is torn down, so the
+# next request on the thread starts afresh. CLI commands get their thread's.
+DBSession = scoped_session(sessionmaker(class_=KatalogSession),
+                           scopefunc=_app_ctx_stack.__ident_func__)
@@ -0,0 +1,298 @@
+from sqlalchemy import select, and_, or_, func
+
+from models import Job
+from datetime import datetime, timedelta
+
+import json
+import logging
+import os
+import socket
+import threading
+import traceback
+
+# Background jobs: slow work taken off the request path. Handlers queue a job
+# (a row of the jobs table, @see models.Job) and answer 202 with the URL of
+# its status (@see job_json in webserver.py); "flask katalog worker"
+# (@see cli.py) runs the jobs in a pool of threads.
+#
+# Claiming a job is a conditional UPDATE ... WHERE status = 'queued', so any
+# number of workers can share the table, on PostgreSQL without blocking each
+# other (SKIP LOCKED). A failed attempt is retried after an exponential
+# backoff until max_attempts is reached. Publishing progress is the running
+# job's heartbeat: a job whose worker has not been heard from for longer than
+# the timeout is taken to be dead and claimed again (or failed, if that was
+# its last attempt), so handlers must be safe to run twice, and long ones
+# must report progress more often than that. A worker that lost its job that
+# way can no longer record progress or an outcome for it (@see Lost).
+#
+# Each kind of job can be limited to a number of concurrent runs per worker
+# process (@see handler), e.g. to keep large deletes from competing with each
+# other for locks.
+
+log = logging.getLogger('katalog.jobs')
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+RETRY_DELAY = 5
+TIMEOUT = 3600
+
+HANDLERS = {}
+
+
+class Lost(Exception):
+    """
+    Raised by progress() in a handler whose job was claimed by another worker
+    after it went silent for longer than the timeout.
+    """
+
+
+class Handler(object):
+    """
+    A registered kind of job (@see handler).
+    """
+
+    def __init__(self, function, concurrency):
+        self.function = function
+        self.concurrency = concurrency
+
+
+def handler(kind, concurrency=None):
+    """
+    Registers the decorated function(payload, progress) as the handler of a
+    kind of job. It receives the job's payload, may call progress(dict) to
+    publish how far it got, and returns the (JSON serializable) result.
+    progress() raises Lost if the job has been taken over meanwhile.
+
+    :param kind: the name of the kind of job.
+    :param concurrency: how many jobs of this kind a worker runs at most at
+    the same time, defaults to no limit beyond the worker's threads.
+    """
+    def register(function):
+        HANDLERS[kind] = Handler(function, concurrency)
+        return function
+    return register
+
+
+def enqueue(db_session, kind, payload, user_id=None, max_attempts=3):
+    """
+    Queues a job. The caller commits.
+
+    :param db_session: the session to add the job to.
+    :param kind: the kind of job (@see handler).
+    :param payload: its JSON serializable arguments.
+    :param user_id: the user on whose behalf it runs, if any.
+    :param max_attempts: how often to try before giving up.
+
+    :return: the Job, with its id.
+    """
+    job = Job(kind=kind, payload=json.dumps(payload), user_id=user_id,
+              max_attempts=max_attempts, status=QUEUED)
+    db_session.add(job)
+    db_session.flush()
+    return job
+
+
+def describe(job):
+    """
+    :return: the job's status as a JSON serializable dict.
+    """
+    return {'id': job.id, 'kind': job.kind, 'status': job.status,
+            'attempts': job.attempts, 'max_attempts': job.max_attempts,
+            'result': json.loads(job.result) if job.result else None,
+            'error': job.error.splitlines()[-1] if job.error else None,
+            'created_at': job.created_at.isoformat() + 'Z',
+            'updated_at': job.updated_at.isoformat() + 'Z'}
+
+
+# =========Worker=============
+def claim(engine, worker_id, kinds, timeout=TIMEOUT):
+    """
+    Takes the oldest job of one of the given kinds that is due, or whose
+    worker has not been heard from for longer than timeout seconds. Such a
+    job that has no attempts left fails instead.
+
+    :return: (id, kind, payload) of the claimed job, or None.
+    """
+    jobs = Job.__table__
+    now = datetime.utcnow()
+    lost = and_(jobs.c.status == RUNNING, jobs.c.kind.in_(kinds),
+                jobs.c.locked_at < now - timedelta(seconds=timeout))
+    due = or_(and_(jobs.c.status == QUEUED, jobs.c.run_at <= now),
+              and_(lost, jobs.c.attempts < jobs.c.max_attempts))
+    with engine.begin() as connection:
+        # A job that keeps taking its worker down (e.g. out of memory) must
+        # not be run again forever.
+        connection.execute(jobs.update().where(and_(
+            lost, jobs.c.attempts >= jobs.c.max_attempts)).values(
+            status=FAILED, locked_by=None, updated_at=now,
+            error="Lost its worker on each of its attempts"))
+        row = connection.execute(
+            select([jobs.c.id, jobs.c.kind, jobs.c.payload, jobs.c.status])
+            .where(and_(due, jobs.c.kind.in_(kinds)))
+            .order_by(jobs.c.run_at, jobs.c.id).limit(1)
+            .with_for_update(skip_locked=True)).first()
+        if row is None:
+            return None
+        # Only one worker can move the job on from the status it read.
+        claimed = connection.execute(jobs.update().where(and_(
+            jobs.c.id == row.id, jobs.c.status == row.status)).values(
+            status=RUNNING, locked_by=worker_id, locked_at=now,
+            attempts=jobs.c.attempts + 1, updated_at=now)).rowcount
+    if not claimed:
+        return None
+    return row.id, row.kind, json.loads(row.payload)
+
+
+def finish(engine, job_id, worker_id, result=None, error=None,
+           retry_delay=RETRY_DELAY):
+    """
+    Records the outcome of an attempt: the job is done, queued again after
+    retry_delay * 2 ** (attempts - 1) seconds, or failed for good.
+
+    :return: the job's new status, or None if worker_id no longer holds the
+    job, in which case nothing is recorded.
+    """
+    jobs = Job.__table__
+    now = datetime.utcnow()
+    held = and_(jobs.c.id == job_id, jobs.c.status == RUNNING,
+                jobs.c.locked_by == worker_id)
+    with engine.begin() as connection:
+        if error is None:
+            updated = connection.execute(jobs.update().where(held).values(
+                status=DONE, result=json.dumps(result), error=None,
+                locked_by=None, updated_at=now)).rowcount
+            return DONE if updated else None
+        row = connection.execute(select(
+            [jobs.c.attempts, jobs.c.max_attempts]).where(held)).first()
+        if row is None:
+            return None
+        status = QUEUED if row.attempts < row.max_attempts else FAILED
+        updated = connection.execute(jobs.update().where(held).values(
+            status=status, error=error, locked_by=None, updated_at=now,
+            run_at=now + timedelta(
+                seconds=retry_delay * 2 ** (row.attempts - 1)))).rowcount
+        return status if updated else None
+
+
+def progress(engine, job_id, worker_id, state):
+    """
+    Publishes a running job's progress in its result, and renews worker_id's
+    hold on it.
+
+    :raise Lost: if worker_id no longer holds the job.
+    """
+    jobs = Job.__table__
+    now = datetime.utcnow()
+    with engine.begin() as connection:
+        updated = connection.execute(jobs.update().where(and_(
+            jobs.c.id == job_id, jobs.c.status == RUNNING,
+            jobs.c.locked_by == worker_id)).values(
+            result=json.dumps(state), locked_at=now, updated_at=now)).rowcount
+    if not updated:
+        raise Lost(job_id)
+
+
+def pending(engine, kinds):
+    """
+    :return: the number of jobs of the given kinds queued or running.
+    """
+    jobs = Job.__table__
+    with engine.begin() as connection:
+        return connection.execute(select([func.count(jobs.c.id)]).where(and_(
+            jobs.c.status.in_([QUEUED, RUNNING]),
+            jobs.c.kind.in_(kinds)))).scalar()
+
+
+class Worker(object):
+    """
+    Runs jobs on a number of threads until stopped.
+    """
+
+    def __init__(self, engine, threads=4, poll_interval=1.0,
+                 retry_delay=RETRY_DELAY, timeout=TIMEOUT):
+        self.engine = engine
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+        self.id = '{}:{}'.format(socket.gethostname(), os.getpid())
+        self.processed = 0
+        self._running = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def run_one(self):
+        """
+        Claims and runs one job, if any is due.
+
+        :return: True if a job was run.
+        """
+        # Claims are made one at a time, so the limits are never overrun.
+        with self._lock:
+            kinds = [kind for kind, h in HANDLERS.items()
+                     if h.concurrency is None or
+                     self._running.get(kind, 0) < h.concurrency]
+            if not kinds:
+                return False
+            # Each thread holds its jobs in its own name, so that a job taken
+            # over by another thread of this process is not finished twice.
+            worker_id = '{}:{}'.format(self.id,
+                                       threading.current_thread().name)
+            job = claim(self.engine, worker_id, kinds, self.timeout)
+            if job is None:
+                return False
+            job_id, kind, payload = job
+            self._running[kind] = self._running.get(kind, 0) + 1
+        try:
+            result = HANDLERS[kind].function(
+                payload, lambda state: progress(self.engine, job_id,
+                                                worker_id, state))
+            if finish(self.engine, job_id, worker_id, result):
+                log.info("Job %d (%s) done", job_id, kind)
+            else:
+                log.warning("Job %d (%s) done, but it was taken over",
+                            job_id, kind)
+        except Lost:
+            log.warning("Job %d (%s) was taken over, abandoned", job_id, kind)
+        except Exception:
+            status = finish(self.engine, job_id, worker_id,
+                            error=traceback.format_exc(),
+                            retry_delay=self.retry_delay)
+            log.exception("Job %d (%s) failed, now %s", job_id, kind, status)
+        finally:
+            with self._lock:
+                self._running[kind] -= 1
+                self.processed += 1
+        return True
+
+    def _loop(self, burst):
+        while not self._stop.is_set():
+            if not self.run_one():
+                if burst and not pending(self.engine, list(HANDLERS)):
+                    return
+                self._stop.wait(self.poll_interval)
+
+    def run(self, burst=False):
+        """
+        Runs jobs until stop() is called or, in burst mode, until no job of a
+        kind it handles is queued or running any more.
+        """
+        workers = [threading.Thread(target=self._loop, args=(burst,),
+                                    name='job-worker-%d' % n, daemon=True)
+                   for n in range(self.threads)]
+        for thread in workers:
+            thread.start()
+        try:
+            for thread in workers:
+                while thread.is_alive():
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            self.stop()
+            for thread in workers:
+                thread.join()
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,121 @@
+from sqlalchemy import event
+
+import bisect
+import threading
+import time
+
+# Process wide metrics, rendered in the Prometheus text format at /metrics.
+# Every gunicorn worker keeps its own, so scrape each worker (or sum them).
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram(object):
+    """
+    Cumulative bucket histogram of durations in seconds.
+    """
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS, labels=None):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        # e.g. 'route="GET /items/"', added to every sample.
+        self.labels = labels
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.total += value
+
+    def render(self, header=True):
+        """
+        :param header: whether to start with the HELP and TYPE lines, which
+        appear once per name even if several label sets share it.
+        """
+        lines = []
+        if header:
+            lines += ['# HELP {} {}'.format(self.name, self.help_text),
+                      '# TYPE {} histogram'.format(self.name)]
+        labels = self.labels + ',' if self.labels else ''
+        suffix = '{' + self.labels + '}' if self.labels else ''
+        with self._lock:
+            cumulative = 0
+            for bound, count in zip(self.buckets, self.counts):
+                cumulative += count
+                lines.append('{}_bucket{{{}le="{}"}} {}'.format(
+                    self.name, labels, bound, cumulative))
+            cumulative += self.counts[-1]
+            lines.append('{}_bucket{{{}le="+Inf"}} {}'.format(
+                self.name, labels, cumulative))
+            lines.append('{}_sum{} {}'.format(self.name, suffix, self.total))
+            lines.append('{}_count{} {}'.format(self.name, suffix,
+                                                cumulative))
+        return lines
+
+
+checkout_wait = Histogram('katalog_db_pool_checkout_seconds',
+                          "Time spent waiting for a pooled connection.")
+query_duration = Histogram('katalog_db_query_seconds',
+                           "Time spent executing SQL statements.")
+
+
+def instrument_engine(engine):
+    """
+    Records query durations and, for an InstrumentedQueuePool
+    (@see database.py), checkout waits of engine.
+
+    :param engine: the engine to instrument.
+    """
+    if hasattr(engine.pool, 'on_checkout_wait'):
+        engine.pool.on_checkout_wait = checkout_wait.observe
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_timer(conn, cursor, statement, parameters, context,
+                    executemany):
+        conn.info.setdefault('query_start', []).append(time.time())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def stop_timer(conn, cursor, statement, parameters, context,
+                   executemany):
+        query_duration.observe(time.time() - conn.info['query_start'].pop())
+
+
+def gauge(name, help_text, value):
+    return ['# HELP {} {}'.format(name, help_text),
+            '# TYPE {} gauge'.format(name),
+            '{} {}'.format(name, value)]
+
+
+def render(engine, cache=None):
+    """
+    :param engine: the engine whose pool is reported.
+    :param cache: the view cache (@see cache.py), if its counters should be
+    included.
+
+    :return: the metrics in the Prometheus text format.
+    """
+    lines = []
+    pool = engine.pool
+    if hasattr(pool, 'checkedout'):
+        lines += gauge('katalog_db_pool_size', "Configured pool size.",
+                       pool.size())
+        lines += gauge('katalog_db_pool_checked_out',
+                       "Connections currently in use.", pool.checkedout())
+        lines += gauge('katalog_db_pool_checked_in',
+                       "Idle connections in the pool.", pool.checkedin())
+        lines += gauge('katalog_db_pool_overflow',
+                       "Connections open beyond pool_size (negative while "
+                       "the pool is not yet full).", pool.overflow())
+    lines += checkout_wait.render()
+    lines += query_duration.render()
+    if cache is not None:
+        stats = cache.stats()
+        lines += gauge('katalog_cache_hits', "View cache hits.",
+                       stats['hits'])
+        lines += gauge('katalog_cache_misses', "View cache misses.",
+                       stats['misses'])
+    return '\n'.join(lines) + '\n'
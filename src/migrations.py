@@ -0,0 +1,178 @@
+from sqlalchemy import Table, Column, Integer, String, DateTime, MetaData, \
+    inspect, select, text, func
+from sqlalchemy.dialects.postgresql import TSVECTOR
+
+from models import Base, Item, Catalog, Job, search_document
+from datetime import datetime
+
+# Versioned schema migrations, applied in order by "flask katalog migrate"
+# (@see cli.py) instead of every worker running create_all at import.
+#
+# Migration 1 creates any missing table in its current shape, so a fresh
+# database is complete after it; the later ones bring databases created by
+# earlier versions of the app up to date. Every migration therefore checks
+# what already exists before changing anything. New migrations are appended
+# with the next version number and must never be edited once released.
+
+ADVISORY_LOCK_ID = 7242601
+
+schema_migrations = Table(
+    'schema_migrations', MetaData(),
+    Column('version', Integer, primary_key=True),
+    Column('description', String(250), nullable=False),
+    Column('applied_at', DateTime, nullable=False))
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """
+    Registers the decorated function(connection) as a migration.
+    """
+    def register(upgrade):
+        MIGRATIONS.append((version, description, upgrade))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return upgrade
+    return register
+
+
+# =========Helpers=============
+def has_column(connection, table, column):
+    return column in [c['name'] for c in
+                      inspect(connection).get_columns(table)]
+
+
+def create_missing_indexes(connection, table, names):
+    existing = [i['name'] for i in inspect(connection).get_indexes(
+        table.name)]
+    for index in table.indexes:
+        if index.name in names and index.name not in existing:
+            index.create(connection)
+
+
+def add_column(connection, table, column, ddl):
+    if not has_column(connection, table, column):
+        connection.execute(text('ALTER TABLE {} ADD COLUMN {} {}'.format(
+            table, column, ddl)))
+
+
+def recount_items(connection):
+    """
+    Recomputes every Catalog.item_count from the items table.
+    """
+    catalogs, items = Catalog.__table__, Item.__table__
+    connection.execute(catalogs.update().values(item_count=select(
+        [func.count(items.c.id)]).where(
+        items.c.catalog_id == catalogs.c.id).as_scalar()))
+
+
+# =========Migrations=============
+@migration(1, "Create the users, catalogs and items tables")
+def create_tables(connection):
+    Base.metadata.create_all(connection)
+
+
+@migration(2, "Index the foreign keys of catalogs and items")
+def index_foreign_keys(connection):
+    create_missing_indexes(connection, Catalog.__table__,
+                           ['ix_catalogs_user_id'])
+    create_missing_indexes(connection, Item.__table__,
+                           ['ix_items_user_id', 'ix_items_catalog_id'])
+
+
+@migration(3, "Add version and updated_at to catalogs and items")
+def add_versions(connection):
+    postgresql = connection.dialect.name == 'postgresql'
+    for table in ('catalogs', 'items'):
+        add_column(connection, table, 'version', 'INTEGER NOT NULL DEFAULT 1')
+        if not has_column(connection, table, 'updated_at'):
+            add_column(connection, table, 'updated_at',
+                       'TIMESTAMP WITHOUT TIME ZONE' if postgresql
+                       else 'DATETIME')
+            connection.execute(text(
+                'UPDATE {} SET updated_at = :now'.format(table)),
+                now=datetime.utcnow())
+            if postgresql:
+                connection.execute(text(
+                    'ALTER TABLE {} ALTER COLUMN updated_at SET NOT NULL'
+                    .format(table)))
+
+
+@migration(4, "Add the full text search document to items")
+def add_search_vector(connection):
+    items = Item.__table__
+    if connection.dialect.name != 'postgresql':
+        add_column(connection, 'items', 'search_vector', 'TEXT')
+        return
+    if not has_column(connection, 'items', 'search_vector'):
+        add_column(connection, 'items', 'search_vector',
+                   TSVECTOR().compile(dialect=connection.dialect))
+        connection.execute(items.update().values(
+            search_vector=search_document(items.c.name,
+                                          items.c.description)))
+    create_missing_indexes(connection, items, ['ix_items_search_vector'])
+
+
+@migration(5, "Add item_count to catalogs")
+def add_item_counts(connection):
+    if has_column(connection, 'catalogs', 'item_count'):
+        return
+    add_column(connection, 'catalogs', 'item_count', 'INTEGER NOT NULL '
+                                                     'DEFAULT 0')
+    recount_items(connection)
+
+
+@migration(6, "Create the jobs table")
+def create_jobs(connection):
+    Job.__table__.create(connection, checkfirst=True)
+
+
+# =========Runner=============
+def applied_versions(connection):
+    schema_migrations.create(connection, checkfirst=True)
+    return set(row.version for row in connection.execute(
+        select([schema_migrations.c.version])))
+
+
+def migrate(engine, target=None, report=None):
+    """
+    Applies every pending migration up to target, each in its own
+    transaction. On PostgreSQL an advisory lock makes concurrent runs wait
+    for each other instead of racing.
+
+    :param engine: the engine of the database to migrate.
+    :param target: the highest version to apply, defaults to all of them.
+    :param report: called with (version, description) before each migration.
+
+    :return: the versions applied.
+    """
+    applied = []
+    for version, description, upgrade in MIGRATIONS:
+        if target is not None and version > target:
+            break
+        with engine.begin() as connection:
+            if connection.dialect.name == 'postgresql':
+                connection.execute(text('SELECT pg_advisory_xact_lock(:id)'),
+                                   id=ADVISORY_LOCK_ID)
+            if version in applied_versions(connection):
+                continue
+            if report is not None:
+                report(version, description)
+            upgrade(connection)
+            connection.execute(schema_migrations.insert().values(
+                version=version, description=description,
+                applied_at=datetime.utcnow()))
+        applied.append(version)
+    return applied
+
+
+def status(engine):
+    """
+    :param engine: the engine of the database to inspect.
+
+    :return: (version, description, applied) tuples for every migration.
+    """
+    with engine.begin() as connection:
+        done = applied_versions(connection)
+    return [(version, description, version in done)
+            for version, description, _ in MIGRATIONS]
@@ -1,15 +1,11 @@
-from sqlalchemy import Column, ForeignKey, Integer, String
+from sqlalchemy import Column, ForeignKey, Integer, String, DateTime, \
+    Text, Index, event, func, inspect
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
-from sqlalchemy import create_engine
-
-import os
+from sqlalchemy.orm import relationship, deferred
+from datetime import datetime
 
 Base = declarative_base()
-if os.getenv("DATABASE_URL"):
-    DATABASE_URL = os.environ['DATABASE_URL']
-else:
-    DATABASE_URL = 'postgres:///catalog'
 
 
 class User(Base):
@@ -33,11 +29,26 @@ class Catalog(Base):
 
     id = Column(Integer, primary_key=True)
     name = Column(String(250), nullable=False)
-    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False,
+                     index=True)
+    # Bumped by SQLAlchemy on every UPDATE (@see version_id_col); used for
+    # ETags and optimistic concurrency: a write to a row written by someone
+    # else since it was loaded answers 409 (@see commit_write).
+    version = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow,
+                        onupdate=datetime.utcnow)
+    # Number of items in the catalog (@see adjust_item_counts). Not covered
+    # by version, so adding items never conflicts with renaming the catalog.
+    item_count = Column(Integer, nullable=False, default=0,
+                        server_default='0')
+
+    __mapper_args__ = {'version_id_col': version}
 
     user = relationship("User", back_populates="catalogs")
+    # Deleting a catalog never loads its items: they are removed with one
+    # set based DELETE (@see bulk.delete_catalog_items) before the catalog.
     items = relationship("Item", back_populates="catalog",
-                         cascade="all, delete-orphan")
+                         cascade="all, delete-orphan", passive_deletes=True)
 
     @property
     def serialize(self):
@@ -53,8 +64,24 @@ class Item(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String(80), nullable=False)
     description = Column(String(250))
-    catalog_id = Column(Integer, ForeignKey('catalogs.id'), nullable=False)
-    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    catalog_id = Column(Integer, ForeignKey('catalogs.id'), nullable=False,
+                        index=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False,
+                     index=True)
+    version = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow,
+                        onupdate=datetime.utcnow)
+    # Full text search document over name and description, maintained on
+    # PostgreSQL only (@see set_search_vector). Other databases fall back to
+    # an in-process index (@see search.py).
+    search_vector = deferred(
+        Column(Text().with_variant(TSVECTOR(), 'postgresql')))
+
+    __mapper_args__ = {'version_id_col': version}
+    __table_args__ = (
+        Index('ix_items_search_vector', 'search_vector',
+              postgresql_using='gin'),
+    )
 
     user = relationship(User, back_populates="items")
     catalog = relationship(Catalog, back_populates="items")
@@ -69,5 +96,97 @@ class Item(Base):
         }
 
 
-engine = create_engine(DATABASE_URL)
-Base.metadata.create_all(engine)
+class Job(Base):
+    """
+    A unit of background work (@see jobs.py).
+    """
+    __tablename__ = 'jobs'
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String(50), nullable=False)
+    # JSON arguments, and the JSON result (or progress, while running).
+    payload = Column(Text, nullable=False)
+    result = Column(Text)
+    status = Column(String(20), nullable=False, default='queued')
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    error = Column(Text)
+    # Who queued the job, if a user did; only they may see its status.
+    user_id = Column(Integer, ForeignKey('users.id'))
+    # When a queued job may run next; pushed back after a failed attempt.
+    run_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = Column(String(100))
+    locked_at = Column(DateTime)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow,
+                        onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    )
+
+
+@event.listens_for(Item, 'before_insert')
+@event.listens_for(Item, 'before_update')
+def set_search_vector(mapper, connection, target):
+    """
+    Recomputes Item.search_vector in the same INSERT/UPDATE statement.
+    """
+    if connection.dialect.name != 'postgresql':
+        return
+    target.search_vector = search_document(target.name, target.description)
+
+
+@event.listens_for(Item, 'after_insert')
+def count_inserted_item(mapper, connection, target):
+    adjust_item_counts(connection, {target.catalog_id: 1})
+
+
+@event.listens_for(Item, 'after_delete')
+def count_deleted_item(mapper, connection, target):
+    adjust_item_counts(connection, {target.catalog_id: -1})
+
+
+@event.listens_for(Item, 'after_update')
+def count_moved_item(mapper, connection, target):
+    history = inspect(target).attrs.catalog_id.history
+    if history.deleted and history.added:
+        old, new = int(history.deleted[0]), int(history.added[0])
+        if old != new:
+            adjust_item_counts(connection, {old: -1, new: 1})
+
+
+def adjust_item_counts(connection, deltas):
+    """
+    Keeps Catalog.item_count current, in the same transaction as the item
+    writes (@see the Item events above). The counters are incremented in SQL
+    rather than read, changed and written back, so concurrent writers cannot
+    lose each other's updates. Rows are updated in id order, so two moves in
+    opposite directions cannot deadlock.
+
+    :param connection: the connection of the current transaction.
+    :param deltas: maps catalog ids to the change in their item count.
+    """
+    catalogs = Catalog.__table__
+    for catalog_id, delta in sorted((int(catalog_id), delta)
+                                    for catalog_id, delta in deltas.items()):
+        if delta:
+            connection.execute(catalogs.update().where(
+                catalogs.c.id == catalog_id).values(
+                item_count=catalogs.c.item_count + delta))
+
+
+def search_document(name, description):
+    """
+    The tsvector of an item. The item's name is weighted above its
+    description when ranking.
+
+    :param name: the name, as a value or a column.
+    :param description: the description, as a value or a column.
+
+    :return: the SQL expression.
+    """
+    return func.setweight(
+        func.to_tsvector('english', func.coalesce(name, '')), 'A').op('||')(
+        func.setweight(
+            func.to_tsvector('english', func.coalesce(description, '')), 'B'))
@@ -0,0 +1,155 @@
+from google.auth import jwt
+from requests.adapters import HTTPAdapter
+
+import json
+import re
+import requests
+import threading
+import time
+
+# Google sign in, without a network round trip per login.
+#
+# The app secrets are read once at startup (@see create_app in webserver.py)
+# and Google's signing certificates are kept in a process-wide cache that
+# honours the max-age Google sends with them. The certificates are refreshed
+# in the background shortly before they expire, so logins never wait on
+# Google unless the cache is cold or a token is signed with a key we have not
+# seen yet (i.e. Google rotated its keys early).
+
+GOOGLE_CERTS_URL = 'https://www.googleapis.com/oauth2/v1/certs'
+GOOGLE_ISSUERS = ['accounts.google.com', 'https://accounts.google.com']
+
+# Used when the response has no usable Cache-Control header.
+DEFAULT_MAX_AGE = 300
+# Refresh in the background once this fraction of the max-age has passed.
+REFRESH_AHEAD = 0.8
+# Unknown key ids trigger at most one refetch per this many seconds.
+MIN_REFETCH_INTERVAL = 30
+
+MAX_AGE = re.compile(r'max-age=(\d+)')
+
+
+def load_secrets(path):
+    """
+    :param path: the app_secrets.json file.
+
+    :return: the parsed secrets.
+    """
+    with open(path, 'r') as secrets_file:
+        return json.load(secrets_file)
+
+
+def max_age(headers, default=DEFAULT_MAX_AGE):
+    """
+    :param headers: the response headers.
+    :param default: used when there is no max-age directive.
+
+    :return: the number of seconds the response may be cached for.
+    """
+    match = MAX_AGE.search(headers.get('Cache-Control', ''))
+    return int(match.group(1)) if match else default
+
+
+def http_session(pool_size=10):
+    """
+    :return: a requests session keeping connections to Google alive.
+    """
+    http = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    http.mount('https://', adapter)
+    http.mount('http://', adapter)
+    return http
+
+
+class CertCache(object):
+    """
+    Thread safe cache of the certificates, keyed by key id, that tokens are
+    verified with.
+    """
+
+    def __init__(self, url=GOOGLE_CERTS_URL, http=None, timeout=5):
+        self.url = url
+        self.http = http or http_session()
+        self.timeout = timeout
+        self.fetches = 0
+        self._certs = {}
+        self._fetched_at = 0
+        self._expires_at = 0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def fetch(self):
+        """
+        Downloads the certificates and replaces the cached ones.
+        """
+        response = self.http.get(self.url, timeout=self.timeout)
+        response.raise_for_status()
+        certs = response.json()
+        now = time.time()
+        with self._lock:
+            self.fetches += 1
+            self._certs = certs
+            self._fetched_at = now
+            self._expires_at = now + max_age(response.headers)
+        return certs
+
+    def get(self):
+        """
+        :return: the current certificates, fetching them if the cache is
+        empty or expired, and starting a background refresh if they are
+        about to expire.
+        """
+        now = time.time()
+        with self._lock:
+            certs, fetched_at, expires_at = \
+                self._certs, self._fetched_at, self._expires_at
+            refresh_at = fetched_at + (expires_at - fetched_at) * REFRESH_AHEAD
+            stale = certs and refresh_at <= now < expires_at \
+                and not self._refreshing
+            if stale:
+                self._refreshing = True
+        if not certs or now >= expires_at:
+            return self.fetch()
+        if stale:
+            threading.Thread(target=self._refresh, daemon=True).start()
+        return certs
+
+    def _refresh(self):
+        try:
+            self.fetch()
+        except (requests.RequestException, ValueError):
+            pass
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def get_for(self, key_id):
+        """
+        Like get, but refetches (rate limited) if key_id is not among the
+        cached certificates.
+        """
+        certs = self.get()
+        if key_id in certs or \
+                time.time() - self._fetched_at < MIN_REFETCH_INTERVAL:
+            return certs
+        return self.fetch()
+
+
+def verify_token(token, audience, cert_cache):
+    """
+    Verifies a Google ID token locally, against cached certificates.
+
+    :param token: the ID token sent by the client.
+    :param audience: the app's OAuth client id.
+    :param cert_cache: a CertCache.
+
+    :raises ValueError: if the token is malformed, expired, not signed by
+    Google or not meant for this app.
+
+    :return: the token's claims.
+    """
+    certs = cert_cache.get_for(jwt.decode_header(token).get('kid'))
+    idinfo = jwt.decode(token, certs=certs, audience=audience)
+    if idinfo.get('iss') not in GOOGLE_ISSUERS:
+        raise ValueError('Wrong issuer.')
+    return idinfo
@@ -0,0 +1,149 @@
+from sqlalchemy import event
+
+from models import Item, Catalog
+
+import threading
+
+# Per worker index of who owns what: email -> user id, and item / catalog
+# id -> owner id. Answers the hot authorization checks (@see is_owner in
+# webserver.py) and the login lookup (@see create_user) without a database
+# round trip.
+#
+# Owners never change while a row exists, so entries only have to go when
+# rows are deleted: through the ORM events below and, for batches, through
+# forget() (@see invalidate_batch). Users are never deleted. Ids are not
+# reused on PostgreSQL; SQLite may reuse the highest id after a delete, which
+# only matters with several workers in development.
+#
+# Catalogs deleted in bulk, possibly by another process (the job worker or
+# "flask katalog delete-catalog"), take an unknown set of items with them.
+# Those deletes bump the cache's "owners" generation, and every worker
+# empties its maps when it sees a new one (@see sync). That reaches the other
+# workers through a shared CACHE_BACKEND only.
+#
+# The maps are plain dicts of ints, kept in least recently used order by
+# re-inserting on every hit: about 106 bytes per entry, two thirds of what an
+# OrderedDict takes, i.e. some 100 MB per million items (@see
+# bench/ownership.py). OWNER_INDEX_MAX_ENTRIES bounds each map.
+
+
+class LRUMap(object):
+    """
+    A thread safe, size bounded map that evicts its least recently used
+    entry.
+    """
+    __slots__ = ('max_entries', 'hits', 'misses', '_entries', '_lock')
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :return: the value, or None if key is not in the map.
+        """
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            if len(self._entries) > self.max_entries:
+                del self._entries[next(iter(self._entries))]
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {'entries': len(self._entries), 'hits': self.hits,
+                'misses': self.misses}
+
+
+class OwnerIndex(object):
+    """
+    The users, items and catalogs maps, each holding up to max_entries.
+    """
+    __slots__ = ('users', 'items', 'catalogs', 'generation')
+
+    def __init__(self, max_entries=100000):
+        self.users = LRUMap(max_entries)
+        self.items = LRUMap(max_entries)
+        self.catalogs = LRUMap(max_entries)
+        self.generation = None
+
+    def rows(self, model):
+        return self.items if model is Item else self.catalogs
+
+    def owner(self, model, row_id):
+        """
+        :return: the id of the owner of an Item or Catalog, or None if it is
+        not known.
+        """
+        return self.rows(model).get(int(row_id))
+
+    def remember(self, model, row_id, user_id):
+        self.rows(model).set(int(row_id), user_id)
+
+    def forget(self, model, row_ids):
+        rows = self.rows(model)
+        for row_id in row_ids:
+            rows.discard(int(row_id))
+
+    def clear(self):
+        """
+        Forgets the owners of every item and catalog.
+        """
+        self.items.clear()
+        self.catalogs.clear()
+
+    def sync(self, generation):
+        """
+        Forgets every owner if generation is not the one the maps were filled
+        under.
+
+        :param generation: the current "owners" generation of the cache.
+        """
+        if generation != self.generation:
+            self.clear()
+            self.generation = generation
+
+    def user_id(self, email):
+        """
+        :return: the id of the user with this email, or None if not known.
+        """
+        return self.users.get(email)
+
+    def remember_user(self, email, user_id):
+        self.users.set(email, user_id)
+
+    def stats(self):
+        return {'users': self.users.stats(), 'items': self.items.stats(),
+                'catalogs': self.catalogs.stats()}
+
+
+# Replaced by create_app() with one of the configured size.
+index = OwnerIndex()
+
+
+@event.listens_for(Item, 'after_delete')
+@event.listens_for(Catalog, 'after_delete')
+def forget_deleted(mapper, connection, target):
+    index.forget(mapper.class_, [target.id])
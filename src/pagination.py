@@ -0,0 +1,182 @@
+from sqlalchemy import text
+
+import base64
+
+FORWARD = 'n'
+BACKWARD = 'p'
+
+# Below this many (estimated) rows an exact COUNT(*) is cheap enough to run.
+EXACT_COUNT_THRESHOLD = 1000
+
+
+class Page(object):
+    """
+    A single page of a keyset-paginated query.
+
+    rows holds the (already materialized) results in ascending key order,
+    next_cursor and prev_cursor are opaque strings (or None if there is no
+    page in that direction).
+    """
+
+    def __init__(self, rows, next_cursor, prev_cursor, per_page):
+        self.rows = rows
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.per_page = per_page
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+
+def encode_cursor(direction, key):
+    """
+    Packs a direction and a key into an opaque, URL safe cursor.
+
+    :param direction: FORWARD or BACKWARD.
+    :param key: the integer key the next page starts after (or before).
+
+    :return: the cursor string.
+    """
+    raw = "{}:{}".format(direction, key).encode('ascii')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Reverses encode_cursor.
+
+    :param cursor: the opaque cursor string, as received from a client.
+
+    :return: a (direction, key) tuple, or None if the cursor is missing or
+    malformed. A bad cursor simply means "start from the first page".
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode('ascii')).decode('ascii')
+        direction, key = raw.split(':', 1)
+        key = int(key)
+    except (ValueError, UnicodeError, TypeError):
+        return None
+    if direction not in (FORWARD, BACKWARD):
+        return None
+    return direction, key
+
+
+def encode_rank_cursor(rank, key):
+    """
+    Like encode_cursor, for result sets ordered by (rank descending, key). Such
+    cursors only go forward.
+
+    :param rank: the rank of the last row on the page.
+    :param key: the key of the last row on the page.
+
+    :return: the cursor string.
+    """
+    raw = "r:{!r}:{}".format(float(rank), key).encode('ascii')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_rank_cursor(cursor):
+    """
+    Reverses encode_rank_cursor.
+
+    :param cursor: the opaque cursor string, as received from a client.
+
+    :return: a (rank, key) tuple, or None if the cursor is missing or
+    malformed.
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode('ascii')).decode('ascii')
+        marker, rank, key = raw.split(':', 2)
+        rank, key = float(rank), int(key)
+    except (ValueError, UnicodeError, TypeError):
+        return None
+    if marker != 'r':
+        return None
+    return rank, key
+
+
+def paginate(query, column, key, cursor=None, per_page=30):
+    """
+    Keyset pagination over a unique, indexed integer column. Unlike
+    OFFSET, every page costs one index range scan of per_page + 1 rows,
+    no matter how deep into the table the client is.
+
+    :param query: the unordered query to paginate.
+    :param column: the key column, e.g. Item.id.
+    :param key: a function that extracts the key value from a result row.
+    :param cursor: the opaque cursor from the previous page, if any.
+    :param per_page: the number of rows per page.
+
+    :return: a Page.
+    """
+    decoded = decode_cursor(cursor)
+    if decoded is not None and decoded[0] == BACKWARD:
+        rows = query.filter(column < decoded[1]).order_by(
+            column.desc()).limit(per_page + 1).all()
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+        rows.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        if decoded is not None:
+            query = query.filter(column > decoded[1])
+        rows = query.order_by(column.asc()).limit(per_page + 1).all()
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+        has_prev, has_next = decoded is not None, has_more
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if has_next:
+            next_cursor = encode_cursor(FORWARD, key(rows[-1]))
+        if has_prev:
+            prev_cursor = encode_cursor(BACKWARD, key(rows[0]))
+    return Page(rows, next_cursor, prev_cursor, per_page)
+
+
+def page_size(requested, default, maximum):
+    """
+    Clamps the page size a client asked for.
+
+    :param requested: the raw value of the per_page query argument, or None.
+    :param default: the page size used when nothing (or garbage) is supplied.
+    :param maximum: the upper bound on the page size.
+
+    :return: the page size to use.
+    """
+    try:
+        size = int(requested)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(size, maximum))
+
+
+def estimate_count(db_session, model):
+    """
+    Returns the number of rows in a model's table without a full COUNT(*)
+    on large tables. On PostgreSQL the planner's estimate from pg_class is
+    used; small (or never analyzed) tables, and other databases, fall back
+    to an exact count.
+
+    :param db_session: the session to run the query in.
+    :param model: the mapped class whose table is counted.
+
+    :return: the (approximate) row count.
+    """
+    if db_session.get_bind().dialect.name == 'postgresql':
+        estimate = db_session.execute(
+            text("SELECT reltuples::bigint FROM pg_class "
+                 "WHERE relname = :table"),
+            {'table': model.__tablename__}).scalar()
+        if estimate is not None and estimate >= EXACT_COUNT_THRESHOLD:
+            return estimate
+    return db_session.query(model).count()
@@ -0,0 +1,203 @@
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from jinja2 import Template
+from sqlalchemy import event
+
+from metrics import Histogram
+
+import logging
+import threading
+import time
+
+# Opt-in per request instrumentation (INSTRUMENT=1, @see create_app in
+# webserver.py). For every request it records the number of SQL statements
+# and the time spent in the database, in templates and encoding JSON
+# (@see json_response in webserver.py).
+# The result is sent back in a Server-Timing header and aggregated per route
+# into histograms, served at /admin/routes.
+#
+# Requests are tracked per thread, which matches both the sync workers and
+# the ASGI mode's thread pool (@see asgi.py). When instrumentation is off
+# no profile is ever started and the hooks below return immediately.
+
+log = logging.getLogger('katalog.profiling')
+
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200)
+CATEGORIES = ('db', 'template', 'serialize')
+
+_local = threading.local()
+
+
+class RequestProfile(object):
+    """
+    The measurements of one request.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.timings = defaultdict(float)
+        self.statements = Counter()
+        self._depth = Counter()
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def server_timing(self):
+        """
+        :return: the value of the Server-Timing header, durations in
+        milliseconds.
+        """
+        parts = ['db;dur={:.2f};desc="{} queries"'.format(
+            self.timings['db'] * 1000, self.queries)]
+        parts += ['{};dur={:.2f}'.format(category,
+                                         self.timings[category] * 1000)
+                  for category in CATEGORIES[1:] if category in self.timings]
+        parts.append('total;dur={:.2f}'.format(self.elapsed() * 1000))
+        return ', '.join(parts)
+
+
+def current():
+    """
+    :return: the RequestProfile of the request on this thread, or None.
+    """
+    return getattr(_local, 'profile', None)
+
+
+def start():
+    _local.profile = RequestProfile()
+
+
+def stop():
+    _local.profile = None
+
+
+@contextmanager
+def timed(category):
+    """
+    Adds the time spent in the block to the current request's category.
+    Nested blocks of the same category (e.g. a template rendering another
+    one) are only counted once.
+    """
+    profile = current()
+    if profile is None:
+        yield
+        return
+    profile._depth[category] += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile._depth[category] -= 1
+        if not profile._depth[category]:
+            profile.timings[category] += time.perf_counter() - started
+
+
+class TimedTemplate(Template):
+    """
+    Template class (@see jinja2.Environment.template_class) that records
+    rendering time.
+    """
+
+    def render(self, *args, **kwargs):
+        with timed('template'):
+            return Template.render(self, *args, **kwargs)
+
+
+def instrument_engine(engine):
+    """
+    Counts and times the statements of the current request, if any.
+
+    :param engine: the engine to instrument.
+    """
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_timer(conn, cursor, statement, parameters, context,
+                    executemany):
+        if current() is not None:
+            conn.info.setdefault('profile_start', []).append(
+                time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def stop_timer(conn, cursor, statement, parameters, context,
+                   executemany):
+        profile = current()
+        starts = conn.info.get('profile_start')
+        if profile is None or not starts:
+            return
+        profile.timings['db'] += time.perf_counter() - starts.pop()
+        profile.queries += 1
+        # Statements are parameterized, so equal text means equal shape.
+        profile.statements[statement] += 1
+
+
+class RouteStats(object):
+    """
+    Histograms of request duration, time per category and queries per
+    request, one set per route.
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self._lock = threading.Lock()
+
+    def observe(self, route, profile):
+        with self._lock:
+            histograms = self.routes.get(route)
+            if histograms is None:
+                histograms = self.routes[route] = self._histograms(route)
+        histograms['duration'].observe(profile.elapsed())
+        for category in CATEGORIES:
+            histograms[category].observe(profile.timings.get(category, 0))
+        histograms['queries'].observe(profile.queries)
+
+    def _histograms(self, route):
+        labels = 'route="{}"'.format(route)
+        histograms = {
+            'duration': Histogram('katalog_route_seconds',
+                                  "Request duration per route.",
+                                  labels=labels),
+            'queries': Histogram('katalog_route_queries',
+                                 "SQL statements per request.",
+                                 QUERY_BUCKETS, labels=labels)
+        }
+        for category in CATEGORIES:
+            histograms[category] = Histogram(
+                'katalog_route_{}_seconds'.format(category),
+                "Time per request spent in {}.".format(category),
+                labels=labels)
+        return histograms
+
+    def render(self):
+        """
+        :return: the histograms in the Prometheus text format.
+        """
+        with self._lock:
+            routes = sorted(self.routes.items())
+        lines = []
+        for kind in ('duration', 'queries') + CATEGORIES:
+            for n, (route, histograms) in enumerate(routes):
+                lines += histograms[kind].render(header=n == 0)
+        return '\n'.join(lines) + '\n'
+
+
+route_stats = RouteStats()
+
+
+def finish(route, n_plus_one_threshold):
+    """
+    Ends the current request's profile: records it under route and logs
+    statements run more than n_plus_one_threshold times, the signature of an
+    N+1 query pattern.
+
+    :return: the RequestProfile, or None if the request was not profiled.
+    """
+    profile = current()
+    if profile is None:
+        return None
+    stop()
+    route_stats.observe(route, profile)
+    for statement, count in profile.statements.items():
+        if count > n_plus_one_threshold:
+            log.warning("Possible N+1 in %s: statement ran %d times: %s",
+                        route, count, ' '.join(statement.split())[:300])
+    return profile
@@ -0,0 +1,190 @@
+from sqlalchemy import event, func, or_, and_, cast, Float
+
+from models import Item
+from pagination import Page, encode_rank_cursor, decode_rank_cursor
+from serializers import card_rows
+from collections import Counter
+
+import bisect
+import re
+import threading
+
+# Full text search over Item.name and Item.description.
+#
+# On PostgreSQL this runs against the GIN indexed Item.search_vector
+# (@see models.py). On every other database (SQLite in development and
+# tests) an in-process inverted index is built from the items table on the
+# first search and kept current from the ORM's insert/update/delete events.
+# Each worker has its own copy, so it is not meant for production.
+
+TOKEN = re.compile(r'\w+', re.UNICODE)
+NAME_WEIGHT = 2
+
+
+def tokenize(text):
+    """
+    :param text: the text to split, may be None.
+
+    :return: the lower cased words in text.
+    """
+    return [token.lower() for token in TOKEN.findall(text or '')]
+
+
+class InvertedIndex(object):
+    """
+    Maps every word to the ids of the items containing it. Documents are
+    ranked by the weighted frequency of the query's words, name matches
+    counting NAME_WEIGHT times.
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.documents = {}
+        self.built = False
+        self._lock = threading.RLock()
+
+    def build(self, rows):
+        """
+        :param rows: (id, catalog_id, name, description) tuples of every item.
+        """
+        with self._lock:
+            self.postings.clear()
+            self.documents.clear()
+            for row in rows:
+                self.add(*row)
+            self.built = True
+
+    def add(self, item_id, catalog_id, name, description):
+        with self._lock:
+            self.remove(item_id)
+            terms = Counter(tokenize(description))
+            for token in tokenize(name):
+                terms[token] += NAME_WEIGHT
+            self.documents[item_id] = (catalog_id, terms)
+            for token in terms:
+                self.postings.setdefault(token, set()).add(item_id)
+
+    def remove(self, item_id):
+        with self._lock:
+            document = self.documents.pop(item_id, None)
+            if document is None:
+                return
+            for token in document[1]:
+                ids = self.postings.get(token)
+                ids.discard(item_id)
+                if not ids:
+                    del self.postings[token]
+
+    def search(self, q, catalog_id=None):
+        """
+        :param q: the query. Items must contain every word in it.
+        :param catalog_id: only return items in this catalog, if given.
+
+        :return: (-rank, id) tuples in result order.
+        """
+        tokens = set(tokenize(q))
+        if not tokens:
+            return []
+        with self._lock:
+            postings = [self.postings.get(token, set()) for token in tokens]
+            matches = set.intersection(*postings)
+            results = []
+            for item_id in matches:
+                document_catalog, terms = self.documents[item_id]
+                if catalog_id is not None and document_catalog != catalog_id:
+                    continue
+                rank = sum(terms[token] for token in tokens)
+                results.append((-rank, item_id))
+        results.sort()
+        return results
+
+
+index = InvertedIndex()
+
+
+@event.listens_for(Item, 'after_insert')
+@event.listens_for(Item, 'after_update')
+def index_item(mapper, connection, target):
+    if index.built:
+        # Form handlers assign catalog_id as the submitted string.
+        index.add(target.id, int(target.catalog_id), target.name,
+                  target.description)
+
+
+@event.listens_for(Item, 'after_delete')
+def unindex_item(mapper, connection, target):
+    if index.built:
+        index.remove(target.id)
+
+
+def invalidate_index():
+    """
+    Drops the in-process index, to be rebuilt on the next search. For writes
+    that bypass the ORM events above (@see batch.py).
+    """
+    index.built = False
+
+
+def search_items(db_session, q, catalog_id=None, cursor=None, per_page=30):
+    """
+    Searches items, best matches first.
+
+    :param db_session: the session to search in.
+    :param q: the query string.
+    :param catalog_id: restrict the results to this catalog, if given.
+    :param cursor: the opaque cursor from the previous page, if any.
+    :param per_page: the number of results per page.
+
+    :return: a Page of card_rows() rows (@see serializers.py). Search pages
+    only link forward.
+    """
+    if db_session.get_bind().dialect.name == 'postgresql':
+        return _search_postgresql(db_session, q, catalog_id, cursor, per_page)
+    return _search_index(db_session, q, catalog_id, cursor, per_page)
+
+
+def _search_postgresql(db_session, q, catalog_id, cursor, per_page):
+    tsquery = func.plainto_tsquery('english', q)
+    # ts_rank is a real (float4). Cursors carry the rank as a Python float,
+    # which compared with the real would let a whole tie back in on every
+    # page, so both sides are compared in double precision.
+    rank = cast(func.ts_rank(Item.search_vector, tsquery), Float(53))
+    query = card_rows(db_session).add_columns(rank.label('rank')).filter(
+        Item.search_vector.op('@@')(tsquery))
+    if catalog_id is not None:
+        query = query.filter(Item.catalog_id == catalog_id)
+    decoded = decode_rank_cursor(cursor)
+    if decoded is not None:
+        query = query.filter(or_(rank < decoded[0], and_(
+            rank == decoded[0], Item.id > decoded[1])))
+    rows = query.order_by(rank.desc(), Item.id).limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_rank_cursor(rows[-1].rank, rows[-1].id)
+    return Page(rows, next_cursor, None, per_page)
+
+
+def _search_index(db_session, q, catalog_id, cursor, per_page):
+    if not index.built:
+        index.build(db_session.query(Item.id, Item.catalog_id, Item.name,
+                                     Item.description))
+    results = index.search(q, catalog_id)
+    start = 0
+    decoded = decode_rank_cursor(cursor)
+    if decoded is not None:
+        start = bisect.bisect_right(results, (-decoded[0], decoded[1]))
+    window = results[start:start + per_page + 1]
+
+    next_cursor = None
+    if len(window) > per_page:
+        window = window[:per_page]
+        next_cursor = encode_rank_cursor(-window[-1][0], window[-1][1])
+    ids = [item_id for _, item_id in window]
+    rows = {}
+    if ids:
+        rows = {row.id: row for row in
+                card_rows(db_session).filter(Item.id.in_(ids))}
+    return Page([rows[i] for i in ids if i in rows], next_cursor, None,
+                per_page)
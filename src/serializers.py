@@ -0,0 +1,219 @@
+from models import User, Item, Catalog
+from collections import namedtuple
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Plain, picklable stand-ins for the ORM objects the templates read from.
+# Unlike ORM instances they can be cached and shared between requests.
+CatalogView = namedtuple('CatalogView', ['id', 'name', 'user_id', 'version'])
+ItemView = namedtuple('ItemView', ['id', 'name', 'description', 'catalog_id',
+                                   'user_id', 'version'])
+UserView = namedtuple('UserView', ['id', 'email'])
+
+# Bulk counterparts of the Model.serialize properties. Instead of loading ORM
+# objects and lazily following item.catalog and item.user (one or two extra
+# SELECTs per row), these queries project exactly the columns the JSON
+# endpoints need in a single joined SELECT and build the dicts straight from
+# the result tuples.
+
+
+def item_rows(db_session):
+    """
+    :param db_session: the session to build the query in.
+
+    :return: a query yielding (id, name, description, catalog, by) tuples,
+    one per item.
+    """
+    return db_session.query(Item.id, Item.name, Item.description,
+                            Catalog.name.label('catalog'),
+                            User.email.label('by')) \
+        .join(Item.catalog).join(Item.user)
+
+
+def catalog_rows(db_session):
+    """
+    :param db_session: the session to build the query in.
+
+    :return: a query yielding (id, name, by) tuples, one per catalog.
+    """
+    return db_session.query(Catalog.id, Catalog.name,
+                            User.email.label('by')).join(Catalog.user)
+
+
+def serialize_item(row):
+    """
+    :param row: a row of item_rows().
+
+    :return: the same dict as Item.serialize.
+    """
+    return {
+        'name': row.name,
+        'description': row.description,
+        'catalog': row.catalog,
+        'by': row.by
+    }
+
+
+def serialize_catalog(row):
+    """
+    :param row: a row of catalog_rows().
+
+    :return: the same dict as Catalog.serialize.
+    """
+    return {
+        'name': row.name,
+        'by': row.by
+    }
+
+
+# =========Views=============
+def item_version_rows(db_session):
+    """
+    :param db_session: the session to build the query in.
+
+    :return: a query yielding (id, version, catalog_version) tuples, one per
+    item. Everything item_rows() returns changes only if one of these does.
+    """
+    return db_session.query(Item.id, Item.version,
+                            Catalog.version.label('catalog_version')) \
+        .join(Item.catalog)
+
+
+def catalog_version_rows(db_session):
+    """
+    :param db_session: the session to build the query in.
+
+    :return: a query yielding (id, version) tuples, one per catalog.
+    """
+    return db_session.query(Catalog.id, Catalog.version)
+
+
+def card_rows(db_session):
+    """
+    :param db_session: the session to build the query in.
+
+    :return: a query over the columns needed to display items, one row per
+    item (@see to_card).
+    """
+    return db_session.query(Catalog.id.label('catalog_id'),
+                            Catalog.name.label('catalog_name'),
+                            Catalog.user_id.label('catalog_user_id'),
+                            Catalog.version.label('catalog_version'),
+                            Item.id, Item.name, Item.description,
+                            Item.user_id, Item.version, User.email) \
+        .join(Item.catalog).join(Item.user)
+
+
+def to_card(row):
+    """
+    :param row: a row of card_rows().
+
+    :return: a (CatalogView, ItemView, UserView) tuple, the shape the item
+    templates iterate over.
+    """
+    return (CatalogView(row.catalog_id, row.catalog_name,
+                        row.catalog_user_id, row.catalog_version),
+            ItemView(row.id, row.name, row.description, row.catalog_id,
+                     row.user_id, row.version),
+            UserView(row.user_id, row.email))
+
+
+def serialize_card(row):
+    """
+    :param row: a row of card_rows().
+
+    :return: the same dict as Item.serialize.
+    """
+    return {
+        'name': row.name,
+        'description': row.description,
+        'catalog': row.catalog_name,
+        'by': row.email
+    }
+
+
+def catalog_card_rows(db_session):
+    """
+    :param db_session: the session to build the query in.
+
+    :return: a query over the columns needed to list catalogs.
+    """
+    return db_session.query(Catalog.id, Catalog.name, Catalog.user_id,
+                            Catalog.version, User.email).join(Catalog.user)
+
+
+def to_catalog_card(row):
+    """
+    :param row: a row of catalog_card_rows().
+
+    :return: a (CatalogView, UserView) tuple.
+    """
+    return (CatalogView(row.id, row.name, row.user_id, row.version),
+            UserView(row.user_id, row.email))
+
+
+# =========Encoding=============
+def dumps(obj):
+    """
+    Encodes obj as compact JSON, with orjson if it is installed (several times
+    faster than the json module on large lists of dicts).
+
+    :param obj: dicts, lists, strings, numbers, booleans and None.
+
+    :return: UTF-8 encoded bytes.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(',', ':'),
+                      ensure_ascii=False).encode('utf-8')
+
+
+# =========Streaming=============
+def stream_rows(query, batch_size=1000):
+    """
+    Iterates over a query through a server side cursor, so that only
+    batch_size rows are ever held in memory at once.
+
+    :param query: the query to iterate over.
+    :param batch_size: the number of rows fetched per round trip.
+
+    :return: an iterator over the query's rows.
+    """
+    return query.execution_options(stream_results=True).yield_per(batch_size)
+
+
+def stream_json(key, rows, serialize):
+    """
+    Encodes rows as a JSON document of the form {key: [...]}, one row at a
+    time.
+
+    :param key: the name of the top level list.
+    :param rows: an iterable of rows, typically from stream_rows().
+    :param serialize: a function turning a row into a dict.
+
+    :return: a generator of byte chunks.
+    """
+    yield b'{' + dumps(key) + b':['
+    separator = b''
+    for row in rows:
+        yield separator + dumps(serialize(row))
+        separator = b','
+    yield b']}\n'
+
+
+def stream_ndjson(rows, serialize):
+    """
+    Encodes rows as newline delimited JSON, one object per line.
+
+    :param rows: an iterable of rows, typically from stream_rows().
+    :param serialize: a function turning a row into a dict.
+
+    :return: a generator of byte chunks.
+    """
+    for row in rows:
+        yield dumps(serialize(row)) + b'\n'
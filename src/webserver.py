@@ -1,35 +1,95 @@
 #!/usr/bin/env python3
 from flask import Flask, render_template, request, redirect, url_for, \
-    session, flash, Markup, jsonify
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-
-from models import Base, User, Item, Catalog
-from google.oauth2 import id_token
-from google.auth.transport import requests
-
-import random
-import string
-import json
+    session, flash, Markup, Response, make_response, abort, safe_join, \
+    send_from_directory
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.orm.util import identity_key
+from jinja2 import FileSystemBytecodeCache
+
+from database import DBSession, get_engine, READ_REPLICA_URLS
+from models import User, Item, Catalog, Job
+from pagination import Page, paginate, page_size, estimate_count
+from serializers import item_rows, catalog_rows, serialize_item, \
+    serialize_catalog, stream_rows, stream_json, stream_ndjson, card_rows, \
+    to_card, catalog_card_rows, to_catalog_card, item_version_rows, \
+    catalog_version_rows, serialize_card, dumps
+from cache import make_cache
+from search import search_items, invalidate_index
+from bulk import delete_catalog_items, delete_catalog, import_records, \
+    read_records
+from cli import katalog_cli
+import metrics
+import profiling
+import assets
+import batch
+import jobs
+import compression
+import csrf
+import oauth
+import owners
+
+import hashlib
+import hmac
+import mimetypes
 import os
+import time
 
 app = Flask(__name__, template_folder='../views',
             static_folder='../views/static')
-
-if os.getenv("DATABASE_URL"):
-    DATABASE_URL = os.environ['DATABASE_URL']
-else:
-    DATABASE_URL = 'postgres:///catalog'
-
-engine = create_engine(DATABASE_URL)
-Base.metadata.bind = engine
-DBSession = sessionmaker(bind=engine)
+app.cli.add_command(katalog_cli)
+
+app.config['PAGE_SIZE'] = int(os.getenv("PAGE_SIZE", 30))
+app.config['MAX_PAGE_SIZE'] = int(os.getenv("MAX_PAGE_SIZE", 100))
+app.config['STREAM_BATCH_SIZE'] = int(os.getenv("STREAM_BATCH_SIZE", 1000))
+app.config['CACHE_BACKEND'] = os.getenv("CACHE_BACKEND", "memory")
+app.config['CACHE_TTL'] = int(os.getenv("CACHE_TTL", 60))
+app.config['CACHE_MAX_ENTRIES'] = int(os.getenv("CACHE_MAX_ENTRIES", 1024))
+app.config['FRAGMENT_CACHE_MAX_ENTRIES'] = int(
+    os.getenv("FRAGMENT_CACHE_MAX_ENTRIES", 10000))
+app.config['TEMPLATE_CACHE_DIR'] = os.getenv("TEMPLATE_CACHE_DIR")
+app.config['PRECOMPILE_TEMPLATES'] = os.getenv(
+    "PRECOMPILE_TEMPLATES", "false").lower() in ('1', 'true', 'yes', 'on')
+app.config['INSTRUMENT'] = os.getenv("INSTRUMENT", "false").lower() in (
+    '1', 'true', 'yes', 'on')
+app.config['N_PLUS_ONE_THRESHOLD'] = int(os.getenv("N_PLUS_ONE_THRESHOLD",
+                                                   10))
+app.config['BATCH_MAX_OPERATIONS'] = int(os.getenv("BATCH_MAX_OPERATIONS",
+                                                   5000))
+app.config['OWNER_INDEX_MAX_ENTRIES'] = int(
+    os.getenv("OWNER_INDEX_MAX_ENTRIES", 100000))
+app.config['ASYNC_DELETE_MIN_ITEMS'] = int(
+    os.getenv("ASYNC_DELETE_MIN_ITEMS", 10000))
+app.config['COMPRESS_MIN_SIZE'] = int(os.getenv("COMPRESS_MIN_SIZE", 500))
+app.config['ASSET_MAX_AGE'] = int(os.getenv("ASSET_MAX_AGE", 31536000))
+app.config['CSRF_TOKEN_MAX_AGE'] = int(os.getenv("CSRF_TOKEN_MAX_AGE",
+                                                 8 * 3600))
+app.config['REPLICA_STICKY_SECONDS'] = int(os.getenv("REPLICA_STICKY_SECONDS",
+                                                     5))
+app.config['SECRETS_PATH'] = os.getenv("SECRETS_PATH",
+                                       "../secrets/app_secrets.json")
+app.config['GOOGLE_CERTS_URL'] = os.getenv("GOOGLE_CERTS_URL",
+                                           oauth.GOOGLE_CERTS_URL)
+# Bearer token for the operational endpoints; they are off without one.
+app.config['OPS_TOKEN'] = os.getenv("OPS_TOKEN")
+# Identifies the deployed code in ETags (Heroku sets the slug's commit when
+# runtime dyno metadata is enabled).
+app.config['APP_VERSION'] = os.getenv("APP_VERSION",
+                                      os.getenv("HEROKU_SLUG_COMMIT"))
+
+# Set up by create_app().
+cache = None
+fragments = None
+asset_manifest = None
+build_id = None
+cert_cache = None
 
 # =========Constants=============
 MUST_SIGN_IN = "You need to <a href=/login>sign in </a> " \
                "before you perform that action."
 CATALOG_DELETED = "Catalog deleted successfully, along with all the items in" \
                   " it."
+CATALOG_DELETE_QUEUED = "The catalog is being deleted, along with all the " \
+                        "items in it. This can take a few minutes."
 ITEM_DELETED = "Item deleted successfully."
 NOT_AUTHORIZED = "You do not have permission to view that resource(s). This " \
                  "could be because you are trying view a resource that you" \
@@ -41,14 +101,17 @@ EMPTY_FORM = "No input read. Please enter some value."
 @app.route('/')
 def index():
     """
-    Displays the index page, which lists some items on the home screen.
+    Displays the index page, which lists the three most recent items on the
+    home screen. A backward scan of the primary key finds them without
+    touching the rest of the table, and the result is cached until the next
+    item write.
 
     :return: the appropriate template.
     """
-    db_session = DBSession()
-    items_three = db_session.query(Catalog, Item, User).join(
-        Item.catalog).join(Item.user).limit(3)
-    db_session.close()
+    key = 'index:{}'.format(cache.generation('items'))
+    items_three = cache.get_or_set(key, lambda: [
+        to_card(row) for row in card_rows(DBSession()).order_by(
+            Item.id.desc()).limit(3)])
     return render_template('index.html', tuple=items_three)
 
 
@@ -63,12 +126,10 @@ def catalogs():
     :return: template (if GET) and a redirect to catalogs on POST.
     """
     if request.method == "GET":
-        db_session = DBSession()
-        catalogs_all = db_session.query(Catalog, User).join(Catalog.user)
-        catalogs_count = catalogs_all.count()
-        db_session.close()
-        return render_template('catalogs/catalogs.html', tuple=catalogs_all,
-                               count=catalogs_count)
+        catalogs_page, catalogs_count = cache.get_or_set(
+            page_key('catalogs'), load_catalogs_page)
+        return render_template('catalogs/catalogs.html', tuple=catalogs_page,
+                               page=catalogs_page, count=catalogs_count)
 
     elif request.method == "POST":
         if not is_signed_in():
@@ -80,22 +141,29 @@ def catalogs():
         if not name:
             flash(EMPTY_FORM)
             return redirect(request.referrer)
-        email = session['idinfo']['email']
-        user = db_session.query(User).filter_by(email=email).first()
-        catalog = Catalog(name=name, user_id=user.id)
+        catalog = Catalog(name=name, user_id=current_user_id())
         db_session.add(catalog)
         db_session.commit()
-        db_session.close()
+        cache.invalidate('catalogs')
         return redirect(url_for('catalogs'))
 
 
 @app.route('/catalogs/JSON/')
 def catalogs_json():
     db_session = DBSession()
-    catalogs_all = db_session.query(Catalog).all()
-    catalogs_serialized = [i.serialize for i in catalogs_all]
-    db_session.close()
-    return jsonify(catalogs=catalogs_serialized)
+    etag = page_etag(catalog_version_rows(db_session), Catalog.id)
+    if etag_matches(etag):
+        return not_modified(etag)
+
+    catalogs_page = current_page(catalog_rows(db_session), Catalog.id,
+                                 lambda row: row.id)
+    with profiling.timed('serialize'):
+        catalogs_serialized = [serialize_catalog(i) for i in catalogs_page]
+        response = json_response({'catalogs': catalogs_serialized,
+                                  'next': catalogs_page.next_cursor,
+                                  'prev': catalogs_page.prev_cursor})
+    response.set_etag(etag)
+    return response
 
 
 @app.route('/catalogs/new/')
@@ -126,73 +194,110 @@ def id_catalog(catalog_id):
     :return: the appropriate template.
     """
     db_session = DBSession()
-    catalog = db_session.query(Catalog).filter_by(id=catalog_id).one()
 
     if request.method == "GET":
-        catalogs_all = db_session.query(Catalog, Item, User).join(
-            Item.user).join(Item.catalog).filter(
-            Item.catalog_id == catalog_id)
-        catalogs_count = catalogs_all.count()
+        catalog, catalogs_page, catalogs_count = cache.get_or_set(
+            page_key('catalog:{}'.format(catalog_id)),
+            lambda: load_catalog_page(catalog_id))
+
+        etag = html_etag(catalog, catalogs_page.rows,
+                         catalogs_page.next_cursor, catalogs_page.prev_cursor,
+                         catalogs_count)
+        if etag and etag_matches(etag):
+            return not_modified(etag)
 
         if is_signed_in():
-            email = session['idinfo']['email']
-            user = db_session.query(User).filter_by(email=email).one()
-            display_actions = (catalog.user_id == user.id)
+            display_actions = (catalog.user_id == current_user_id())
         else:
             display_actions = False
 
-        state = get_csrf_token()
-        db_session.close()
-        return render_template('catalogs/show.html', tuple=catalogs_all,
-                               catalog=catalog,
-                               display_actions=display_actions,
-                               state=state,
-                               count=catalogs_count)
+        state = get_csrf_token() if display_actions else ''
+        response = make_response(render_template(
+            'catalogs/show.html', tuple=catalogs_page, page=catalogs_page,
+            catalog=catalog, display_actions=display_actions, state=state,
+            count=catalogs_count))
+        if etag:
+            response.set_etag(etag)
+        return response
 
     elif request.method == "PUT":
+        catalog = db_session.query(Catalog).filter_by(id=catalog_id).one()
         if not valid_state():
-            return json.dumps({'success': False}), 401, {
-                'ContentType': 'application/json'}
+            return json_response({'success': False}, 401)
 
         if not is_authorized_catalog(catalog_id):
             flash(NOT_AUTHORIZED)
-            return json.dumps({'success': False}), 403, {
-                'ContentType': 'application/json'}
+            return json_response({'success': False}, 403)
 
         new_name = request.form['name']
         catalog.name = new_name
         db_session.add(catalog)
-        db_session.commit()
-        db_session.close()
-        return json.dumps({'success': True}), 200, {
-            'ContentType': 'application/json'}
+        if not commit_write(db_session):
+            return json_response({'success': False}, 409)
+        invalidate_catalog(catalog_id)
+        return json_response({'success': True}, 200)
 
     elif request.method == "DELETE":
+        catalog = db_session.query(Catalog).filter_by(id=catalog_id).one()
         if not valid_state():
-            return json.dumps({'success': False}), 401, {
-                'ContentType': 'application/json'}
+            return json_response({'success': False}, 401)
 
         if not is_authorized_catalog(catalog_id):
             flash(NOT_AUTHORIZED)
-            return json.dumps({'success': False}), 403, {
-                'ContentType': 'application/json'}
+            return json_response({'success': False}, 403)
 
+        if catalog.item_count >= app.config['ASYNC_DELETE_MIN_ITEMS']:
+            job = jobs.enqueue(db_session, 'delete_catalog',
+                               {'catalog_id': catalog_id}, current_user_id())
+            db_session.commit()
+            flash(CATALOG_DELETE_QUEUED)
+            return job_accepted(job)
+
+        delete_catalog_items(db_session.connection(), catalog_id)
         db_session.delete(catalog)
-        db_session.commit()
-        db_session.close()
+        if not commit_write(db_session):
+            return json_response({'success': False}, 409)
+        invalidate_deleted_catalog(catalog_id)
         flash(CATALOG_DELETED)
-        return json.dumps({'success': True}), 200, {
-            'ContentType': 'application/json'}
+        return json_response({'success': True}, 200)
 
 
 @app.route('/catalogs/<int:catalog_id>/JSON/')
 def id_catalog_json(catalog_id):
     db_session = DBSession()
-    items_in_catalog = db_session.query(Item).filter(
-        Item.catalog_id == catalog_id)
-    items_serialized = [i.serialize for i in items_in_catalog]
-    db_session.close()
-    return jsonify(items=items_serialized)
+    etag = page_etag(item_version_rows(db_session).filter(
+        Item.catalog_id == catalog_id), Item.id)
+    if etag_matches(etag):
+        return not_modified(etag)
+
+    items_page = current_page(
+        item_rows(db_session).filter(Item.catalog_id == catalog_id), Item.id,
+        lambda row: row.id)
+    with profiling.timed('serialize'):
+        items_serialized = [serialize_item(i) for i in items_page]
+        response = json_response({'items': items_serialized,
+                                  'next': items_page.next_cursor,
+                                  'prev': items_page.prev_cursor})
+    response.set_etag(etag)
+    return response
+
+
+@app.route('/catalogs/<int:catalog_id>/JSON/export/')
+def id_catalog_json_export(catalog_id):
+    """
+    Streams every item in a catalog as one JSON document, or as NDJSON with
+    ?format=ndjson. Memory use stays flat regardless of the catalog's size.
+
+    :param catalog_id: the id of the catalog.
+
+    :return: a streamed response.
+    """
+    db_session = DBSession.session_factory()
+    if reads_from_replica():
+        db_session.use_replica()
+    rows = item_rows(db_session).filter(
+        Item.catalog_id == catalog_id).order_by(Item.id)
+    return export_response('items', rows, serialize_item, db_session)
 
 
 @app.route('/catalogs/<int:catalog_id>/edit/')
@@ -216,8 +321,6 @@ def edit_catalog(catalog_id):
     db_session = DBSession()
     catalog = db_session.query(Catalog).filter_by(id=catalog_id).one()
     state = get_csrf_token()
-    session['state'] = state
-    db_session.close()
     return render_template('catalogs/edit.html', catalog=catalog, state=state)
 
 
@@ -230,13 +333,10 @@ def items():
     :return: GET: the appropriate template, POST: redirect to items
     """
     if request.method == "GET":
-        db_session = DBSession()
-        items_all = db_session.query(Catalog, Item, User).join(
-            Item.catalog).join(Item.user)
-        items_count = items_all.count()
-        db_session.close()
-        return render_template('items/items.html', tuple=items_all,
-                               count=items_count)
+        items_page, items_count = cache.get_or_set(page_key('items'),
+                                                   load_items_page)
+        return render_template('items/items.html', tuple=items_page,
+                               page=items_page, count=items_count)
 
     elif request.method == "POST":
         if not is_signed_in():
@@ -253,28 +353,81 @@ def items():
             redirect(request.referrer)
 
         catalog_id = request.form['catalog_id']
-        email = session['idinfo']['email']
-        user = db_session.query(User).filter_by(email=email).first()
         item = Item(name=name, description=description, catalog_id=catalog_id,
-                    user_id=user.id)
+                    user_id=current_user_id())
         db_session.add(item)
         db_session.commit()
-        db_session.close()
+        invalidate_item(item_id=None, catalog_ids=[catalog_id])
         return redirect(url_for('items'))
 
 
 @app.route('/items/JSON/')
 def items_json():
     """
-    JSON endpoint for all the items in the database.
+    JSON endpoint for all the items in the database, one page at a time.
+    Follow the "next" and "prev" cursors to walk through the rest.
 
-    :return: JSON string containing items' serialized values (@see models.py)
+    :return: JSON string containing items' serialized values
+    (@see serializers.py)
     """
     db_session = DBSession()
-    items_all = db_session.query(Item).all()
-    items_serialized = [i.serialize for i in items_all]
-    db_session.close()
-    return jsonify(items=items_serialized)
+    etag = page_etag(item_version_rows(db_session), Item.id)
+    if etag_matches(etag):
+        return not_modified(etag)
+
+    items_page = current_page(item_rows(db_session), Item.id,
+                              lambda row: row.id)
+    with profiling.timed('serialize'):
+        items_serialized = [serialize_item(i) for i in items_page]
+        response = json_response({'items': items_serialized,
+                                  'next': items_page.next_cursor,
+                                  'prev': items_page.prev_cursor})
+    response.set_etag(etag)
+    return response
+
+
+@app.route('/items/JSON/export/')
+def items_json_export():
+    """
+    Streams every item in the database as one JSON document, or as NDJSON
+    with ?format=ndjson. Memory use stays flat regardless of the table size.
+
+    :return: a streamed response.
+    """
+    db_session = DBSession.session_factory()
+    if reads_from_replica():
+        db_session.use_replica()
+    rows = item_rows(db_session).order_by(Item.id)
+    return export_response('items', rows, serialize_item, db_session)
+
+
+@app.route('/items/search/')
+def items_search():
+    """
+    Shows the items matching ?q=, best matches first, optionally restricted
+    to the catalog given by ?catalog_id=.
+
+    :return: the appropriate template.
+    """
+    q, items_page = current_search()
+    items_page.rows = [to_card(row) for row in items_page.rows]
+    return render_template('items/search.html', tuple=items_page,
+                           page=items_page, q=q)
+
+
+@app.route('/items/search/JSON/')
+def items_search_json():
+    """
+    JSON endpoint for item search (@see items_search).
+
+    :return: JSON string containing the matching items' serialized values
+    (@see serializers.py)
+    """
+    q, items_page = current_search()
+    with profiling.timed('serialize'):
+        items_serialized = [serialize_card(i) for i in items_page]
+        return json_response({'items': items_serialized,
+                              'next': items_page.next_cursor})
 
 
 @app.route('/items/new/')
@@ -289,7 +442,6 @@ def new_item():
 
     db_session = DBSession()
     catalogs_all = db_session.query(Catalog).all()
-    db_session.close()
     return render_template('items/new.html', catalogs=catalogs_all)
 
 
@@ -308,68 +460,70 @@ def id_item(item_id):
     :return: the appropriate template.
     """
     db_session = DBSession()
-    item = db_session.query(Item).filter_by(id=item_id).one()
 
     if request.method == "GET":
-        item_tuple = db_session.query(Catalog, Item, User).join(Item.catalog) \
-            .join(Item.user).filter(Item.id == item_id).one()
+        item_tuple = cache.get_or_set(item_key(item_id), lambda: to_card(
+            card_rows(db_session).filter(Item.id == item_id).one()))
+        item = item_tuple[1]
+
+        etag = html_etag(item_tuple)
+        if etag and etag_matches(etag):
+            return not_modified(etag)
 
         if is_signed_in():
-            email = session['idinfo']['email']
-            user = db_session.query(User).filter_by(email=email).one()
-            display_actions = (item.user_id == user.id)
+            display_actions = (item.user_id == current_user_id())
         else:
             display_actions = False
-        db_session.close()
 
-        state = get_csrf_token()
+        state = get_csrf_token() if display_actions else ''
         description = item.description.split("\n")
 
-        return render_template('items/show.html', catalog=item_tuple[0],
-                               item=item_tuple[1],
-                               user=item_tuple[2],
-                               display_actions=display_actions,
-                               state=state,
-                               description=description)
+        response = make_response(render_template(
+            'items/show.html', catalog=item_tuple[0], item=item_tuple[1],
+            user=item_tuple[2], display_actions=display_actions, state=state,
+            description=description))
+        if etag:
+            response.set_etag(etag)
+        return response
 
     elif request.method == "PUT":
+        item = db_session.query(Item).filter_by(id=item_id).one()
         if not valid_state():
-            return json.dumps({'success': False}), 401, {
-                'ContentType': 'application/json'}
+            return json_response({'success': False}, 401)
 
         if not is_authorized_item(item_id):
             flash(NOT_AUTHORIZED)
-            return json.dumps({'success': False}), 403, {
-                'ContentType': 'application/json'}
+            return json_response({'success': False}, 403)
 
         new_name = request.form['name']
         new_desc = request.form['description']
         new_catalog_id = request.form['catalog_id']
+        old_catalog_id = item.catalog_id
         item.name = new_name
         item.description = new_desc
         item.catalog_id = new_catalog_id
         db_session.add(item)
-        db_session.commit()
-        db_session.close()
-        return json.dumps({'success': True}), 200, {
-            'ContentType': 'application/json'}
+        if not commit_write(db_session):
+            return json_response({'success': False}, 409)
+        invalidate_item(item_id, [old_catalog_id, new_catalog_id])
+        return json_response({'success': True}, 200)
 
     elif request.method == "DELETE":
+        item = db_session.query(Item).filter_by(id=item_id).one()
         if not valid_state():
-            return json.dumps({'success': False}), 401, {
-                'ContentType': 'application/json'}
+            return json_response({'success': False}, 401)
 
         if not is_authorized_item(item_id):
             flash(NOT_AUTHORIZED)
-            return json.dumps({'success': False}), 403, {
-                'ContentType': 'application/json'}
+            return json_response({'success': False}, 403)
 
+        catalog_id = item.catalog_id
         db_session.delete(item)
-        db_session.commit()
-        db_session.close()
+        if not commit_write(db_session):
+            return json_response({'success': False}, 409)
+        invalidate_item(item_id, [catalog_id])
         flash(ITEM_DELETED)
-        return json.dumps({'success': True}), 200, {
-            'ContentType': 'application/json'}
+        return json_response({'success': True}, 200)
 
 
 @app.route('/items/<int:item_id>/JSON/')
@@ -379,13 +533,21 @@ def id_item_json(item_id):
 
     :param item_id: The ID of the particular item.
 
-    :return: JSON string containing item's serialized value (@see models.py)
+    :return: JSON string containing item's serialized value
+    (@see serializers.py)
     """
     db_session = DBSession()
-    item = db_session.query(Item).filter(Item.id == item_id).one()
-    item_serialized = [item.serialize]
-    db_session.close()
-    return jsonify(item=item_serialized)
+    etag = make_etag(build_id, item_version_rows(db_session).filter(
+        Item.id == item_id).one())
+    if etag_matches(etag):
+        return not_modified(etag)
+
+    item = item_rows(db_session).filter(Item.id == item_id).one()
+    with profiling.timed('serialize'):
+        item_serialized = [serialize_item(item)]
+        response = json_response({'item': item_serialized})
+    response.set_etag(etag)
+    return response
 
 
 @app.route('/items/<int:item_id>/edit/')
@@ -410,12 +572,109 @@ def edit_item(item_id):
     item = db_session.query(Item).filter_by(id=item_id).one()
     catalogs_all = db_session.query(Catalog).all()
     state = get_csrf_token()
-    session['state'] = state
-    db_session.close()
     return render_template('items/edit.html', item=item, state=state,
                            catalogs=catalogs_all)
 
 
+# =========Batch=============
+@app.route('/batch/JSON/', methods=['POST'])
+def batch_json():
+    """
+    Creates, updates and deletes any number of items and catalogs at once
+    (@see batch.py). The body is a JSON document {"state": <CSRF token>,
+    "operations": [...]}. All operations are authorized up front and applied
+    in one transaction, or none is.
+
+    :return: JSON with "success" and one result per operation, in order.
+    """
+    if not is_signed_in():
+        return json_response({'success': False}, 401)
+
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or \
+            not isinstance(payload.get('operations'), list):
+        return json_response({'success': False}, 400)
+    if not valid_state(str(payload.get('state', ''))):
+        return json_response({'success': False}, 401)
+    if len(payload['operations']) > app.config['BATCH_MAX_OPERATIONS']:
+        return json_response({'success': False}, 413)
+
+    db_session = DBSession()
+    results, changes = batch.apply(db_session.connection(), current_user_id(),
+                                   payload['operations'])
+    if changes is None:
+        db_session.rollback()
+        return json_response({'success': False, 'results': results}, 400)
+    if not commit_write(db_session):
+        return json_response({'success': False}, 409)
+    invalidate_batch(changes)
+    return json_response({'success': True, 'results': results}, 200)
+
+
+# =========Jobs=============
+@app.route('/jobs/<int:job_id>/JSON/')
+def job_json(job_id):
+    """
+    JSON endpoint for the status of a background job (@see jobs.py), for the
+    user who caused it.
+
+    :param job_id: the id of the job.
+
+    :return: JSON string containing the job's status.
+    """
+    if not is_signed_in():
+        return json_response({'success': False}, 401)
+    db_session = DBSession()
+    with db_session.using_primary():
+        job = db_session.query(Job).filter_by(id=job_id).first()
+    if job is None or job.user_id != current_user_id():
+        return json_response({'success': False}, 404)
+    return json_response({'job': jobs.describe(job)})
+
+
+def job_accepted(job):
+    """
+    :param job: the Job the request was turned into.
+
+    :return: a 202 response pointing at the job's status.
+    """
+    url = url_for('job_json', job_id=job.id)
+    response = json_response({'success': True, 'job': url}, 202)
+    response.headers['Location'] = url
+    return response
+
+
+@jobs.handler('delete_catalog', concurrency=1)
+def delete_catalog_job(payload, progress):
+    """
+    Deletes a catalog too large to delete within a request, in chunks
+    (@see bulk.delete_catalog). One at a time, so that large deletes do not
+    compete for locks.
+    """
+    catalog_id = payload['catalog_id']
+    deleted = delete_catalog(get_engine(), catalog_id, on_chunk=lambda done:
+                             progress({'items_deleted': done}))
+    invalidate_deleted_catalog(catalog_id)
+    return {'items_deleted': deleted}
+
+
+@jobs.handler('import', concurrency=1)
+def import_job(payload, progress):
+    """
+    Imports a file the worker can read (@see bulk.import_records).
+    """
+    catalog_ids = set()
+    try:
+        with open(payload['path'], newline='') as stream:
+            imported = import_records(
+                get_engine(), read_records(stream, payload['format']),
+                payload['kind'], payload['batch_size'], on_batch=lambda done:
+                progress({'imported': done}), catalog_ids=catalog_ids)
+    finally:
+        invalidate_import(payload['kind'], catalog_ids)
+    return {'imported': imported}
+
+
 # =========Login=============
 @app.route('/login/', methods=["GET", "POST", "DELETE"])
 def login():
@@ -428,38 +687,27 @@ def login():
     """
     if request.method == "GET":
         state = get_csrf_token()
-        session['state'] = state
         return render_template('login/new.html', state=state)
 
     if request.method == "POST":
         if not valid_state():
-            return json.dumps({'success': False}), 401, {
-                'ContentType': 'application/json'}
+            return json_response({'success': False}, 401)
 
         token = request.form['token']
-        client_id = \
-            json.loads(open('../secrets/app_secrets.json', 'r').read())['web'][
-                'google']["client_id"]
         try:
-            idinfo = id_token.verify_oauth2_token(token, requests.Request(),
-                                                  client_id)
-            session['idinfo'] = idinfo
-            if idinfo['iss'] not in ['accounts.google.com',
-                                     'https://accounts.google.com']:
-                raise ValueError('Wrong issuer.')
+            session['idinfo'] = oauth.verify_token(
+                token, app.config['GOOGLE_CLIENT_ID'], cert_cache)
         except ValueError:
             print("Raised error")
-            session.pop('idinfo')
-            return json.dumps({'success': False}), 401, {
-                'ContentType': 'application/json'}
-        create_user()
-        return json.dumps({'success': True}), 200, {
-            'ContentType': 'application/json'}
+            session.pop('idinfo', None)
+            return json_response({'success': False}, 401)
+        session['user_id'] = create_user()
+        return json_response({'success': True}, 200)
 
     elif request.method == "DELETE":
         session.pop("idinfo")
-        return json.dumps({'success': True}), 200, {
-            'ContentType': 'application/json'}
+        session.pop("user_id", None)
+        return json_response({'success': True}, 200)
 
 
 def is_signed_in():
@@ -486,13 +734,7 @@ def is_authorized_catalog(catalog_id):
     :return: True if the current user if authorized to use privileged actions
     on the particular catalog, False otherwise.
     """
-    email = session['idinfo']['email']
-    db_session = DBSession()
-    user = db_session.query(User).filter_by(email=email).one()
-    catalog = db_session.query(Catalog).filter_by(id=catalog_id).one()
-    user_catalogs = user.catalogs
-    db_session.close()
-    return catalog in user_catalogs
+    return is_owner(Catalog, catalog_id)
 
 
 def is_authorized_item(item_id):
@@ -506,52 +748,690 @@ def is_authorized_item(item_id):
     :return: True if the current user if authorized to use privileged actions
     on the particular item, False otherwise.
     """
-    email = session['idinfo']['email']
+    return is_owner(Item, item_id)
+
+
+def is_owner(model, row_id):
+    """
+    Checks if the current user owns a particular catalog or item. If the
+    handler has already loaded the row into the session, or its owner is in
+    the worker's owner index (@see owners.py), no query is issued at all.
+    Otherwise the owner is read with a primary key lookup and remembered.
+
+    :param model: Catalog or Item.
+    :param row_id: the id of the catalog or item.
+
+    :return: True if the row exists and belongs to the current user, False
+    otherwise.
+    """
     db_session = DBSession()
-    user = db_session.query(User).filter_by(email=email).one()
-    item = db_session.query(Item).filter_by(id=item_id).one()
-    user_items = user.items
-    db_session.close()
-    return item in user_items
+    user_id = current_user_id()
+    loaded = db_session.identity_map.get(identity_key(model, row_id))
+    if loaded is not None:
+        return loaded.user_id == user_id
+    owners.index.sync(cache.generation('owners'))
+    owner_id = owners.index.owner(model, row_id)
+    if owner_id is None:
+        with db_session.using_primary():
+            owner_id = db_session.query(model.user_id).filter(
+                model.id == row_id).scalar()
+        if owner_id is None:
+            return False
+        owners.index.remember(model, row_id, owner_id)
+    return owner_id == user_id
+
+
+# =========Pagination=============
+@app.template_global()
+def page_url(cursor):
+    """
+    The URL of another page of the current listing, keeping every other
+    argument (e.g. per_page or a search query) intact.
+
+    :param cursor: the cursor of the page to link to.
+
+    :return: the URL.
+    """
+    args = request.args.to_dict()
+    args['cursor'] = cursor
+    args.update(request.view_args)
+    return url_for(request.endpoint, **args)
+
+
+def current_page(query, column, key):
+    """
+    Paginates a query according to the "cursor" and "per_page" arguments of
+    the current request (@see pagination.py).
+
+    :param query: the query to paginate.
+    :param column: the unique, indexed column to paginate on.
+    :param key: a function that extracts the column's value from a row.
+
+    :return: the requested Page.
+    """
+    per_page = page_size(request.args.get('per_page'),
+                         app.config['PAGE_SIZE'], app.config['MAX_PAGE_SIZE'])
+    return paginate(query, column, key, cursor=request.args.get('cursor'),
+                    per_page=per_page)
+
+
+# =========Rendering=============
+URL_PLACEHOLDER = 2147483647
+_url_shapes = {}
+
+
+@app.template_global()
+def url_path(endpoint, value):
+    """
+    A cheap url_for for the views that take a single argument, e.g.
+    url_path('id_item', 4) == url_for('id_item', item_id=4). url_for runs
+    once per endpoint (and script root) to find the shape of the URL; every
+    later call is a string concatenation, which matters on listings that
+    link to thousands of rows.
+
+    :param endpoint: the view, which must take exactly one argument.
+    :param value: the argument, usually an id.
+
+    :return: the URL.
+    """
+    key = (request.script_root, endpoint)
+    shape = _url_shapes.get(key)
+    if shape is None:
+        argument, = next(app.url_map.iter_rules(endpoint)).arguments
+        shape = url_for(endpoint, **{argument: URL_PLACEHOLDER}).split(
+            str(URL_PLACEHOLDER), 1)
+        _url_shapes[key] = shape
+    return shape[0] + str(value) + shape[1]
+
+
+@app.template_global()
+def item_card(catalog, item, user):
+    """
+    Renders an item's card (views/items/card.html), cached by the versions of
+    the item and its catalog. A card only changes when one of them does, so
+    cached cards never have to be invalidated.
+
+    :param catalog: the item's CatalogView.
+    :param item: the ItemView.
+    :param user: the owner's UserView.
+
+    :return: the card's HTML.
+    """
+    key = 'card:{}:{}@{}:{}@{}'.format(request.script_root, item.id,
+                                       item.version, catalog.id,
+                                       catalog.version)
+    return Markup(fragments.get_or_set(key, lambda: str(
+        app.jinja_env.get_template('items/card.html').render(
+            catalog=catalog, item=item, user=user))))
+
+
+@app.template_global()
+def asset_url(filename):
+    """
+    :param filename: a file under views/static, e.g. img/logo.png.
+
+    :return: the URL of its fingerprinted copy if the assets were built
+    (@see assets.py), or of the original otherwise.
+    """
+    built = asset_manifest['files'].get(filename)
+    if built is None:
+        return url_for('static', filename=filename)
+    return url_for('static_dist', filename=built)
+
+
+@app.template_global()
+def bundle_urls(bundle):
+    """
+    :param bundle: a bundle of assets.BUNDLES, e.g. css/site.css.
+
+    :return: the URL of the built bundle, or the URLs of its members if the
+    assets were not built.
+    """
+    if bundle in asset_manifest['files']:
+        return [asset_url(bundle)]
+    return [url_for('static', filename=member)
+            for member in assets.BUNDLES[bundle]]
+
+
+@app.template_global()
+def asset_srcset(filename):
+    """
+    :param filename: an image under views/static.
+
+    :return: a srcset of its WebP thumbnails, empty if there are none.
+    """
+    return ', '.join('{} {}w'.format(url_for('static_dist', filename=name),
+                                     width)
+                     for width, name in asset_manifest['webp'].get(filename,
+                                                                   []))
+
+
+@app.route('/static/dist/<path:filename>')
+def static_dist(filename):
+    """
+    Serves the built assets (@see assets.py). Their names change with their
+    content, so they are cached for good, and the precompressed copies are
+    sent to clients that accept them.
+
+    :param filename: the built file's name.
+
+    :return: the file.
+    """
+    dist = os.path.join(app.static_folder, assets.DIST)
+    response = None
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[encoding] and os.path.isfile(
+                safe_join(dist, filename + suffix)):
+            response = send_from_directory(
+                dist, filename + suffix,
+                mimetype=mimetypes.guess_type(filename)[0])
+            response.headers['Content-Encoding'] = encoding
+            break
+    if response is None:
+        response = send_from_directory(dist, filename)
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = 'public, max-age={}, immutable' \
+        .format(app.config['ASSET_MAX_AGE'])
+    return response
+
+
+def configure_templates():
+    """
+    With TEMPLATE_CACHE_DIR set, compiled templates are kept on disk and
+    reused by later workers instead of being compiled again. With
+    PRECOMPILE_TEMPLATES, every template is compiled at startup rather than
+    by the first request that needs it.
+    """
+    cache_dir = app.config['TEMPLATE_CACHE_DIR']
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    if app.config['PRECOMPILE_TEMPLATES']:
+        for name in app.jinja_env.list_templates(extensions=['html']):
+            app.jinja_env.get_template(name)
+
+
+# =========Caching=============
+# Cached reads (@see cache.py) hold plain view tuples rather than ORM
+# objects. Keys embed the generation of every group they depend on:
+#   "items":      any item write, and catalog renames and deletions
+#   "catalogs":   any catalog write
+#   "catalog:ID": writes to the catalog, or to any item in it
+def page_key(*groups):
+    """
+    Builds the cache key for the page of a listing the current request asked
+    for.
+
+    :param groups: the invalidation groups the listing depends on.
+
+    :return: the cache key.
+    """
+    parts = ['{}@{}'.format(group, cache.generation(group))
+             for group in groups]
+    per_page = page_size(request.args.get('per_page'),
+                         app.config['PAGE_SIZE'], app.config['MAX_PAGE_SIZE'])
+    parts.append('{}/{}'.format(request.args.get('cursor', ''), per_page))
+    return ':'.join(parts)
+
+
+def item_key(item_id):
+    """
+    :param item_id: the id of the item.
+
+    :return: the cache key of an item's page. It embeds the "catalogs"
+    generation, since the page shows the name of the item's catalog.
+    """
+    return 'item:{}:catalogs@{}'.format(item_id, cache.generation('catalogs'))
+
+
+def load_items_page():
+    db_session = DBSession()
+    items_page = current_page(card_rows(db_session), Item.id,
+                              lambda row: row.id)
+    items_page.rows = [to_card(row) for row in items_page.rows]
+    return items_page, estimate_count(db_session, Item)
+
+
+def load_catalogs_page():
+    db_session = DBSession()
+    catalogs_page = current_page(catalog_card_rows(db_session), Catalog.id,
+                                 lambda row: row.id)
+    catalogs_page.rows = [to_catalog_card(row) for row in catalogs_page.rows]
+    return catalogs_page, estimate_count(db_session, Catalog)
+
+
+def load_catalog_page(catalog_id):
+    db_session = DBSession()
+    catalog_row = catalog_card_rows(db_session).add_columns(
+        Catalog.item_count).filter(Catalog.id == catalog_id).one()
+    catalog = to_catalog_card(catalog_row)[0]
+    catalog_items = card_rows(db_session).filter(
+        Item.catalog_id == catalog_id)
+    catalog_count = catalog_row.item_count
+    catalog_page = current_page(catalog_items, Item.id, lambda row: row.id)
+    catalog_page.rows = [to_card(row) for row in catalog_page.rows]
+    return catalog, catalog_page, catalog_count
+
+
+def invalidate_catalog(catalog_id):
+    """
+    Invalidates everything that shows a catalog, after it was renamed or
+    deleted.
+
+    :param catalog_id: the id of the catalog.
+    """
+    cache.invalidate('catalogs', 'items', 'catalog:{}'.format(catalog_id))
+
+
+def invalidate_deleted_catalog(catalog_id):
+    """
+    Invalidates everything that showed a deleted catalog or its items, which
+    were deleted without the ORM events that usually drop them from the
+    search and owner indexes. May run outside the web workers (@see
+    delete_catalog_job), so the owner indexes are reset through the cache's
+    "owners" generation (@see owners.py).
+
+    :param catalog_id: the id of the catalog.
+    """
+    invalidate_catalog(catalog_id)
+    cache.invalidate('owners')
+    invalidate_index()
+    owners.index.clear()
+
+
+def invalidate_item(item_id, catalog_ids):
+    """
+    Invalidates everything that shows an item, after it was created, updated
+    or deleted.
+
+    :param item_id: the id of the item, or None for a new item.
+    :param catalog_ids: the catalogs the item was in before and after the
+    write.
+    """
+    if item_id is not None:
+        cache.delete(item_key(item_id))
+    cache.invalidate('items', *['catalog:{}'.format(catalog_id)
+                                for catalog_id in set(map(int, catalog_ids))])
+
+
+def invalidate_import(kind, catalog_ids):
+    """
+    Invalidates everything an import (@see bulk.import_records) may have
+    changed, also after it failed part way: its batches are committed one by
+    one.
+
+    :param kind: "items" or "catalogs".
+    :param catalog_ids: the ids of the catalogs items were imported into.
+    """
+    if kind == 'catalogs':
+        cache.invalidate('catalogs')
+        return
+    cache.invalidate('catalogs', 'items', *['catalog:{}'.format(catalog_id)
+                                            for catalog_id in catalog_ids])
+    invalidate_index()
+
+
+def invalidate_batch(changes):
+    """
+    Invalidates everything a batch of writes touched (@see batch.apply).
+
+    :param changes: the changes the batch reported.
+    """
+    for item_id in changes['items']:
+        cache.delete(item_key(item_id))
+    groups = ['items'] + ['catalog:{}'.format(catalog_id)
+                          for catalog_id in changes['catalogs']]
+    if changes['catalogs_written']:
+        groups.append('catalogs')
+    cache.invalidate(*groups)
+    if changes['items']:
+        invalidate_index()
+    owners.index.forget(Item, changes['items'])
+    owners.index.forget(Catalog, changes['catalogs'])
+
+
+@app.route('/cache/JSON/')
+def cache_json():
+    """
+    JSON endpoint for the caches' hit and miss counters (of this worker).
+
+    :return: JSON string containing the counters (@see require_ops).
+    """
+    require_ops()
+    return json_response({'cache': cache.stats(),
+                          'fragments': fragments.stats(),
+                          'owners': owners.index.stats()})
+
+
+# =========Conditional requests=============
+def make_etag(*parts):
+    """
+    Hashes the ids and versions a response is built from into a strong ETag.
+    A response's body changes only when one of those does, so clients can be
+    answered with a 304 before the body is ever materialized or serialized.
+
+    :param parts: the ids, versions and cursors the response depends on.
+
+    :return: the ETag.
+    """
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def page_etag(query, column):
+    """
+    Computes the ETag of the page of a JSON listing the current request asks
+    for, by paginating a query over (id, version) columns only. The build is
+    part of it too (@see create_app).
+
+    :param query: a query whose first column is the key column, followed by
+    the versions the page's body depends on.
+    :param column: the key column.
+
+    :return: the ETag.
+    """
+    page = current_page(query, column, lambda row: row[0])
+    return make_etag(build_id, [tuple(row) for row in page.rows],
+                     page.next_cursor, page.prev_cursor)
+
+
+def html_etag(*parts):
+    """
+    Like make_etag, but for HTML pages, and also depending on the build like
+    page_etag. Those are personalized for signed in users (and whenever a
+    message was flashed), so an ETag is only issued to anonymous visitors.
+
+    :param parts: the (cached) view data the page is rendered from.
+
+    :return: the ETag, or None if the page must not be revalidated.
+    """
+    if is_signed_in() or session.get('_flashes'):
+        return None
+    return make_etag(build_id, *parts)
+
+
+def etag_matches(etag):
+    """
+    :param etag: the ETag of the response the current request would get.
+
+    :return: True if the client already has it, plain or compressed
+    (@see compression.py).
+    """
+    return any(request.if_none_match.contains(tag)
+               for tag in variant_etags(etag))
+
+
+def variant_etags(etag):
+    return [etag] + [compression.variant_etag(etag, encoding)
+                     for encoding in compression.encodings()]
+
+
+def not_modified(etag):
+    """
+    :param etag: the plain ETag of the response.
+
+    :return: a 304 carrying the ETag of the representation the client has.
+    """
+    response = Response(status=304)
+    response.set_etag(next((tag for tag in variant_etags(etag)
+                            if request.if_none_match.contains(tag)), etag))
+    return response
+
+
+@app.after_request
+def vary_on_cookie(response):
+    """
+    Pages differ between signed in and anonymous users, which caches must not
+    mix up. Static files are the same for everyone.
+    """
+    if request.endpoint not in ('static', 'static_dist'):
+        response.vary.add('Cookie')
+    return response
+
+
+# =========Responses=============
+def commit_write(db_session):
+    """
+    Commits an update or delete of versioned rows (@see models.py). If
+    another transaction wrote one of them since it was loaded, the flush
+    fails its version check, and the write is rolled back instead.
+
+    :param db_session: the session holding the write.
+
+    :return: True if committed, False on such a conflict (answer 409).
+    """
+    try:
+        db_session.commit()
+    except StaleDataError:
+        db_session.rollback()
+        return False
+    return True
+
+
+def json_response(payload, status=200):
+    """
+    Encodes payload as compact JSON (@see serializers.dumps). The JSON
+    routes time building the payload as 'serialize' too, around this call.
+
+    :param payload: the document.
+    :param status: the status code.
+
+    :return: the Response.
+    """
+    with profiling.timed('serialize'):
+        body = dumps(payload)
+    return Response(body, status, mimetype='application/json')
+
+
+@app.after_request
+def compress_response(response):
+    """
+    Compresses text responses of at least COMPRESS_MIN_SIZE bytes (and every
+    streamed one) with the best encoding the client accepts
+    (@see compression.py). Files are left alone: the built assets are
+    compressed ahead of time.
+    """
+    if response.mimetype not in compression.COMPRESSIBLE or \
+            response.direct_passthrough or \
+            'Content-Encoding' in response.headers or \
+            response.status_code < 200 or response.status_code in (204, 304):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = compression.negotiate(request.accept_encodings)
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = compression.compress_stream(response.response,
+                                                        encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < app.config['COMPRESS_MIN_SIZE']:
+            return response
+        response.set_data(compression.compress(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(compression.variant_etag(etag, encoding), weak)
+    return response
+
+
+# =========Search=============
+def current_search():
+    """
+    Runs the search described by the current request's arguments
+    (@see search.py).
+
+    :return: a (query string, Page) tuple.
+    """
+    q = request.args.get('q', '').strip()
+    per_page = page_size(request.args.get('per_page'),
+                         app.config['PAGE_SIZE'], app.config['MAX_PAGE_SIZE'])
+    if not q:
+        return q, Page([], None, None, per_page)
+    return q, search_items(DBSession(), q,
+                           request.args.get('catalog_id', type=int),
+                           request.args.get('cursor'), per_page)
+
+
+# =========Metrics=============
+@app.route('/metrics')
+def metrics_endpoint():
+    """
+    Connection pool, query timing and cache metrics of this worker, in the
+    Prometheus text format (@see metrics.py).
+
+    :return: the metrics (@see require_ops).
+    """
+    require_ops()
+    return Response(metrics.render(get_engine(), cache),
+                    mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/admin/routes')
+def admin_routes():
+    """
+    Per route histograms of request duration, queries and time spent in the
+    database, templates and serialization, collected by this worker while
+    INSTRUMENT is on (@see profiling.py).
+
+    :return: the histograms in the Prometheus text format, or 404 if
+    instrumentation is off (@see require_ops).
+    """
+    if not app.config['INSTRUMENT']:
+        abort(404)
+    require_ops()
+    return Response(profiling.route_stats.render(),
+                    mimetype='text/plain; version=0.0.4')
+
+
+def require_ops():
+    """
+    Guards the operational endpoints, which expose internals: aborts with
+    404 if OPS_TOKEN is not set and with 401 unless the request carries
+    "Authorization: Bearer <OPS_TOKEN>".
+    """
+    token = app.config['OPS_TOKEN']
+    if not token:
+        abort(404)
+    scheme, _, received = request.headers.get('Authorization', '').partition(
+        ' ')
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(
+            received.strip().encode('utf-8'), token.encode('utf-8')):
+        abort(401)
+
+
+@app.before_request
+def start_profile():
+    if app.config['INSTRUMENT']:
+        profiling.start()
+
+
+@app.after_request
+def server_timing(response):
+    """
+    Records the profile of an instrumented request and reports it to the
+    client in a Server-Timing header.
+    """
+    rule = request.url_rule.rule if request.url_rule else '<unmatched>'
+    profile = profiling.finish('{} {}'.format(request.method, rule),
+                               app.config['N_PLUS_ONE_THRESHOLD'])
+    if profile is not None:
+        response.headers['Server-Timing'] = profile.server_timing()
+    return response
+
+
+@app.teardown_request
+def stop_profile(exception=None):
+    profiling.stop()
+
+
+# =========Export=============
+def export_response(key, query, serialize, db_session):
+    """
+    Builds a streamed response over a query in the format the client asked
+    for (@see serializers.py). The response outlives the request scoped
+    session, so it is given its own db_session and closes it once the last
+    row has been sent.
+
+    :param key: the name of the top level list in the JSON format.
+    :param query: the query whose rows are exported.
+    :param serialize: a function turning a row into a dict.
+    :param db_session: the session the query belongs to.
+
+    :return: the streamed Response.
+    """
+    rows = stream_rows(query, app.config['STREAM_BATCH_SIZE'])
+    if request.args.get('format') == 'ndjson':
+        response = Response(stream_ndjson(rows, serialize),
+                            mimetype='application/x-ndjson')
+    else:
+        response = Response(stream_json(key, rows, serialize),
+                            mimetype='application/json')
+    response.call_on_close(db_session.close)
+    return response
 
 
 # =========CSRF=============
 def get_csrf_token():
     """
-    Creates a CSRF token as a mixture of upper and lowercase symbols.
+    Creates a CSRF token for the current user (@see csrf.py). Nothing is
+    stored in the session, except a random nonce the first time an anonymous
+    visitor gets a token.
 
     :return: the generated token
     """
-    state = ''.join(
-        random.choice(string.ascii_uppercase + string.ascii_lowercase)
-        for _ in range(32))
-    session['state'] = state
-    return state
+    if 'user_id' not in session and 'csrf_nonce' not in session:
+        session['csrf_nonce'] = csrf.new_nonce()
+    return csrf.make_token(app.secret_key, csrf_subject())
 
 
-def valid_state():
+def valid_state(received_state=None):
     """
-    Checks if the received CSRF token matches the one in session.
+    Checks that the received CSRF token was issued by us, to the current
+    user, and has not expired.
+
+    :param received_state: the token, if not sent as the "state" form field.
 
     :return: True if the state is valid, False if there's a CSRF token
     mismatch.
     """
-    received_state = request.form['state']
-    if received_state != session['state']:
-        print("CSRF mismatch", received_state, "!=", session['state'])
+    if received_state is None:
+        received_state = request.form.get('state', '')
+    subject = csrf_subject()
+    if subject is None or not csrf.check_token(
+            received_state, app.secret_key, subject,
+            app.config['CSRF_TOKEN_MAX_AGE']):
+        print("CSRF mismatch", received_state)
         return False
     return True
 
 
+def csrf_subject():
+    """
+    :return: whom CSRF tokens are bound to: the signed in user or, for
+    anonymous visitors (i.e. on the login page), the random nonce in their
+    session. None for a visitor who was never given a token.
+    """
+    if 'user_id' in session:
+        return str(session['user_id'])
+    if 'csrf_nonce' in session:
+        return 'anonymous:' + session['csrf_nonce']
+    return None
+
+
 # =========Users=============
 def create_user():
     """
     Creates a new User if one doesn't exist yet. Lookup is performed against
-    User.email, an indexed column.
+    the owner index (@see owners.py), then User.email, an indexed column.
 
-    :return: None
+    :return: the id of the (possibly new) user.
     """
     email = session['idinfo']['email']
+    user_id = owners.index.user_id(email)
+    if user_id is not None:
+        return user_id
+
     db_session = DBSession()
     user = db_session.query(User).filter_by(email=email).first()
 
@@ -560,13 +1440,109 @@ def create_user():
         db_session.add(user)
         db_session.commit()
 
-    db_session.close()
+    owners.index.remember_user(email, user.id)
+    return user.id
+
+
+def current_user_id():
+    """
+    The id of the signed in user. It is kept in the signed session cookie,
+    so resolving it normally costs no query at all; sessions created before
+    the id was stored fall back to a lookup by email once.
+
+    :return: the current user's id.
+    """
+    if 'user_id' not in session:
+        email = session['idinfo']['email']
+        user_id = owners.index.user_id(email)
+        if user_id is None:
+            user_id = DBSession().query(User.id).filter_by(
+                email=email).one()[0]
+            owners.index.remember_user(email, user_id)
+        session['user_id'] = user_id
+    return session['user_id']
+
+
+@app.teardown_appcontext
+def remove_db_session(exception=None):
+    """
+    Closes the request scoped session (@see DBSession) at the end of every
+    request.
+    """
+    DBSession.remove()
+
+
+# =========Read replicas=============
+def reads_from_replica():
+    """
+    Whether the current request may read from a replica (@see database.py):
+    it must be a GET (or HEAD), and the user must not have written anything
+    in the last REPLICA_STICKY_SECONDS, so they always see their own writes.
+
+    :return: True if the request can go to a replica.
+    """
+    if not READ_REPLICA_URLS or request.method not in ('GET', 'HEAD'):
+        return False
+    written_at = session.get('written_at', 0)
+    return time.time() - written_at > app.config['REPLICA_STICKY_SECONDS']
+
 
+@app.before_request
+def route_reads():
+    if reads_from_replica():
+        DBSession().use_replica()
 
-secret_key = \
-    json.loads(open('../secrets/app_secrets.json', 'r').read())['app'][
-        'secret']
-app.secret_key = secret_key
+
+@app.after_request
+def remember_write(response):
+    """
+    Records when a signed in user last wrote, for reads_from_replica.
+    """
+    if READ_REPLICA_URLS and request.method not in ('GET', 'HEAD', 'OPTIONS') \
+            and response.status_code < 400 and is_signed_in():
+        session['written_at'] = time.time()
+    return response
+
+
+# =========Application=============
+def create_app(config=None):
+    """
+    Configures the application and returns it. Nothing here touches the
+    database: the engine is created lazily by the first query
+    (@see database.py) and the schema is managed by "flask katalog migrate"
+    (@see migrations.py). The secrets are read here, once, rather than on
+    every login.
+
+    :param config: settings overriding the ones read from the environment.
+
+    :return: the Flask app.
+    """
+    global cache, fragments, asset_manifest, build_id, cert_cache
+    if config:
+        app.config.update(config)
+    owners.index = owners.OwnerIndex(app.config['OWNER_INDEX_MAX_ENTRIES'])
+    if app.config['INSTRUMENT']:
+        app.jinja_env.template_class = profiling.TimedTemplate
+    cache = make_cache(app.config['CACHE_BACKEND'], app.config['CACHE_TTL'],
+                       app.config['CACHE_MAX_ENTRIES'])
+    fragments = make_cache(app.config['CACHE_BACKEND'],
+                           app.config['CACHE_TTL'],
+                           app.config['FRAGMENT_CACHE_MAX_ENTRIES'])
+    asset_manifest = assets.load_manifest(app.static_folder)
+    # Pages link the built assets and bodies depend on the code, so a deploy
+    # or an asset build must not be answered with a 304.
+    build_id = make_etag(app.config['APP_VERSION'], asset_manifest)
+    configure_templates()
+    if not app.secret_key or not app.config.get('GOOGLE_CLIENT_ID'):
+        app_secrets = oauth.load_secrets(app.config['SECRETS_PATH'])
+        app.secret_key = app.secret_key or app_secrets['app']['secret']
+        app.config.setdefault('GOOGLE_CLIENT_ID',
+                              app_secrets['web']['google']['client_id'])
+    cert_cache = oauth.CertCache(app.config['GOOGLE_CERTS_URL'])
+    return app
+
+
+create_app()
 
 if __name__ == '__main__':
     app.debug = True